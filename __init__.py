@@ -1,6 +1,24 @@
+from rdcanon.rdcanon.version import __version__
 from rdcanon.rdcanon.main import canon_smarts
 from rdcanon.rdcanon.main import canon_reaction_smarts
 from rdcanon.rdcanon.main import random_smarts
 from rdcanon.rdcanon.main import debug
 from rdcanon.rdcanon.main import gen_canon_repl_dict
-from rdcanon.rdcanon.token_parser import order_token_canon
\ No newline at end of file
+from rdcanon.rdcanon.main import canon_query_mol
+from rdcanon.rdcanon.main import canon_query_reaction
+from rdcanon.rdcanon.stats import CanonStats
+from rdcanon.rdcanon.hooks import add_hook
+from rdcanon.rdcanon.hooks import remove_hook
+from rdcanon.rdcanon.hooks import ProfileHook
+from rdcanon.rdcanon.token_parser import order_token_canon
+from rdcanon.rdcanon.token_parser import canon_token
+from rdcanon.rdcanon.batch import canon_smarts_batch
+from rdcanon.rdcanon.batch import canon_reaction_smarts_batch
+from rdcanon.rdcanon.cache import CanonCache
+from rdcanon.rdcanon.keys import canon_key
+from rdcanon.rdcanon.equivalence import smarts_equivalent
+from rdcanon.rdcanon.equivalence import reaction_smarts_equivalent
+from rdcanon.rdcanon.incremental import CanonState
+from rdcanon.rdcanon.aio import AsyncCanonicalizer
+from rdcanon.rdcanon.aio import canon_smarts_async
+from rdcanon.rdcanon.aio import canon_reaction_smarts_async
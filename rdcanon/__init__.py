@@ -1,6 +1,24 @@
+from rdcanon.version import __version__
 from rdcanon.main import canon_smarts
 from rdcanon.main import canon_reaction_smarts
 from rdcanon.main import random_smarts
 from rdcanon.main import debug
 from rdcanon.main import gen_canon_repl_dict
-from rdcanon.token_parser import order_token_canon
\ No newline at end of file
+from rdcanon.main import canon_query_mol
+from rdcanon.main import canon_query_reaction
+from rdcanon.stats import CanonStats
+from rdcanon.hooks import add_hook
+from rdcanon.hooks import remove_hook
+from rdcanon.hooks import ProfileHook
+from rdcanon.token_parser import order_token_canon
+from rdcanon.token_parser import canon_token
+from rdcanon.batch import canon_smarts_batch
+from rdcanon.batch import canon_reaction_smarts_batch
+from rdcanon.cache import CanonCache
+from rdcanon.keys import canon_key
+from rdcanon.equivalence import smarts_equivalent
+from rdcanon.equivalence import reaction_smarts_equivalent
+from rdcanon.incremental import CanonState
+from rdcanon.aio import AsyncCanonicalizer
+from rdcanon.aio import canon_smarts_async
+from rdcanon.aio import canon_reaction_smarts_async
@@ -0,0 +1,204 @@
+import asyncio
+import concurrent.futures
+import functools
+import os
+from rdcanon.main import canon_smarts, canon_reaction_smarts
+from rdcanon.cache import embedding_fingerprint, repl_dict_fingerprint
+
+
+def _warm_worker():
+    canon_smarts("[C]")
+
+
+class _InFlight:
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class AsyncCanonicalizer:
+    """
+    Runs canonicalization off the event loop on a managed executor.
+
+    Concurrent requests for the same input and settings are coalesced into a single
+    computation. At most `max_concurrency` computations are submitted to the executor at
+    once; the rest wait on the event loop, where they can be cancelled cheaply. A
+    computation is cancelled when every request waiting on it has been cancelled, but one
+    that has already started in a worker runs to completion.
+
+    Args:
+        executor (str or Executor, optional): "process", "thread", or an existing
+            concurrent.futures executor (which is then not shut down by close()). Defaults to "process".
+        max_workers (int, optional): Number of workers of a created executor. Defaults to os.cpu_count().
+        max_concurrency (int, optional): Maximum number of computations in the executor. Defaults to the
+            number of workers.
+    """
+
+    def __init__(self, executor="process", max_workers=None, max_concurrency=None):
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+
+        self.owns_executor = True
+        if executor == "process":
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers, initializer=_warm_worker
+            )
+        elif executor == "thread":
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers)
+        elif isinstance(executor, concurrent.futures.Executor):
+            self.executor = executor
+            self.owns_executor = False
+        else:
+            raise ValueError("executor must be 'process', 'thread' or an Executor")
+
+        self.max_concurrency = max_concurrency if max_concurrency else max_workers
+        self.submitted = 0
+        self.coalesced = 0
+        self._loop = None
+        self._semaphore = None
+        self._inflight = {}
+
+    def _bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._inflight = {}
+
+    async def _compute(self, fn, args):
+        async with self._semaphore:
+            return await self._loop.run_in_executor(
+                self.executor, functools.partial(fn, *args)
+            )
+
+    def _forget(self, key, entry):
+        if self._inflight.get(key) is entry:
+            del self._inflight[key]
+
+    async def _run(self, key, fn, args):
+        self._bind_loop()
+
+        entry = self._inflight.get(key)
+        if entry is None:
+            entry = _InFlight(asyncio.ensure_future(self._compute(fn, args)))
+            self._inflight[key] = entry
+            entry.task.add_done_callback(lambda _: self._forget(key, entry))
+            self.submitted = self.submitted + 1
+        else:
+            self.coalesced = self.coalesced + 1
+
+        entry.waiters = entry.waiters + 1
+        try:
+            return await asyncio.shield(entry.task)
+        except asyncio.CancelledError:
+            if entry.waiters == 1 and not entry.task.done():
+                entry.task.cancel()
+                self._forget(key, entry)
+            raise
+        finally:
+            entry.waiters = entry.waiters - 1
+
+    async def canon_smarts(
+        self, smarts, mapping=False, embedding="drugbank", repl_dict={}
+    ):
+        """
+        Canonicalizes a SMARTS pattern without blocking the event loop.
+
+        Args:
+            smarts (str): The input SMARTS pattern to be canonicalized.
+            mapping (bool, optional): Whether to return the atom mapping. Defaults to False.
+            embedding (str or dict, optional): The query primitive frequency dictionary to use. Defaults to "drugbank".
+            repl_dict (dictionary, optional): A dictionary of SMARTS token replacements.
+
+        Returns:
+            str: The canonicalized SMARTS pattern.
+        """
+        key = (
+            "smarts",
+            smarts,
+            bool(mapping),
+            embedding_fingerprint(embedding),
+            repl_dict_fingerprint(repl_dict),
+        )
+        return await self._run(
+            key, canon_smarts, (smarts, mapping, embedding, False, False, repl_dict)
+        )
+
+    async def canon_reaction_smarts(
+        self, smarts, mapping=False, embedding="drugbank", remapping=False, repl_dict={}
+    ):
+        """
+        Canonicalizes a reaction SMARTS string without blocking the event loop.
+
+        Args:
+            smarts (str): The reaction SMARTS string to be canonicalized.
+            mapping (bool, optional): Whether to include atom mapping in the canonicalization. Defaults to False.
+            embedding (str or dict, optional): The embedding to use for the canonicalization. Defaults to "drugbank".
+            remapping (bool, optional): Whether to remap atom indices after canonicalization. Defaults to False.
+            repl_dict (dictionary, optional): A dictionary of SMARTS token replacements.
+
+        Returns:
+            str: The canonicalized reaction SMARTS string.
+        """
+        if remapping:
+            mapping = True
+        key = (
+            "reaction",
+            smarts,
+            bool(mapping),
+            embedding_fingerprint(embedding),
+            bool(remapping),
+            repl_dict_fingerprint(repl_dict),
+        )
+        return await self._run(
+            key,
+            canon_reaction_smarts,
+            (smarts, mapping, embedding, remapping, repl_dict),
+        )
+
+    def close(self):
+        for entry in list(self._inflight.values()):
+            entry.task.cancel()
+        self._inflight = {}
+        if self.owns_executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+_default = None
+
+
+def _get_default():
+    global _default
+    if _default is None:
+        _default = AsyncCanonicalizer()
+    return _default
+
+
+async def canon_smarts_async(
+    smarts, mapping=False, embedding="drugbank", repl_dict={}
+):
+    """
+    Canonicalizes a SMARTS pattern on a shared process pool without blocking the event loop.
+
+    See AsyncCanonicalizer.canon_smarts.
+    """
+    return await _get_default().canon_smarts(smarts, mapping, embedding, repl_dict)
+
+
+async def canon_reaction_smarts_async(
+    smarts, mapping=False, embedding="drugbank", remapping=False, repl_dict={}
+):
+    """
+    Canonicalizes a reaction SMARTS string on a shared process pool without blocking the event loop.
+
+    See AsyncCanonicalizer.canon_reaction_smarts.
+    """
+    return await _get_default().canon_reaction_smarts(
+        smarts, mapping, embedding, remapping, repl_dict
+    )
@@ -0,0 +1,851 @@
+import os
+import re
+import socket
+import threading
+import time
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing.connection import wait
+from rdkit import Chem
+from rdkit.Chem import AllChem
+from rdcanon.main import canon_smarts, canon_reaction_smarts
+from rdcanon.token_parser import (
+    canon_token,
+    token_cache,
+    shared_token_tables,
+    shared_token_key,
+)
+from rdcanon.shared import SharedTable
+
+_worker_config = {}
+
+
+def _attach_token_table(name):
+    for table in shared_token_tables:
+        table.close()
+    shared_token_tables[:] = [SharedTable.attach(name)]
+
+
+def _init_worker(config):
+    _worker_config.update(config)
+    if config.get("token_table"):
+        _attach_token_table(config["token_table"])
+
+    # the grammar is built on import; canonicalizing a single atom also
+    # resolves the embedding so the first real item does not pay for it
+    canon_smarts("[C]", embedding=config["embedding"])
+
+
+def _canon_item(smarts, cfg):
+    try:
+        if cfg["kind"] == "token":
+            out = canon_token(smarts, None, cfg["embedding"])
+        elif cfg["kind"] == "reaction":
+            out = canon_reaction_smarts(
+                smarts,
+                cfg["mapping"],
+                cfg["embedding"],
+                cfg["remapping"],
+                repl_dict=cfg["repl_dict"],
+            )
+        else:
+            out = canon_smarts(
+                smarts,
+                cfg["mapping"],
+                cfg["embedding"],
+                repl_dict=cfg["repl_dict"],
+            )
+        return out, None
+    except Exception as e:
+        return None, type(e).__name__ + ": " + str(e)
+
+
+def _worker_main(conn, config):
+    _init_worker(config)
+    conn.send(None)
+
+    # results are sent one item at a time, so the supervisor always knows
+    # which item a worker is on when it hangs or dies
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            break
+        if msg is None:
+            break
+        if msg[0] == "seed":
+            token_cache.update(msg[1])
+            continue
+        if msg[0] == "attach":
+            _attach_token_table(msg[1])
+            continue
+        _, chunk, options = msg
+        cfg = dict(_worker_config, **options) if options else _worker_config
+        for smarts in chunk:
+            conn.send(_canon_item(smarts, cfg))
+
+    for table in shared_token_tables:
+        table.close()
+
+
+def _matching(s, i, open_char, close_char):
+    depth = 0
+    for j in range(i, len(s)):
+        if s[j] == open_char:
+            depth = depth + 1
+        elif s[j] == close_char:
+            depth = depth - 1
+            if depth == 0:
+                return j
+    return len(s) - 1
+
+
+def estimate_cost(smarts):
+    """
+    Returns a cheap lexical estimate of the time needed to canonicalize a SMARTS pattern.
+
+    The estimate grows with the string length, the number of atoms, ring closures and
+    repeated atom tokens (which cause ties in the path search), and every recursive SMARTS,
+    whose body is canonicalized on its own. It is only meant for ordering work: it ranks
+    inputs roughly by their canonicalization time and is not a time in any unit.
+
+    Args:
+        smarts (str): A SMARTS pattern or reaction SMARTS string.
+
+    Returns:
+        float: The estimated relative cost.
+    """
+    atoms = 0
+    ring_bonds = 0
+    tokens = []
+    recursive = []
+
+    i = 0
+    while i < len(smarts):
+        c = smarts[i]
+        if c == "[":
+            j = _matching(smarts, i, "[", "]")
+            token = smarts[i : j + 1]
+            k = token.find("$(")
+            while k != -1:
+                end = _matching(token, k + 1, "(", ")")
+                recursive.append(token[k + 2 : end])
+                k = token.find("$(", end)
+            atoms = atoms + 1
+            tokens.append(re.sub(r":\d+\]$", "]", token))
+            i = j + 1
+            continue
+        if smarts[i : i + 2] in ("Cl", "Br"):
+            atoms = atoms + 1
+            tokens.append(smarts[i : i + 2])
+            i = i + 2
+            continue
+        if c.isdigit():
+            ring_bonds = ring_bonds + 1
+        elif c == "%":
+            ring_bonds = ring_bonds + 1
+            i = i + 2
+        elif c.isalpha() or c == "*":
+            atoms = atoms + 1
+            tokens.append(c)
+        i = i + 1
+
+    ties = len(tokens) - len(set(tokens))
+    cost = len(smarts) / 4 + atoms + ring_bonds + ties
+    for body in recursive:
+        cost = cost + 4 + estimate_cost(body)
+    return cost
+
+
+def _atom_tokens(smarts, kind="smarts"):
+    # the unmapped atom tokens as Graph.graph_from_smarts sees them
+    try:
+        if kind == "reaction":
+            rxn = AllChem.ReactionFromSmarts(smarts)
+            mols = (
+                list(rxn.GetReactants())
+                + list(rxn.GetAgents())
+                + list(rxn.GetProducts())
+            )
+        else:
+            mols = [Chem.MolFromSmarts(smarts)]
+    except Exception:
+        return []
+
+    tokens = []
+    for mol in mols:
+        if mol is None:
+            continue
+        if Chem.HasQueryHs(mol)[0]:
+            mol = Chem.AdjustQueryProperties(Chem.MergeQueryHs(mol))
+        for atom in mol.GetAtoms():
+            sm = atom.GetSmarts()
+            if sm == "[H]" or sm == "[#1]":
+                continue
+            tokens.append(re.sub(r":\d+]", "]", sm))
+    return tokens
+
+
+def _chunked(iterable, chunk_size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class _Worker:
+    def __init__(self, ctx, config):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main, args=(child_conn, config), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.ready = False
+        self.broadcast = 0
+        self.task = None
+        self.started = None
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class _Task:
+    def __init__(self, chunk, options):
+        self.chunk = chunk
+        self.options = options
+        self.results = []
+        self.future = Future()
+
+
+class _SupervisedPool:
+    """
+    Worker processes watched by a supervisor thread in the parent.
+
+    Chunks are queued with submit() and handed to idle workers, which report each
+    item as it finishes. A worker that exceeds `timeout` seconds on one item is
+    killed, a worker that dies is detected by its closed pipe, and in both cases the
+    item is failed, the worker is replaced and the rest of its chunk is requeued.
+    """
+
+    def __init__(self, workers, config, timeout=None):
+        self.ctx = multiprocessing.get_context()
+        self.config = config
+        self.timeout = timeout
+        self.timeouts = 0
+        self.crashes = 0
+        self.pending = deque()
+        self.broadcasts = []
+        self.lock = threading.Lock()
+        self.closing = False
+        self.terminating = False
+        self.broken = None
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_w.setblocking(False)
+        self.workers = [_Worker(self.ctx, config) for _ in range(workers)]
+        self.thread = threading.Thread(target=self._supervise, daemon=True)
+        self.thread.start()
+
+    def submit(self, chunk, options=None):
+        """
+        Queues a chunk and returns a Future of its list of (result, error) tuples.
+        """
+        task = _Task(chunk, options)
+        with self.lock:
+            if self.broken is not None:
+                raise RuntimeError(self.broken)
+            if self.closing:
+                raise ValueError("pool is closed")
+            self.pending.append(task)
+        self._wake()
+        return task.future
+
+    def broadcast(self, msg):
+        """
+        Queues a ("seed", entries) or ("attach", table name) message that every worker,
+        including later replacements, receives before its next chunk.
+        """
+        with self.lock:
+            self.broadcasts.append(msg)
+
+    def _wake(self):
+        try:
+            self._wake_w.send(b"x")
+        except OSError:
+            # a full socket already wakes the supervisor; a closed one means it has exited
+            pass
+
+    def _assign(self, worker, task):
+        worker.task = task
+        worker.started = time.monotonic()
+        try:
+            for msg in self.broadcasts[worker.broadcast :]:
+                worker.conn.send(msg)
+            worker.broadcast = len(self.broadcasts)
+            worker.conn.send(("task", task.chunk[len(task.results) :], task.options))
+        except OSError:
+            # the worker died while idle; its pipe is reported closed on the next wait
+            worker.task = None
+            self.pending.appendleft(task)
+
+    def _record(self, worker, pair):
+        task = worker.task
+        task.results.append(pair)
+        worker.started = time.monotonic()
+        if len(task.results) == len(task.chunk):
+            task.future.set_result(task.results)
+            worker.task = None
+
+    def _replace(self, worker, error):
+        worker.kill()
+        task = worker.task
+        idx = self.workers.index(worker)
+
+        if task is None and not worker.ready:
+            # a worker that cannot start would be replaced forever
+            self.broken = "worker process failed to start: " + error
+            return
+
+        if task is not None:
+            task.results.append((None, error))
+            if len(task.results) == len(task.chunk):
+                task.future.set_result(task.results)
+            else:
+                self.pending.appendleft(task)
+        self.workers[idx] = _Worker(self.ctx, self.config)
+
+    def _fail_pending(self, error):
+        tasks = list(self.pending) + [w.task for w in self.workers if w.task]
+        self.pending.clear()
+        for task in tasks:
+            if not task.future.done():
+                task.future.set_exception(RuntimeError(error))
+
+    def _supervise(self):
+        while True:
+            with self.lock:
+                if self.broken is not None or self.terminating:
+                    self._fail_pending(self.broken or "pool was terminated")
+                    break
+                busy = [w for w in self.workers if w.task is not None]
+                if self.closing and not self.pending and not busy:
+                    break
+                for w in self.workers:
+                    if w.ready and w.task is None and self.pending:
+                        self._assign(w, self.pending.popleft())
+                busy = [w for w in self.workers if w.task is not None]
+
+            wait_for = None
+            if self.timeout is not None and busy:
+                oldest = min(w.started for w in busy)
+                wait_for = max(0.0, oldest + self.timeout - time.monotonic())
+
+            by_conn = {w.conn: w for w in self.workers}
+            ready = wait(list(by_conn) + [self._wake_r], wait_for)
+
+            with self.lock:
+                for obj in ready:
+                    if obj is self._wake_r:
+                        self._wake_r.recv(4096)
+                        continue
+                    w = by_conn[obj]
+                    try:
+                        msg = w.conn.recv()
+                    except (EOFError, OSError):
+                        self.crashes = self.crashes + 1
+                        w.process.join()
+                        self._replace(
+                            w,
+                            "WorkerCrash: worker process exited unexpectedly (exit code %s)"
+                            % w.process.exitcode,
+                        )
+                        continue
+                    if not w.ready:
+                        w.ready = True
+                    else:
+                        self._record(w, msg)
+
+                if self.timeout is not None:
+                    now = time.monotonic()
+                    for w in list(self.workers):
+                        if w.task is not None and now - w.started > self.timeout:
+                            self.timeouts = self.timeouts + 1
+                            self._replace(
+                                w,
+                                "TimeoutError: canonicalization took longer than %g s"
+                                % self.timeout,
+                            )
+
+        for w in self.workers:
+            if not self.terminating and self.broken is None:
+                try:
+                    w.conn.send(None)
+                    w.process.join(5)
+                except OSError:
+                    pass
+            w.kill()
+        self._wake_r.close()
+        self._wake_w.close()
+
+    def close(self):
+        with self.lock:
+            self.closing = True
+        self._wake()
+        self.thread.join()
+
+    def terminate(self):
+        with self.lock:
+            self.closing = True
+            self.terminating = True
+        self._wake()
+        self.thread.join()
+
+
+class CanonPool:
+    """
+    A pool of worker processes that canonicalize SMARTS or reaction SMARTS.
+
+    Every worker is initialized once with the canonicalization settings, so
+    only the input strings are sent per task. Workers are supervised: an item
+    that crashes its worker, or runs longer than `timeout`, is reported as failed
+    and the worker is replaced, so the rest of the input is unaffected. Use as a
+    context manager, or call close() when done.
+
+    Args:
+        kind (str, optional): "smarts" or "reaction". Defaults to "smarts".
+        mapping (bool, optional): Whether to return the atom mapping. Defaults to False.
+        embedding (str or dict, optional): The query primitive frequency dictionary to use. Defaults to "drugbank".
+        remapping (bool, optional): Whether to remap atom indices (reactions only). Defaults to False.
+        repl_dict (dictionary, optional): A dictionary of SMARTS token replacements.
+        workers (int, optional): Number of worker processes. Defaults to os.cpu_count(). With 1 worker
+            and no timeout, items are canonicalized in the calling process.
+        chunk_size (int, optional): Number of items sent to a worker per task. Defaults to 64.
+        cache (CanonCache, optional): A persistent cache consulted before dispatching work.
+        schedule (str, optional): How map() orders work. "cost" sends the items with the highest
+            estimate_cost first, in chunks sized so each carries a similar estimated cost; "fifo" sends
+            them in input order in chunks of `chunk_size`. imap() always streams in input order.
+            Defaults to "cost".
+        timeout (float, optional): Wall-clock limit in seconds for a single item. An item that exceeds it
+            fails with a TimeoutError message. Defaults to None (no limit).
+        prepass (bool, optional): Whether map() first canonicalizes the distinct atom tokens of its input
+            (see prepass). Defaults to False.
+        shared_memory (bool, optional): Whether to hand the token cache of this process to the workers as
+            one read-only shared memory table, which they look entries up in without copying it, instead
+            of sending each worker its own copy. Defaults to False.
+    """
+
+    def __init__(
+        self,
+        kind="smarts",
+        mapping=False,
+        embedding="drugbank",
+        remapping=False,
+        repl_dict={},
+        workers=None,
+        chunk_size=64,
+        cache=None,
+        schedule="cost",
+        timeout=None,
+        prepass=False,
+        shared_memory=False,
+    ):
+        if kind not in ("smarts", "reaction"):
+            raise ValueError("kind must be 'smarts' or 'reaction'")
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be a positive integer")
+        if schedule not in ("cost", "fifo"):
+            raise ValueError("schedule must be 'cost' or 'fifo'")
+        if timeout is not None and timeout <= 0:
+            raise ValueError("timeout must be positive")
+
+        if kind == "reaction" and remapping:
+            mapping = True
+
+        self.kind = kind
+        self.workers = workers if workers else os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.cache = cache
+        self.schedule = schedule
+        self.config = {
+            "kind": kind,
+            "mapping": mapping,
+            "embedding": embedding,
+            "remapping": remapping,
+            "repl_dict": repl_dict,
+        }
+        self.timeout = timeout
+        self.prepass_tokens = prepass
+        self.prepass_stats = None
+        self.shared_memory = shared_memory
+        self.token_tables = []
+        self.pool = None
+
+        if self.workers > 1 or timeout is not None:
+            worker_config = self.config
+            if shared_memory and type(embedding) == str:
+                worker_config = dict(self.config, token_table=self._publish_tokens())
+            self.pool = _SupervisedPool(self.workers, worker_config, timeout)
+
+    def _options(self, options):
+        for k in options:
+            if k not in ("kind", "mapping", "remapping"):
+                raise ValueError("only kind, mapping and remapping can be set per call")
+        if options.get("kind", self.kind) not in ("smarts", "reaction"):
+            raise ValueError("kind must be 'smarts' or 'reaction'")
+        options = dict(options)
+        if options.get("kind", self.kind) == "reaction" and options.get(
+            "remapping", self.config["remapping"]
+        ):
+            options["mapping"] = True
+        return options
+
+    def _submit(self, chunk, options):
+        config = dict(self.config, **options)
+        keys = None
+        hits = {}
+        todo = chunk
+        if self.cache is not None:
+            keys = [
+                self.cache.key(
+                    sm,
+                    config["kind"],
+                    config["mapping"],
+                    config["embedding"],
+                    config["remapping"],
+                    config["repl_dict"],
+                )
+                for sm in chunk
+            ]
+            hits = self.cache.get_many(keys)
+            todo = [sm for sm, k in zip(chunk, keys) if k not in hits]
+
+        if len(todo) == 0:
+            res = []
+        elif self.pool is None:
+            res = [_canon_item(sm, config) for sm in todo]
+        else:
+            res = self.pool.submit(todo, options)
+        return chunk, keys, hits, res
+
+    def _collect(self, submitted):
+        chunk, keys, hits, res = submitted
+        computed = res if type(res) == list else res.result()
+        if keys is None:
+            return computed
+
+        out = []
+        new_entries = []
+        computed = iter(computed)
+        for k in keys:
+            if k in hits:
+                out.append((hits[k], None))
+            else:
+                pair = next(computed)
+                out.append(pair)
+                if pair[1] is None:
+                    new_entries.append((k, pair[0]))
+        self.cache.put_many(new_entries)
+        return out
+
+    def imap(self, smarts, max_pending=None, **options):
+        """
+        Canonicalize an iterable of SMARTS lazily, yielding results in input order.
+
+        At most `max_pending` chunks are in flight at once, so memory stays bounded
+        for arbitrarily long inputs. With a cache, each chunk is looked up before it is
+        sent to the workers and only the misses are canonicalized.
+
+        Args:
+            smarts (iterable): The input SMARTS or reaction SMARTS strings.
+            max_pending (int, optional): Maximum number of chunks in flight. Defaults to 4 per worker.
+            **options: `kind`, `mapping` or `remapping` to use instead of the pool settings for this call.
+
+        Yields:
+            tuple: (canonical SMARTS or None, error message or None) for each input.
+        """
+        if max_pending is None:
+            max_pending = 4 * self.workers
+        options = self._options(options)
+
+        pending = deque()
+        for chunk in _chunked(smarts, self.chunk_size):
+            pending.append(self._submit(chunk, options))
+            if len(pending) >= max_pending:
+                for out in self._collect(pending.popleft()):
+                    yield out
+        while pending:
+            for out in self._collect(pending.popleft()):
+                yield out
+
+    def _cost_chunks(self, smarts):
+        costs = [estimate_cost(sm) for sm in smarts]
+        order = sorted(range(len(smarts)), key=lambda i: -costs[i])
+
+        # expensive items travel alone or in small chunks, cheap ones are packed
+        # up to chunk_size, so no single chunk dominates the tail of the run
+        target = sum(costs) / (8 * self.workers)
+        chunks = []
+        chunk = []
+        chunk_cost = 0
+        for i in order:
+            chunk.append(i)
+            chunk_cost = chunk_cost + costs[i]
+            if len(chunk) == self.chunk_size or chunk_cost >= target:
+                chunks.append(chunk)
+                chunk = []
+                chunk_cost = 0
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    def _publish_tokens(self):
+        embedding = self.config["embedding"]
+        entries = {
+            shared_token_key(emb, tok): value
+            for (emb, tok), value in token_cache.items()
+            if emb == embedding
+        }
+        # earlier tables stay alive until close(): a replacement worker attaches
+        # to every published table in turn
+        table = SharedTable.create(entries)
+        self.token_tables.append(table)
+        return table.name
+
+    def prepass(self, smarts, **options):
+        """
+        Canonicalizes every distinct atom token of a library once and seeds the token caches.
+
+        The distinct tokens are canonicalized in parallel, and the results are added to the
+        token cache of this process and of every worker, so the graph searches that follow
+        only look tokens up. Token canonicalization then scales with the vocabulary of the
+        library rather than its number of atoms. Tokens are only cached for named embeddings.
+
+        Args:
+            smarts (iterable): The input SMARTS or reaction SMARTS strings.
+            **options: `kind` to use instead of the pool setting.
+
+        Returns:
+            dict: tokens (total atom tokens), unique_tokens, and canonicalized (distinct tokens
+            that were not cached yet).
+        """
+        kind = options.get("kind", self.kind)
+        embedding = self.config["embedding"]
+
+        counts = {}
+        for sm in smarts:
+            for tok in _atom_tokens(sm, kind):
+                counts[tok] = counts.get(tok, 0) + 1
+
+        todo = []
+        if type(embedding) == str:
+            todo = [tok for tok in counts if (embedding, tok) not in token_cache]
+
+        if self.pool is None:
+            for tok in todo:
+                _canon_item(tok, {"kind": "token", "embedding": embedding})
+        elif len(todo) > 0:
+            chunks = list(_chunked(todo, self.chunk_size))
+            futs = [self.pool.submit(chunk, {"kind": "token"}) for chunk in chunks]
+            entries = {}
+            for chunk, fut in zip(chunks, futs):
+                for tok, (out, error) in zip(chunk, fut.result()):
+                    if error is None:
+                        entries[(embedding, tok)] = out
+            token_cache.update(entries)
+            if self.shared_memory:
+                self.pool.broadcast(("attach", self._publish_tokens()))
+            else:
+                self.pool.broadcast(("seed", entries))
+
+        return {
+            "tokens": sum(counts.values()),
+            "unique_tokens": len(counts),
+            "canonicalized": len(todo),
+        }
+
+    def map(self, smarts, **options):
+        """
+        Canonicalize a list of SMARTS, returning (result, error) tuples in input order.
+
+        With the "cost" schedule and more than one worker, the most expensive items are
+        dispatched first (see estimate_cost), so a large pattern at the end of the input
+        does not leave the other workers idle while it finishes. Accepts the same per-call
+        options as imap.
+        """
+        smarts = list(smarts)
+        if self.prepass_tokens:
+            self.prepass_stats = self.prepass(smarts, **options)
+        if self.schedule == "fifo" or self.pool is None:
+            return list(self.imap(smarts, max_pending=float("inf"), **options))
+
+        options = self._options(options)
+        chunks = self._cost_chunks(smarts)
+        submitted = [
+            self._submit([smarts[i] for i in chunk], options) for chunk in chunks
+        ]
+        out = [None] * len(smarts)
+        for chunk, sub in zip(chunks, submitted):
+            for i, pair in zip(chunk, self._collect(sub)):
+                out[i] = pair
+        return out
+
+    def stats(self):
+        """
+        Returns the number of items that timed out and of worker processes that crashed.
+        """
+        if self.pool is None:
+            return {"timeouts": 0, "crashes": 0}
+        return {"timeouts": self.pool.timeouts, "crashes": self.pool.crashes}
+
+    def _release_tables(self):
+        for table in self.token_tables:
+            table.close()
+            table.unlink()
+        self.token_tables = []
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+        self._release_tables()
+
+    def terminate(self):
+        if self.pool is not None:
+            self.pool.terminate()
+        self._release_tables()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+
+
+def _split_results(pairs, return_errors):
+    results = [r for r, _ in pairs]
+    if return_errors:
+        return results, [e for _, e in pairs]
+    return results
+
+
+def canon_smarts_batch(
+    smarts,
+    mapping=False,
+    embedding="drugbank",
+    repl_dict={},
+    workers=None,
+    chunk_size=64,
+    return_errors=False,
+    cache=None,
+    schedule="cost",
+    timeout=None,
+    prepass=False,
+    shared_memory=False,
+):
+    """
+    Canonicalizes many SMARTS patterns over a process pool.
+
+    Args:
+        smarts (iterable): The input SMARTS patterns.
+        mapping (bool, optional): Whether to return the atom mapping. Defaults to False.
+        embedding (str or dict, optional): The query primitive frequency dictionary to use. Defaults to "drugbank".
+        repl_dict (dictionary, optional): A dictionary of SMARTS token replacements.
+        workers (int, optional): Number of worker processes. Defaults to os.cpu_count().
+        chunk_size (int, optional): Number of SMARTS sent to a worker per task. Defaults to 64.
+        return_errors (bool, optional): Whether to also return the per-item error messages. Defaults to False.
+        cache (CanonCache, optional): A persistent cache of canonical SMARTS.
+        schedule (str, optional): "cost" to canonicalize the most expensive items first, or "fifo". Defaults to "cost".
+        timeout (float, optional): Seconds after which a single item is abandoned and reported as failed.
+            Defaults to None (no limit).
+        prepass (bool, optional): Whether to canonicalize the distinct atom tokens of the library once before
+            the graph searches. Defaults to False.
+        shared_memory (bool, optional): Whether workers read the token cache from one shared memory table.
+            Defaults to False.
+
+    Returns:
+        list or tuple: The canonical SMARTS in input order, with None for items that failed. If `return_errors`
+        is True, a tuple of that list and a list of error messages (None for items that succeeded) is returned.
+    """
+    with CanonPool(
+        "smarts",
+        mapping,
+        embedding,
+        repl_dict=repl_dict,
+        workers=workers,
+        chunk_size=chunk_size,
+        cache=cache,
+        schedule=schedule,
+        timeout=timeout,
+        prepass=prepass,
+        shared_memory=shared_memory,
+    ) as pool:
+        pairs = pool.map(list(smarts))
+    return _split_results(pairs, return_errors)
+
+
+def canon_reaction_smarts_batch(
+    smarts,
+    mapping=False,
+    embedding="drugbank",
+    remapping=False,
+    repl_dict={},
+    workers=None,
+    chunk_size=16,
+    return_errors=False,
+    cache=None,
+    schedule="cost",
+    timeout=None,
+    prepass=False,
+    shared_memory=False,
+):
+    """
+    Canonicalizes many reaction SMARTS strings over a process pool.
+
+    Args:
+        smarts (iterable): The input reaction SMARTS strings.
+        mapping (bool, optional): Whether to include atom mapping in the canonicalization. Defaults to False.
+        embedding (str or dict, optional): The embedding to use for the canonicalization. Defaults to "drugbank".
+        remapping (bool, optional): Whether to remap atom indices after canonicalization. Defaults to False.
+        repl_dict (dictionary, optional): A dictionary of SMARTS token replacements.
+        workers (int, optional): Number of worker processes. Defaults to os.cpu_count().
+        chunk_size (int, optional): Number of reactions sent to a worker per task. Defaults to 16.
+        return_errors (bool, optional): Whether to also return the per-item error messages. Defaults to False.
+        cache (CanonCache, optional): A persistent cache of canonical reaction SMARTS.
+        schedule (str, optional): "cost" to canonicalize the most expensive items first, or "fifo". Defaults to "cost".
+        timeout (float, optional): Seconds after which a single item is abandoned and reported as failed.
+            Defaults to None (no limit).
+        prepass (bool, optional): Whether to canonicalize the distinct atom tokens of the library once before
+            the graph searches. Defaults to False.
+        shared_memory (bool, optional): Whether workers read the token cache from one shared memory table.
+            Defaults to False.
+
+    Returns:
+        list or tuple: The canonical reaction SMARTS in input order, with None for items that failed. If
+        `return_errors` is True, a tuple of that list and a list of error messages is returned.
+    """
+    with CanonPool(
+        "reaction",
+        mapping,
+        embedding,
+        remapping,
+        repl_dict,
+        workers=workers,
+        chunk_size=chunk_size,
+        cache=cache,
+        schedule=schedule,
+        timeout=timeout,
+        prepass=prepass,
+        shared_memory=shared_memory,
+    ) as pool:
+        pairs = pool.map(list(smarts))
+    return _split_results(pairs, return_errors)
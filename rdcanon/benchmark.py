@@ -0,0 +1,694 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import threading
+import time
+import urllib.request
+import numpy as np
+from rdcanon.datasets import load_dataset
+from rdcanon.version import __version__
+
+
+def load_templates():
+    return list(
+        load_dataset("noncanon_efg_templates_20240108")["noncanon_efg_templates"]
+    )
+
+
+def latency_summary(latencies):
+    lat = np.array(latencies) * 1000
+    return {
+        "n": int(len(lat)),
+        "mean_ms": float(np.mean(lat)),
+        "p50_ms": float(np.percentile(lat, 50)),
+        "p90_ms": float(np.percentile(lat, 90)),
+        "p99_ms": float(np.percentile(lat, 99)),
+        "max_ms": float(np.max(lat)),
+    }
+
+
+def _post(url, payload):
+    req = urllib.request.Request(
+        url,
+        data=json.dumps(payload).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    try:
+        with urllib.request.urlopen(req) as resp:
+            return json.loads(resp.read())
+    except urllib.error.HTTPError as e:
+        return json.loads(e.read())
+
+
+def bench_server(
+    templates=None,
+    clients=8,
+    requests=2000,
+    workers=None,
+    max_batch=256,
+    max_delay=0.005,
+    cache_size=100000,
+    seed=0,
+):
+    """
+    Runs a load test against a canonicalization server on localhost.
+
+    A CanonServer is started on a free port and `clients` threads send single-SMARTS requests,
+    drawn at random from `templates`, until `requests` responses have been received.
+
+    Args:
+        templates (list, optional): SMARTS to send. Defaults to the shipped noncanon_efg_templates dataset.
+        clients (int, optional): Number of concurrent client threads. Defaults to 8.
+        requests (int, optional): Total number of requests. Defaults to 2000.
+        workers (int, optional): Number of server pool workers. Defaults to os.cpu_count().
+        max_batch (int, optional): Server batch size limit. Defaults to 256.
+        max_delay (float, optional): Server batching delay in seconds. Defaults to 0.005.
+        cache_size (int, optional): Server in-memory cache size. Defaults to 100000.
+        seed (int, optional): Seed of the request sequence. Defaults to 0.
+
+    Returns:
+        dict: Throughput, latency percentiles, errors and the server statistics.
+    """
+    from rdcanon.server import CanonServer
+
+    if templates is None:
+        templates = load_templates()
+    rng = random.Random(seed)
+    sequence = [rng.choice(templates) for _ in range(requests)]
+
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    next_idx = [0]
+
+    with CanonServer(
+        ("127.0.0.1", 0),
+        workers=workers,
+        max_batch=max_batch,
+        max_delay=max_delay,
+        cache_size=cache_size,
+    ).start() as server:
+        url = server.url + "/canon_smarts"
+
+        def client():
+            while True:
+                with lock:
+                    if next_idx[0] >= len(sequence):
+                        return
+                    sm = sequence[next_idx[0]]
+                    next_idx[0] = next_idx[0] + 1
+                t0 = time.perf_counter()
+                resp = _post(url, {"smarts": sm})
+                t1 = time.perf_counter()
+                with lock:
+                    latencies.append(t1 - t0)
+                    if resp.get("error") is not None:
+                        errors[0] = errors[0] + 1
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=client) for _ in range(clients)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+        server_stats = server.batcher.stats()
+
+    return {
+        "requests": requests,
+        "clients": clients,
+        "elapsed_s": elapsed,
+        "requests_per_s": requests / elapsed,
+        "errors": errors[0],
+        "latency": latency_summary(latencies),
+        "server": server_stats,
+    }
+
+
+def bench_schedule(
+    templates=None,
+    items=2000,
+    workers=None,
+    chunk_size=64,
+    order="random",
+    repeats=3,
+    seed=0,
+):
+    """
+    Compares input-order ("fifo") and longest-job-first ("cost") scheduling of CanonPool.map.
+
+    The wall time of a batch is set by the last worker to finish, so it is reported per
+    schedule as the best of `repeats` runs. With `order="ascending"` the inputs are sorted by
+    length, which puts the most expensive patterns at the end: the worst case for fifo.
+
+    Args:
+        templates (list, optional): SMARTS to canonicalize. Defaults to the shipped noncanon_efg_templates dataset.
+        items (int, optional): Number of inputs drawn from `templates`. Defaults to 2000.
+        workers (int, optional): Number of pool workers. Defaults to os.cpu_count().
+        chunk_size (int, optional): Maximum chunk size. Defaults to 64.
+        order (str, optional): "random" or "ascending". Defaults to "random".
+        repeats (int, optional): Number of runs per schedule. Defaults to 3.
+        seed (int, optional): Seed of the input sample. Defaults to 0.
+
+    Returns:
+        dict: Wall times per schedule and the speedup of "cost" over "fifo".
+    """
+    from rdcanon.batch import CanonPool
+
+    if templates is None:
+        templates = load_templates()
+    rng = random.Random(seed)
+    smarts = [rng.choice(templates) for _ in range(items)]
+    if order == "ascending":
+        smarts.sort(key=len)
+
+    result = {"items": items, "order": order, "schedules": {}}
+    for schedule in ("fifo", "cost"):
+        with CanonPool(
+            workers=workers, chunk_size=chunk_size, schedule=schedule
+        ) as pool:
+            times = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                pool.map(smarts)
+                times.append(time.perf_counter() - start)
+        result["workers"] = pool.workers
+        result["schedules"][schedule] = {
+            "best_s": min(times),
+            "mean_s": float(np.mean(times)),
+            "items_per_s": items / min(times),
+        }
+    result["speedup"] = (
+        result["schedules"]["fifo"]["best_s"] / result["schedules"]["cost"]["best_s"]
+    )
+    return result
+
+
+# atom count ranges of the canon_smarts cases of the suite
+ATOM_BUCKETS = [(1, 3), (4, 6), (7, 10), (11, 30)]
+
+
+def _suite_cases(size, seed):
+    from rdkit import Chem
+    from rdcanon.batch import _atom_tokens
+
+    rng = random.Random(seed)
+    templates = list(dict.fromkeys(load_templates()))
+    queries = load_dataset("drugbank_non_matching_substruct_dataset_20240108")
+    patterns = list(dict.fromkeys(templates + list(queries["query_smarts"])))
+    plain = [t for t in patterns if "$(" not in t]
+    recursive = [t for t in templates if "$(" in t]
+
+    def sample(items, n):
+        return rng.sample(items, min(n, len(items)))
+
+    cases = {}
+
+    tokens = []
+    for t in sample(templates, 4 * size):
+        tokens.extend(_atom_tokens(t))
+    cases["token_canon"] = sample(sorted(set(tokens)), 2 * size)
+
+    sizes = {}
+    for t in plain:
+        mol = Chem.MolFromSmarts(t)
+        if mol is not None:
+            sizes[t] = mol.GetNumAtoms()
+    for lo, hi in ATOM_BUCKETS:
+        bucket = [t for t in plain if t in sizes and lo <= sizes[t] <= hi]
+        cases["canon_smarts_atoms_%d_%d" % (lo, hi)] = sample(bucket, size)
+
+    cases["canon_smarts_recursive"] = sample(recursive, size)
+
+    reactions = list(load_dataset("reaction_smarts_out")["reaction_smarts"])
+    cases["canon_reaction_smarts"] = sample(reactions, max(1, size // 2))
+    return cases
+
+
+def _time_case(fn, items, warmup, repeats, token_cache):
+    from rdcanon.token_parser import clear_token_cache
+
+    def run():
+        errors = 0
+        if token_cache == "cold":
+            clear_token_cache()
+        start = time.perf_counter()
+        for item in items:
+            try:
+                fn(item)
+            except Exception:
+                errors = errors + 1
+        return time.perf_counter() - start, errors
+
+    for _ in range(warmup):
+        run()
+    times = []
+    errors = 0
+    for _ in range(repeats):
+        elapsed, errors = run()
+        times.append(elapsed)
+
+    median = float(np.median(times))
+    return {
+        "n": len(items),
+        "repeats": repeats,
+        "median_s": median,
+        "min_s": float(np.min(times)),
+        "max_s": float(np.max(times)),
+        "per_item_ms": 1000 * median / max(1, len(items)),
+        "errors": errors,
+    }
+
+
+def bench_suite(
+    size=50,
+    repeats=5,
+    warmup=1,
+    seed=0,
+    embedding="drugbank",
+    token_cache="cold",
+):
+    """
+    Times canonicalization on fixed samples of the shipped datasets.
+
+    The cases are atom token canonicalization (order_token_canon, uncached), canon_smarts on
+    non-recursive templates bucketed by atom count, canon_smarts on recursive templates, and
+    canon_reaction_smarts. Every case is run `warmup` times untimed and `repeats` times timed,
+    and the median is reported. The samples depend only on `size` and `seed`, so results of
+    two runs with the same settings are comparable (see compare_to_baseline).
+
+    Args:
+        size (int, optional): Number of inputs per case (tokens: 2x, reactions: 0.5x). Defaults to 50.
+        repeats (int, optional): Number of timed runs per case. Defaults to 5.
+        warmup (int, optional): Number of untimed runs per case. Defaults to 1.
+        seed (int, optional): Seed of the samples. Defaults to 0.
+        embedding (str, optional): The embedding to canonicalize with. Defaults to "drugbank".
+        token_cache (str, optional): "cold" clears the token cache before every run, "warm" keeps it.
+            Defaults to "cold".
+
+    Returns:
+        dict: "meta" (versions, machine and settings) and "cases" (timings per case).
+    """
+    import rdkit
+    from rdcanon.main import canon_smarts, canon_reaction_smarts
+    from rdcanon.token_parser import order_token_canon
+
+    if token_cache not in ("cold", "warm"):
+        raise ValueError("token_cache must be 'cold' or 'warm'")
+
+    functions = {
+        "token_canon": lambda t: order_token_canon(t, None, embedding),
+        "canon_reaction_smarts": lambda r: canon_reaction_smarts(
+            r, embedding=embedding
+        ),
+    }
+    results = {}
+    for name, items in _suite_cases(size, seed).items():
+        fn = functions.get(name, lambda sm: canon_smarts(sm, embedding=embedding))
+        results[name] = _time_case(fn, items, warmup, repeats, token_cache)
+
+    return {
+        "meta": {
+            "rdcanon": __version__,
+            "rdkit": rdkit.__version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "size": size,
+            "repeats": repeats,
+            "warmup": warmup,
+            "seed": seed,
+            "embedding": embedding,
+            "token_cache": token_cache,
+        },
+        "cases": results,
+    }
+
+
+# the bench_suite settings that two compared runs must share
+SUITE_SETTINGS = ["size", "repeats", "warmup", "seed", "embedding", "token_cache"]
+
+
+def compare_to_baseline(result, baseline, tolerance=0.1):
+    """
+    Compares the per-item times of a suite run with a stored run.
+
+    Versions and machine may differ between the runs, the suite settings may not.
+
+    Args:
+        result (dict): The output of bench_suite.
+        baseline (dict): An earlier output of bench_suite with the same settings.
+        tolerance (float, optional): Relative slowdown tolerated before a case is flagged. Defaults to 0.1.
+
+    Returns:
+        dict: For every case in both runs, the baseline and current per-item times, their ratio and a
+        status of "regression", "improvement" or "ok".
+    """
+    mismatched = [
+        "%s (%r vs %r)" % (k, baseline["meta"].get(k), result["meta"].get(k))
+        for k in SUITE_SETTINGS
+        if baseline["meta"].get(k) != result["meta"].get(k)
+    ]
+    if mismatched:
+        raise ValueError(
+            "baseline was run with different settings: " + ", ".join(mismatched)
+        )
+
+    comparison = {}
+    for name, case in result["cases"].items():
+        if name not in baseline["cases"]:
+            continue
+        before = baseline["cases"][name]["per_item_ms"]
+        after = case["per_item_ms"]
+        ratio = after / before if before > 0 else float("inf")
+        if ratio > 1 + tolerance:
+            status = "regression"
+        elif ratio < 1 / (1 + tolerance):
+            status = "improvement"
+        else:
+            status = "ok"
+        comparison[name] = {
+            "baseline_ms": before,
+            "current_ms": after,
+            "ratio": ratio,
+            "status": status,
+        }
+    return comparison
+
+
+def fit_scaling(sizes, seconds):
+    """
+    Fits power law and exponential models to times measured at increasing sizes.
+
+    Args:
+        sizes (list): The size parameters.
+        seconds (list): The time measured at each size.
+
+    Returns:
+        dict: "power" (t = coefficient * n ** exponent), "exponential" (t = coefficient * rate ** n),
+        each with the r2 of the fit in log space, and "model", the better fitting of the two.
+    """
+    x = np.asarray(sizes, dtype=float)
+    t = np.log(np.maximum(np.asarray(seconds, dtype=float), 1e-9))
+    if len(x) < 3:
+        raise ValueError("at least 3 points are needed to fit a scaling curve")
+
+    def r2(pred):
+        ss_tot = float(np.sum((t - t.mean()) ** 2))
+        if ss_tot == 0:
+            return 1.0
+        return 1 - float(np.sum((t - pred) ** 2)) / ss_tot
+
+    b, a = np.polyfit(np.log(x), t, 1)
+    power = {
+        "exponent": float(b),
+        "coefficient": float(np.exp(a)),
+        "r2": r2(a + b * np.log(x)),
+    }
+    b, a = np.polyfit(x, t, 1)
+    exponential = {
+        "rate": float(np.exp(b)),
+        "coefficient": float(np.exp(a)),
+        "r2": r2(a + b * x),
+    }
+    return {
+        "power": power,
+        "exponential": exponential,
+        "model": "power" if power["r2"] >= exponential["r2"] else "exponential",
+    }
+
+
+def bench_scaling(
+    families=None,
+    sizes=None,
+    repeats=3,
+    max_seconds=5.0,
+    embedding="drugbank",
+):
+    """
+    Times canon_smarts on synthetic SMARTS families of increasing size and fits the scaling curve.
+
+    For every family of rdcanon.synthetic, each size is run once untimed and `repeats` times
+    timed. A family stops at the first size whose median exceeds `max_seconds` or whose
+    canonicalization fails (e.g. when the search hits its iteration limit); that size is
+    reported as "blowup". Sizes that completed are fitted with fit_scaling.
+
+    Args:
+        families (list, optional): Family names. Defaults to every family.
+        sizes (dict or list, optional): Sizes per family, or one list for all families. Defaults to
+            rdcanon.synthetic.DEFAULT_SIZES.
+        repeats (int, optional): Number of timed runs per size. Defaults to 3.
+        max_seconds (float, optional): Median time after which a family is stopped. Defaults to 5.
+        embedding (str, optional): The embedding to canonicalize with. Defaults to "drugbank".
+
+    Returns:
+        dict: "meta" and "families", with the points (n, atoms, median_s), the fit and the blowup
+        of each family.
+    """
+    import rdkit
+    from rdkit import Chem
+    from rdcanon.main import canon_smarts
+    from rdcanon.synthetic import DEFAULT_SIZES, FAMILIES, generate
+
+    if families is None:
+        families = list(FAMILIES)
+
+    results = {}
+    for family in families:
+        if sizes is None:
+            family_sizes = DEFAULT_SIZES[family]
+        elif type(sizes) == dict:
+            family_sizes = sizes.get(family, DEFAULT_SIZES[family])
+        else:
+            family_sizes = sizes
+
+        points = []
+        blowup = None
+        for n in family_sizes:
+            smarts = generate(family, n)
+            point = {
+                "n": n,
+                "atoms": Chem.MolFromSmarts(smarts).GetNumAtoms(),
+                "smarts": smarts,
+            }
+            try:
+                canon_smarts(smarts, embedding=embedding)
+                times = []
+                for _ in range(repeats):
+                    start = time.perf_counter()
+                    canon_smarts(smarts, embedding=embedding)
+                    times.append(time.perf_counter() - start)
+            except Exception as e:
+                blowup = dict(point, reason="%s: %s" % (type(e).__name__, e))
+                break
+            point["median_s"] = float(np.median(times))
+            points.append(point)
+            if point["median_s"] > max_seconds:
+                blowup = dict(point, reason="slower than %g s" % max_seconds)
+                break
+
+        result = {"points": points, "blowup": blowup, "fit": None}
+        if len(points) >= 3:
+            result["fit"] = fit_scaling(
+                [p["n"] for p in points], [p["median_s"] for p in points]
+            )
+        results[family] = result
+
+    return {
+        "meta": {
+            "rdcanon": __version__,
+            "rdkit": rdkit.__version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeats": repeats,
+            "max_seconds": max_seconds,
+            "embedding": embedding,
+        },
+        "families": results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m rdcanon.benchmark", description="rdcanon benchmarks"
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("server", help="load test the HTTP server on localhost")
+    p.add_argument("--clients", type=int, default=8)
+    p.add_argument("--requests", type=int, default=2000)
+    p.add_argument("--workers", type=int, default=None)
+    p.add_argument("--max-batch", type=int, default=256)
+    p.add_argument("--max-delay", type=float, default=5.0, help="milliseconds")
+    p.add_argument("--cache-size", type=int, default=100000)
+    p.add_argument("--seed", type=int, default=0)
+
+    p = sub.add_parser(
+        "schedule", help="compare fifo and longest-job-first batch scheduling"
+    )
+    p.add_argument("--items", type=int, default=2000)
+    p.add_argument("--workers", type=int, default=None)
+    p.add_argument("--chunk-size", type=int, default=64)
+    p.add_argument("--order", choices=["random", "ascending"], default="random")
+    p.add_argument("--repeats", type=int, default=3)
+    p.add_argument("--seed", type=int, default=0)
+
+    p = sub.add_parser("suite", help="time canonicalization on the shipped datasets")
+    p.add_argument("--size", type=int, default=50, help="inputs per case")
+    p.add_argument("--repeats", type=int, default=5)
+    p.add_argument("--warmup", type=int, default=1)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--embedding", default="drugbank")
+    p.add_argument("--token-cache", choices=["cold", "warm"], default="cold")
+    p.add_argument("--output", help="also write the results to this JSON file")
+    p.add_argument("--baseline", help="JSON file of an earlier run to compare with")
+    p.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="relative slowdown flagged as a regression (default 0.1)",
+    )
+
+    p = sub.add_parser(
+        "scaling", help="fit time against size on synthetic SMARTS families"
+    )
+    p.add_argument("--families", nargs="+", default=None, help="default: every family")
+    p.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=None,
+        help="sizes for every family (default: per family)",
+    )
+    p.add_argument("--repeats", type=int, default=3)
+    p.add_argument("--max-seconds", type=float, default=5.0)
+    p.add_argument("--embedding", default="drugbank")
+
+    p = sub.add_parser(
+        "substruct",
+        help="per-template substructure match speedup of canonical templates",
+    )
+    p.add_argument(
+        "--dataset",
+        default="drugbank_non_matching_substruct_dataset_20240108",
+        help="dataset name or path with template and substrate columns",
+    )
+    p.add_argument("--template-column", default="query_smarts")
+    p.add_argument("--substrate-column", default="non_matching_substrate_smiles")
+    p.add_argument(
+        "--embeddings",
+        nargs="+",
+        default=["drugbank"],
+        help="built-in names or JSON files of primitive frequencies",
+    )
+    p.add_argument("--limit", type=int, default=None, help="use the first N templates")
+    p.add_argument("--repeats", type=int, default=5)
+    p.add_argument("--iters", type=int, default=100)
+    p.add_argument("--workers", type=int, default=None)
+    p.add_argument("--no-pin", action="store_true", help="do not pin workers to CPUs")
+    p.add_argument("--confidence", type=float, default=0.95)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--json", help="write the full report to this JSON file")
+    p.add_argument("--csv", help="write per-template speedups to this CSV file")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "server":
+        result = bench_server(
+            clients=args.clients,
+            requests=args.requests,
+            workers=args.workers,
+            max_batch=args.max_batch,
+            max_delay=args.max_delay / 1000,
+            cache_size=args.cache_size,
+            seed=args.seed,
+        )
+    elif args.command == "schedule":
+        result = bench_schedule(
+            items=args.items,
+            workers=args.workers,
+            chunk_size=args.chunk_size,
+            order=args.order,
+            repeats=args.repeats,
+            seed=args.seed,
+        )
+
+    elif args.command == "suite":
+        result = bench_suite(
+            size=args.size,
+            repeats=args.repeats,
+            warmup=args.warmup,
+            seed=args.seed,
+            embedding=args.embedding,
+            token_cache=args.token_cache,
+        )
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(result, f, indent=2)
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+            try:
+                result["comparison"] = compare_to_baseline(
+                    result, baseline, args.tolerance
+                )
+            except ValueError as e:
+                sys.stderr.write("rdcanon.benchmark: " + str(e) + "\n")
+                return 2
+
+    elif args.command == "scaling":
+        result = bench_scaling(
+            families=args.families,
+            sizes=args.sizes,
+            repeats=args.repeats,
+            max_seconds=args.max_seconds,
+            embedding=args.embedding,
+        )
+
+    elif args.command == "substruct":
+        from rdcanon.cli import _load_embedding
+        from rdcanon.substruct import bench_substruct, write_report
+
+        df = load_dataset(args.dataset)
+        templates = list(df[args.template_column])[: args.limit]
+        substrates = list(df[args.substrate_column])[: args.limit]
+        embeddings = [
+            (os.path.splitext(os.path.basename(e))[0], _load_embedding(e))
+            for e in args.embeddings
+        ]
+        result = bench_substruct(
+            templates,
+            substrates,
+            embeddings,
+            repeats=args.repeats,
+            iters=args.iters,
+            workers=args.workers,
+            pin=not args.no_pin,
+            confidence=args.confidence,
+            seed=args.seed,
+        )
+        for path in (args.json, args.csv):
+            if path:
+                write_report(result, path)
+        # the per-template results go to the report files
+        result = {"meta": result["meta"], "summary": result["summary"]}
+
+    json.dump(result, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+    regressions = [
+        name
+        for name, c in result.get("comparison", {}).items()
+        if c["status"] == "regression"
+    ]
+    if regressions:
+        sys.stderr.write("regressions: " + ", ".join(regressions) + "\n")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from rdcanon.token_parser import get_prims
+from rdcanon.version import __version__
+
+
+_fingerprints = {}
+
+
+def embedding_fingerprint(embedding):
+    """
+    Returns a hex digest identifying the contents of an embedding.
+
+    Args:
+        embedding (str or dict): An embedding name or a dictionary of primitives.
+
+    Returns:
+        str: The SHA-256 digest of the sorted primitive weights.
+    """
+    if type(embedding) == str and embedding in _fingerprints:
+        return _fingerprints[embedding]
+
+    prims = get_prims(embedding)
+    items = sorted((str(k), repr(v)) for k, v in prims.items())
+    fp = hashlib.sha256(json.dumps(items).encode()).hexdigest()
+
+    if type(embedding) == str:
+        _fingerprints[embedding] = fp
+    return fp
+
+
+def repl_dict_fingerprint(repl_dict):
+    items = sorted((str(k), str(v)) for k, v in repl_dict.items())
+    return hashlib.sha256(json.dumps(items).encode()).hexdigest()
+
+
+class CanonCache:
+    """
+    A persistent cache of canonical SMARTS backed by a SQLite database.
+
+    Entries are keyed by the input string, the embedding fingerprint, the mapping and
+    remapping flags, the replacement dictionary and the rdcanon version, so a changed
+    setting never returns a stale result. The database is opened in WAL mode, so several
+    processes can read and write it at once. Each process (and each pickled copy sent to
+    a worker) opens its own connection on first use.
+
+    Args:
+        path (str): Path of the SQLite database file. It is created if missing.
+        timeout (float, optional): Seconds to wait for a lock held by another writer. Defaults to 30.
+    """
+
+    def __init__(self, path, timeout=30.0):
+        self.path = path
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_conn"] = None
+        state["_pid"] = None
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(
+                self.path, timeout=self.timeout, check_same_thread=False
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS canon (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+            )
+            conn.commit()
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def key(
+        self,
+        smarts,
+        kind="smarts",
+        mapping=False,
+        embedding="drugbank",
+        remapping=False,
+        repl_dict={},
+    ):
+        """
+        Returns the cache key of a canonicalization request.
+        """
+        parts = [
+            __version__,
+            kind,
+            embedding_fingerprint(embedding),
+            str(int(bool(mapping))),
+            str(int(bool(remapping))),
+            repl_dict_fingerprint(repl_dict),
+            smarts,
+        ]
+        return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        """
+        Looks up several keys at once, returning a dictionary of the keys found.
+        """
+        found = {}
+        keys = list(keys)
+        with self._lock:
+            conn = self._connect()
+            for i in range(0, len(keys), 500):
+                part = keys[i : i + 500]
+                rows = conn.execute(
+                    "SELECT key, value FROM canon WHERE key IN (%s)"
+                    % ",".join("?" * len(part)),
+                    part,
+                ).fetchall()
+                for k, v in rows:
+                    found[k] = v
+            # every requested key counts, including repeats within one call
+            hits = sum(k in found for k in keys)
+            self.hits = self.hits + hits
+            self.misses = self.misses + len(keys) - hits
+        return found
+
+    def put(self, key, value):
+        self.put_many([(key, value)])
+
+    def put_many(self, items):
+        items = list(items)
+        if len(items) == 0:
+            return
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO canon (key, value) VALUES (?, ?)", items
+                )
+            self.writes = self.writes + len(items)
+
+    def stats(self):
+        """
+        Returns the hit and miss counts of this cache object.
+
+        Returns:
+            dict: hits, misses, writes and hit_rate (hits / lookups, or 0.0 without lookups).
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+        }
+
+    def __len__(self):
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM canon").fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute("DELETE FROM canon")
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+            self._pid = None
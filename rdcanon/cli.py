@@ -0,0 +1,243 @@
+import argparse
+import csv
+import json
+import sys
+import time
+from collections import deque
+from rdcanon.batch import CanonPool
+from rdcanon.cache import CanonCache
+
+
+EMBEDDINGS = ["askcos", "pubchem", "drugbank", "npatlas"]
+
+
+def _load_embedding(embedding):
+    if embedding in EMBEDDINGS:
+        return embedding
+    with open(embedding) as f:
+        prims = json.load(f)
+    if type(prims) != dict:
+        raise ValueError("embedding file must contain a JSON object of primitives")
+    return prims
+
+
+def _open_inputs(paths):
+    if not paths:
+        paths = ["-"]
+    for path in paths:
+        if path == "-":
+            yield sys.stdin
+        else:
+            with open(path, newline="") as f:
+                yield f
+
+
+def _read_lines(paths):
+    for f in _open_inputs(paths):
+        for line in f:
+            line = line.strip()
+            yield line, line
+
+
+def _read_csv(paths, column, delimiter, header_out):
+    # header_out receives the output header of the first file
+    for f in _open_inputs(paths):
+        reader = csv.reader(f, delimiter=delimiter)
+        header = next(reader, None)
+        if header is None:
+            continue
+        if column not in header:
+            raise ValueError("column '" + column + "' not found in CSV header")
+        col_idx = header.index(column)
+        if len(header_out) == 0:
+            header_out.extend(header + ["canon_" + column])
+        for row in reader:
+            # blank and truncated rows fail like blank lines of plain input
+            yield row[col_idx] if len(row) > col_idx else "", row
+
+
+class Throughput:
+    """
+    Writes a running count and rate of processed items to a stream.
+    """
+
+    def __init__(self, stream, interval=1.0):
+        self.stream = stream
+        self.interval = interval
+        self.start = time.perf_counter()
+        self.last = self.start
+        self.n = 0
+        self.failed = 0
+
+    def update(self, failed):
+        self.n = self.n + 1
+        if failed:
+            self.failed = self.failed + 1
+        now = time.perf_counter()
+        if now - self.last >= self.interval:
+            self.last = now
+            self.write("\r")
+
+    def write(self, end):
+        elapsed = time.perf_counter() - self.start
+        rate = self.n / elapsed if elapsed > 0 else 0.0
+        self.stream.write(
+            "%s%d processed, %d failed, %.1f/s" % (end, self.n, self.failed, rate)
+        )
+        self.stream.flush()
+
+    def finish(self):
+        self.write("\r")
+        self.stream.write("\n")
+        self.stream.flush()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="rdcanon",
+        description="Canonicalize SMARTS or reaction SMARTS, one per line or from a CSV column.",
+    )
+    parser.add_argument(
+        "inputs", nargs="*", help="input files, '-' or none for stdin"
+    )
+    parser.add_argument(
+        "-o", "--output", default="-", help="output file, '-' for stdout (default)"
+    )
+    parser.add_argument(
+        "--reaction", action="store_true", help="inputs are reaction SMARTS"
+    )
+    parser.add_argument(
+        "--column", help="read inputs from this column of CSV files with a header"
+    )
+    parser.add_argument("--delimiter", default=",", help="CSV delimiter (default ',')")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="number of worker processes (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--embedding",
+        default="drugbank",
+        help="one of "
+        + ", ".join(EMBEDDINGS)
+        + ", or a JSON file of primitive frequencies (default drugbank)",
+    )
+    parser.add_argument(
+        "--mapping", action="store_true", help="keep atom mapping in the output"
+    )
+    parser.add_argument(
+        "--remap",
+        action="store_true",
+        help="remap atom indices after canonicalization (reactions only, implies --mapping)",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=None,
+        help="items sent to a worker per task (default 64, or 16 with --reaction)",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=None,
+        help="per-item time limit in seconds; slower items fail (default: none)",
+    )
+    parser.add_argument(
+        "--cache", help="SQLite file used as a persistent cache of canonical outputs"
+    )
+    parser.add_argument(
+        "--quiet", action="store_true", help="do not report throughput or errors"
+    )
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    if args.remap and not args.reaction:
+        print("rdcanon: --remap requires --reaction", file=sys.stderr)
+        return 2
+
+    chunk_size = args.chunk_size
+    if chunk_size is None:
+        chunk_size = 16 if args.reaction else 64
+
+    header = []
+    if args.column is not None:
+        records = _read_csv(args.inputs, args.column, args.delimiter, header)
+    else:
+        records = _read_lines(args.inputs)
+
+    # inputs are kept only while their chunk is in flight
+    in_flight = deque()
+
+    def smarts_stream():
+        for sm, record in records:
+            in_flight.append(record)
+            yield sm
+
+    if args.output == "-":
+        out = sys.stdout
+    else:
+        out = open(args.output, "w", newline="")
+
+    writer = csv.writer(out, delimiter=args.delimiter) if args.column else None
+    counter = None if args.quiet else Throughput(sys.stderr)
+    header_written = False
+    cache = CanonCache(args.cache) if args.cache else None
+
+    try:
+        with CanonPool(
+            "reaction" if args.reaction else "smarts",
+            args.mapping,
+            _load_embedding(args.embedding),
+            args.remap,
+            workers=args.workers,
+            chunk_size=chunk_size,
+            cache=cache,
+            timeout=args.timeout,
+        ) as pool:
+            for canon, error in pool.imap(smarts_stream()):
+                record = in_flight.popleft()
+                if writer is not None:
+                    if not header_written:
+                        writer.writerow(header)
+                        header_written = True
+                    writer.writerow(record + [canon if canon is not None else ""])
+                else:
+                    out.write((canon if canon is not None else "") + "\n")
+
+                if error is not None and not args.quiet:
+                    sys.stderr.write(
+                        "\nrdcanon: failed on " + repr(record) + ": " + error + "\n"
+                    )
+                if counter is not None:
+                    counter.update(error is not None)
+            pool_stats = pool.stats()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        else:
+            out.flush()
+
+    if counter is not None:
+        counter.finish()
+        if pool_stats["timeouts"] or pool_stats["crashes"]:
+            sys.stderr.write(
+                "workers: %d items timed out, %d crashed\n"
+                % (pool_stats["timeouts"], pool_stats["crashes"])
+            )
+        if cache is not None:
+            st = cache.stats()
+            sys.stderr.write(
+                "cache: %d hits, %d misses, %.1f%% hit rate\n"
+                % (st["hits"], st["misses"], 100 * st["hit_rate"])
+            )
+    if cache is not None:
+        cache.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
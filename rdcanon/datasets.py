@@ -0,0 +1,137 @@
+import argparse
+import functools
+import os
+import sys
+import pandas as pd
+
+TESTING_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "testing_data")
+
+# preferred order when a dataset is shipped in several formats
+FORMATS = [".parquet", ".csv", ".xlsx"]
+LINE_FORMATS = [".txt", ".smi", ".smarts"]
+
+
+def read_dataset(path, column="smarts"):
+    """
+    Reads a dataset file into a DataFrame, choosing the reader from the file extension.
+
+    Supported formats are Excel (.xlsx, .xls), CSV (.csv), Parquet (.parquet, requires pyarrow or
+    fastparquet) and line-delimited text (.txt, .smi, .smarts), which is read into a single column.
+
+    Args:
+        path (str): Path of the dataset file.
+        column (str, optional): Column name for line-delimited files. Defaults to "smarts".
+
+    Returns:
+        pandas.DataFrame: The dataset.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".xlsx", ".xls"):
+        return pd.read_excel(path)
+    elif ext == ".csv":
+        # SMARTS and SMILES are strings; only empty cells are missing values
+        return pd.read_csv(path, keep_default_na=False, na_values=[""])
+    elif ext == ".parquet":
+        return pd.read_parquet(path)
+    elif ext in LINE_FORMATS:
+        with open(path) as f:
+            lines = [line.strip() for line in f]
+        return pd.DataFrame({column: [line for line in lines if line]})
+    raise ValueError("unsupported dataset format: " + path)
+
+
+def find_dataset(name, directory=TESTING_DATA):
+    """
+    Returns the path of a named dataset, preferring the fastest format available.
+
+    Args:
+        name (str): A file name with or without extension, or a path.
+        directory (str, optional): Directory searched for bare names. Defaults to the shipped testing_data.
+
+    Returns:
+        str: The path of the dataset file.
+    """
+    if os.path.splitext(name)[1] and os.path.exists(name):
+        return name
+    base = name if os.path.isabs(name) else os.path.join(directory, name)
+    stem, ext = os.path.splitext(base)
+    if ext.lower() in FORMATS + LINE_FORMATS + [".xls"]:
+        base = stem
+    for fmt in FORMATS + LINE_FORMATS:
+        if os.path.exists(base + fmt):
+            return base + fmt
+    raise FileNotFoundError("dataset not found: " + name)
+
+
+@functools.lru_cache(maxsize=None)
+def _load(path, mtime):
+    return read_dataset(path)
+
+
+def load_dataset(name, directory=TESTING_DATA):
+    """
+    Loads a dataset once per process and returns the cached DataFrame on later calls.
+
+    Bare names such as "noncanon_efg_templates_20240108" are looked up in `directory`, using a
+    Parquet or CSV copy when one exists instead of the Excel original. The returned DataFrame is
+    shared between callers and should not be modified.
+
+    Args:
+        name (str): A dataset name or path.
+        directory (str, optional): Directory searched for bare names. Defaults to the shipped testing_data.
+
+    Returns:
+        pandas.DataFrame: The dataset.
+    """
+    path = find_dataset(name, directory)
+    return _load(os.path.abspath(path), os.path.getmtime(path))
+
+
+def convert_datasets(directory=TESTING_DATA, fmt="csv", overwrite=False):
+    """
+    Writes a CSV or Parquet copy of every Excel dataset in a directory.
+
+    Args:
+        directory (str, optional): Directory holding the .xlsx files. Defaults to the shipped testing_data.
+        fmt (str, optional): "csv" or "parquet". Defaults to "csv".
+        overwrite (bool, optional): Whether to replace existing copies. Defaults to False.
+
+    Returns:
+        list: Paths of the files written.
+    """
+    if fmt not in ("csv", "parquet"):
+        raise ValueError("fmt must be 'csv' or 'parquet'")
+    written = []
+    for fn in sorted(os.listdir(directory)):
+        stem, ext = os.path.splitext(fn)
+        if ext.lower() != ".xlsx":
+            continue
+        out = os.path.join(directory, stem + "." + fmt)
+        if os.path.exists(out) and not overwrite:
+            continue
+        df = pd.read_excel(os.path.join(directory, fn))
+        if fmt == "csv":
+            df.to_csv(out, index=False)
+        else:
+            df.to_parquet(out, index=False)
+        written.append(out)
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m rdcanon.datasets",
+        description="Convert Excel datasets to CSV or Parquet.",
+    )
+    parser.add_argument("directory", nargs="?", default=TESTING_DATA)
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    parser.add_argument("--overwrite", action="store_true")
+    args = parser.parse_args(argv)
+
+    for path in convert_datasets(args.directory, args.format, args.overwrite):
+        print(path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+import re
+from rdkit import Chem
+from rdkit.Chem import AllChem
+from rdcanon.main import canon_smarts, canon_reaction_smarts, query_mol
+from rdcanon.token_parser import canon_token
+
+
+def _parse(smarts):
+    if type(smarts) == str:
+        mol = Chem.MolFromSmarts(smarts)
+    else:
+        mol = query_mol(smarts)
+    if not mol:
+        raise ValueError("Invalid SMARTS provided")
+    return _merge_hs(mol)
+
+
+def _merge_hs(mol):
+    if Chem.HasQueryHs(mol)[0]:
+        mol = Chem.AdjustQueryProperties(Chem.MergeQueryHs(mol))
+    return mol
+
+
+def _kept_atoms(mol):
+    # the atoms that become graph nodes in Graph.graph_from_smarts; writing the SMARTS of
+    # every atom is slow, so only hydrogen atoms are checked
+    return [
+        atom
+        for atom in mol.GetAtoms()
+        if atom.GetAtomicNum() != 1 or atom.GetSmarts() not in ("[H]", "[#1]")
+    ]
+
+
+def shape(mol):
+    """
+    Returns the cheap graph invariants of a query mol, over the atoms Graph keeps.
+
+    Args:
+        mol (Mol): The query mol, with explicit hydrogens merged as in Graph.graph_from_smarts.
+
+    Returns:
+        tuple: The number of atoms, the number of bonds and the sorted degree sequence.
+    """
+    degrees = {atom.GetIdx(): 0 for atom in _kept_atoms(mol)}
+    bonds = 0
+    for bond in mol.GetBonds():
+        i = bond.GetBeginAtomIdx()
+        j = bond.GetEndAtomIdx()
+        if i in degrees and j in degrees:
+            bonds = bonds + 1
+            degrees[i] = degrees[i] + 1
+            degrees[j] = degrees[j] + 1
+    return len(degrees), bonds, sorted(degrees.values())
+
+
+def _tokens(mol, mapping, embedding):
+    tokens = []
+    for atom in _kept_atoms(mol):
+        sm = atom.GetSmarts()
+        atom_map = re.findall(r":\d+]", sm)
+        if mapping and len(atom_map) > 0:
+            token, _ = canon_token(
+                re.sub(r":\d+]", "]", sm), atom_map[0][0:-1], embedding
+            )
+        else:
+            token, _ = canon_token(re.sub(r":\d+]", "]", sm), None, embedding)
+        tokens.append(token)
+    return sorted(tokens)
+
+
+def smarts_equivalent(a, b, mapping=False, embedding="drugbank"):
+    """
+    Checks whether two SMARTS patterns have the same canonical form, rejecting most different pairs early.
+
+    The checks run from cheapest to most expensive, and the first difference ends the comparison:
+    the number of atoms and bonds and the degree sequence of the RDKit query mols, then the sorted
+    canonical atom tokens (which determine the token scores), and only then the full canonical
+    SMARTS.
+
+    Args:
+        a (str or Mol): The first SMARTS pattern or query mol.
+        b (str or Mol): The second SMARTS pattern or query mol.
+        mapping (bool, optional): Whether atom map numbers must match as well. Defaults to False.
+        embedding (str, optional): The query primitive frequency dictionary to use. Defaults to "drugbank".
+
+    Returns:
+        bool: Whether canon_smarts(a, mapping, embedding) == canon_smarts(b, mapping, embedding).
+    """
+    mol_a = _parse(a)
+    mol_b = _parse(b)
+    if shape(mol_a) != shape(mol_b):
+        return False
+    if _tokens(mol_a, mapping, embedding) != _tokens(mol_b, mapping, embedding):
+        return False
+    return canon_smarts(a, mapping, embedding) == canon_smarts(b, mapping, embedding)
+
+
+def _reaction_shape(rxn):
+    roles = []
+    for templates in (rxn.GetReactants(), rxn.GetAgents(), rxn.GetProducts()):
+        roles.append(sorted(shape(_merge_hs(t)) for t in templates))
+    return roles
+
+
+def reaction_smarts_equivalent(
+    a, b, mapping=False, embedding="drugbank", remapping=False
+):
+    """
+    Checks whether two reaction SMARTS have the same canonical form, rejecting most different pairs early.
+
+    The number of reactants, agents and products and the invariants of their templates (see shape)
+    are compared before the reactions are canonicalized.
+
+    Args:
+        a (str or ChemicalReaction): The first reaction.
+        b (str or ChemicalReaction): The second reaction.
+        mapping (bool, optional): Whether atom map numbers must match as well. Defaults to False.
+        embedding (str, optional): The embedding to use for the canonicalization. Defaults to "drugbank".
+        remapping (bool, optional): Whether to remap atom indices before comparing. Defaults to False.
+
+    Returns:
+        bool: Whether the canon_reaction_smarts outputs with these settings are equal.
+    """
+    rxns = []
+    for r in (a, b):
+        rxn = AllChem.ReactionFromSmarts(r) if type(r) == str else r
+        if rxn is None:
+            raise ValueError("Invalid reaction SMARTS provided")
+        rxns.append(rxn)
+    if _reaction_shape(rxns[0]) != _reaction_shape(rxns[1]):
+        return False
+
+    out_a = canon_reaction_smarts(rxns[0], mapping, embedding, remapping)
+    out_b = canon_reaction_smarts(rxns[1], mapping, embedding, remapping)
+    return out_a == out_b
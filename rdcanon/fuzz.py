@@ -0,0 +1,301 @@
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+from rdkit import Chem
+from rdcanon.main import canon_smarts
+
+
+def random_traversal(mol, rng):
+    """
+    Writes a query mol as SMARTS from a random atom order.
+
+    The atoms are renumbered with a random permutation before RDKit writes the SMARTS, so
+    the start atom, the branch order and the ring closures of the depth first traversal are
+    random, and stereo tags are rewritten to match.
+
+    Args:
+        mol (Mol): A query mol, e.g. from Chem.MolFromSmarts.
+        rng (random.Random): The random generator.
+
+    Returns:
+        str: The permuted SMARTS.
+    """
+    order = list(range(mol.GetNumAtoms()))
+    rng.shuffle(order)
+    return Chem.MolToSmarts(Chem.RenumberAtoms(mol, order))
+
+
+def _signature(mol):
+    # directions of double bond stereo may flip between orderings, but a directional
+    # bond must not be dropped, as RDKit does for a direction without a partner
+    atoms = sorted(a.GetSmarts() for a in mol.GetAtoms())
+    bonds = sorted(b.GetSmarts().replace("\\", "/") for b in mol.GetBonds())
+    return atoms, bonds
+
+
+def _canon(smarts, embedding):
+    try:
+        return canon_smarts(smarts, embedding=embedding)
+    except Exception as e:
+        return "%s: %s" % (type(e).__name__, e)
+
+
+def check_invariance(smarts, n_perms=100, seed=0, embedding="drugbank"):
+    """
+    Checks that random atom orderings of a SMARTS pattern canonicalize to the same output.
+
+    Args:
+        smarts (str): The SMARTS pattern.
+        n_perms (int, optional): Number of random orderings drawn. Defaults to 100.
+        seed (int, optional): Seed; the orderings drawn depend only on the seed and the input. Defaults to 0.
+        embedding (str or dict, optional): The embedding to canonicalize with. Defaults to "drugbank".
+
+    Returns:
+        dict or None: None if every ordering gives the canonical SMARTS of the input. Otherwise
+        a dictionary with the input "smarts", the "expected" canonical SMARTS, the first failing
+        "variant", what it canonicalized to ("got", or the error message), and "permutations",
+        the number of distinct orderings checked. Orderings that RDKit does not write with the
+        same atom and bond queries as the input are not checked.
+
+    Raises:
+        ValueError: If the input itself cannot be parsed or canonicalized.
+    """
+    mol = Chem.MolFromSmarts(smarts)
+    if mol is None:
+        raise ValueError("Invalid SMARTS provided")
+    expected = canon_smarts(smarts, embedding=embedding)
+
+    rng = random.Random("%d:%s" % (seed, smarts))
+    variants = set()
+    for _ in range(n_perms):
+        variants.add(random_traversal(mol, rng))
+    variants.discard(smarts)
+
+    signature = _signature(mol)
+    variants = [v for v in variants if _signature(Chem.MolFromSmarts(v)) == signature]
+
+    for variant in sorted(variants):
+        got = _canon(variant, embedding)
+        if got != expected:
+            return {
+                "smarts": smarts,
+                "expected": expected,
+                "variant": variant,
+                "got": got,
+                "permutations": len(variants),
+            }
+    return None
+
+
+def _fails(smarts, n_perms, seed, embedding):
+    try:
+        return check_invariance(smarts, n_perms, seed, embedding) is not None
+    except Exception:
+        # a candidate that cannot be canonicalized at all is not a smaller example
+        return False
+
+
+def _candidates(mol):
+    # removing one atom, or one ring bond, while keeping the pattern connected
+    for i in range(mol.GetNumAtoms()):
+        if mol.GetNumAtoms() == 1:
+            break
+        rw = Chem.RWMol(mol)
+        rw.RemoveAtom(i)
+        if len(Chem.GetMolFrags(rw)) == 1:
+            yield rw
+    for bond in mol.GetBonds():
+        rw = Chem.RWMol(mol)
+        rw.RemoveBond(bond.GetBeginAtomIdx(), bond.GetEndAtomIdx())
+        if len(Chem.GetMolFrags(rw)) == 1:
+            yield rw
+
+
+def shrink(
+    smarts, n_perms=100, seed=0, embedding="drugbank", max_steps=1000, fails=None
+):
+    """
+    Reduces a SMARTS pattern that fails check_invariance to a minimal failing pattern.
+
+    Single atoms and ring bonds are removed greedily, keeping the pattern connected, as long as
+    the smaller pattern still fails with the same settings (or, if given, `fails` returns True).
+
+    Args:
+        smarts (str): A failing SMARTS pattern.
+        n_perms (int, optional): Orderings drawn per check. Defaults to 100.
+        seed (int, optional): Seed of the checks. Defaults to 0.
+        embedding (str or dict, optional): The embedding to canonicalize with. Defaults to "drugbank".
+        max_steps (int, optional): Maximum number of candidates checked. Defaults to 1000.
+        fails (callable, optional): A function of a SMARTS pattern that returns True while the
+            failure persists. Defaults to a check_invariance failure.
+
+    Returns:
+        str: The smallest failing pattern found, or `smarts` if no smaller one fails.
+    """
+    if fails is None:
+        fails = lambda sm: _fails(sm, n_perms, seed, embedding)
+    current = smarts
+    steps = 0
+    reduced = True
+    while reduced and steps < max_steps:
+        reduced = False
+        mol = Chem.MolFromSmarts(current)
+        for candidate in _candidates(mol):
+            steps = steps + 1
+            cand_smarts = Chem.MolToSmarts(candidate)
+            if fails(cand_smarts):
+                current = cand_smarts
+                reduced = True
+                break
+            if steps >= max_steps:
+                break
+    return current
+
+
+def _fuzz_item(task):
+    index, smarts, n_perms, seed, embedding, do_shrink = task
+    try:
+        failure = check_invariance(smarts, n_perms, seed, embedding)
+    except Exception as e:
+        return index, None, "%s: %s" % (type(e).__name__, e), 0
+    if failure is None:
+        return index, None, None, n_perms
+    failure["index"] = index
+    if do_shrink:
+        failure["minimal"] = shrink(smarts, n_perms, seed, embedding)
+    return index, failure, None, n_perms
+
+
+def fuzz(
+    smarts,
+    n_perms=100,
+    workers=None,
+    seed=0,
+    embedding="drugbank",
+    shrink_failures=True,
+    progress=None,
+):
+    """
+    Checks permutation invariance of a library of SMARTS patterns over a process pool.
+
+    Every pattern is checked with check_invariance in a worker process, and failing patterns
+    are reduced with shrink. Inputs that cannot be canonicalized at all are reported as errors.
+
+    Args:
+        smarts (iterable): The SMARTS patterns.
+        n_perms (int, optional): Random orderings drawn per pattern. Defaults to 100.
+        workers (int, optional): Number of worker processes. Defaults to os.cpu_count(). 1 runs in the calling process.
+        seed (int, optional): Seed of the orderings. Defaults to 0.
+        embedding (str or dict, optional): The embedding to canonicalize with. Defaults to "drugbank".
+        shrink_failures (bool, optional): Whether to reduce failing patterns to minimal examples. Defaults to True.
+        progress (callable, optional): Called with the number of patterns checked so far.
+
+    Returns:
+        dict: "checked", "permutations" (orderings drawn), "seconds", "failures" (see check_invariance,
+        plus "index" and "minimal") and "errors" ({"index", "smarts", "error"}), both in input order.
+    """
+    items = list(smarts)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    tasks = [
+        (i, sm, n_perms, seed, embedding, shrink_failures) for i, sm in enumerate(items)
+    ]
+
+    start = time.perf_counter()
+    failures = []
+    errors = []
+    permutations = 0
+    done = 0
+
+    if workers == 1:
+        results = map(_fuzz_item, tasks)
+        pool = None
+    else:
+        pool = multiprocessing.get_context().Pool(workers)
+        results = pool.imap_unordered(_fuzz_item, tasks, chunksize=4)
+    try:
+        for index, failure, error, perms in results:
+            done = done + 1
+            permutations = permutations + perms
+            if failure is not None:
+                failures.append(failure)
+            if error is not None:
+                errors.append({"index": index, "smarts": items[index], "error": error})
+            if progress is not None:
+                progress(done)
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    return {
+        "checked": len(items),
+        "permutations": permutations,
+        "seconds": time.perf_counter() - start,
+        "failures": sorted(failures, key=lambda f: f["index"]),
+        "errors": sorted(errors, key=lambda e: e["index"]),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m rdcanon.fuzz",
+        description="Check that random atom orderings of SMARTS canonicalize identically.",
+    )
+    parser.add_argument(
+        "dataset",
+        nargs="?",
+        default="noncanon_efg_templates_20240108",
+        help="a dataset name or a file (.txt, .smarts, .csv, .xlsx, .parquet)",
+    )
+    parser.add_argument(
+        "--column", default=None, help="column of the SMARTS (default: first column)"
+    )
+    parser.add_argument("--perms", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--embedding", default="drugbank")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--no-shrink", action="store_true")
+    parser.add_argument("--output", help="also write the report to this JSON file")
+    args = parser.parse_args(argv)
+
+    from rdcanon.cli import _load_embedding
+    from rdcanon.datasets import load_dataset
+
+    df = load_dataset(args.dataset)
+    column = args.column if args.column is not None else df.columns[0]
+    smarts = [sm for sm in df[column] if type(sm) == str][: args.limit]
+
+    report = fuzz(
+        smarts,
+        n_perms=args.perms,
+        workers=args.workers,
+        seed=args.seed,
+        embedding=_load_embedding(args.embedding),
+        shrink_failures=not args.no_shrink,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    for failure in report["failures"]:
+        print(json.dumps(failure))
+    sys.stderr.write(
+        "%d patterns, %d orderings in %.1f s: %d failures, %d errors\n"
+        % (
+            report["checked"],
+            report["permutations"],
+            report["seconds"],
+            len(report["failures"]),
+            len(report["errors"]),
+        )
+    )
+    return 1 if report["failures"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
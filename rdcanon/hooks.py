@@ -0,0 +1,217 @@
+import cProfile
+import os
+import pstats
+import sys
+import time
+
+EVENTS = [
+    "canon_start",
+    "canon_end",
+    "graph_build",
+    "token",
+    "search_start",
+    "search_end",
+    "regen",
+    "reaction_sort",
+]
+
+# event -> list of callbacks; events without callbacks are absent, and an empty
+# registry means that the pipeline does not time or report anything
+_registry = {}
+
+
+def add_hook(callback, events=None):
+    """
+    Registers a callback that is called at pipeline phase boundaries in this process.
+
+    Callbacks are called as callback(event, info), where info is a dictionary. Every event has
+    "smarts" (the SMARTS or reaction SMARTS being canonicalized); the others are:
+
+        canon_start: kind ("smarts" or "reaction").
+        canon_end: kind, seconds. It is also fired when canonicalization raises an exception.
+        graph_build: atoms, bonds, seconds (RDKit parse, Lark parse and token canonicalization).
+        token: index, token, canonical, length, seconds.
+        search_start: atoms, tied_start_nodes.
+        search_end: atoms, tied_paths, seconds.
+        regen: tied_paths, length (of the output), seconds.
+        reaction_sort: role ("reactants", "agents" or "products"), components, seconds.
+
+    Hooks are not copied to batch or server worker processes.
+
+    Args:
+        callback (callable): The callback.
+        events (list, optional): Events to register for. Defaults to `callback.events` if the callback
+            has that attribute, and to every event otherwise.
+
+    Returns:
+        callable: The callback, so that it can be used as a decorator.
+    """
+    if events is None:
+        events = getattr(callback, "events", EVENTS)
+    for event in events:
+        if event not in EVENTS:
+            raise ValueError("unknown hook event: " + str(event))
+    for event in events:
+        _registry.setdefault(event, []).append(callback)
+    return callback
+
+
+def remove_hook(callback):
+    """
+    Unregisters a callback from every event.
+    """
+    for event in list(_registry):
+        _registry[event] = [c for c in _registry[event] if c is not callback]
+        if len(_registry[event]) == 0:
+            del _registry[event]
+
+
+def clear_hooks():
+    _registry.clear()
+
+
+def active_hooks():
+    """
+    Returns the registry if any hook is registered, and None otherwise.
+    """
+    if _registry:
+        return _registry
+    return None
+
+
+def fire(hooks, event, **info):
+    for callback in hooks.get(event, ()):
+        callback(event, info)
+
+
+class _StackTracer:
+    """
+    A deterministic profiler that records the time spent in every call stack, for flame graphs.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.stack = []
+        self.folded = {}
+
+    def _label(self, frame, event, arg):
+        if event == "call":
+            code = frame.f_code
+            return "%s (%s:%d)" % (
+                getattr(code, "co_qualname", code.co_name),
+                os.path.basename(code.co_filename),
+                code.co_firstlineno,
+            )
+        module = getattr(arg, "__module__", None)
+        name = getattr(arg, "__qualname__", repr(arg))
+        return name if module is None else module + "." + name
+
+    def __call__(self, frame, event, arg):
+        now = time.perf_counter()
+        if event == "call" or event == "c_call":
+            self.stack.append([self._label(frame, event, arg), now, 0.0])
+        elif len(self.stack) > 0:
+            # returns from frames entered before the tracer started are ignored
+            label, start, child = self.stack.pop()
+            elapsed = now - start
+            key = ";".join([self.root] + [s[0] for s in self.stack] + [label])
+            self.folded[key] = self.folded.get(key, 0.0) + elapsed - child
+            if len(self.stack) > 0:
+                self.stack[-1][2] = self.stack[-1][2] + elapsed
+
+    def start(self):
+        sys.setprofile(self)
+
+    def stop(self):
+        sys.setprofile(None)
+        self.stack = []
+
+
+class ProfileHook:
+    """
+    A hook that profiles canonicalization of selected inputs.
+
+    Each selected canon_smarts or canon_reaction_smarts call is profiled from start to end (calls
+    nested in a profiled reaction are part of its profile). With output="pstats", cProfile is used
+    and dump() writes a file readable by pstats, snakeviz or gprof2dot. With output="folded", every
+    call stack is recorded and dump() writes the folded stack format read by flamegraph.pl,
+    speedscope and inferno, with one line per stack and its self time in microseconds.
+
+    Args:
+        select (collection or callable, optional): The inputs to profile, as a collection of SMARTS
+            or a function of the SMARTS returning a bool. Defaults to every input.
+        output (str, optional): "pstats" or "folded". Defaults to "pstats".
+    """
+
+    events = ("canon_start", "canon_end")
+
+    def __init__(self, select=None, output="pstats"):
+        if output not in ("pstats", "folded"):
+            raise ValueError("output must be 'pstats' or 'folded'")
+        self.select = select
+        self.output = output
+        self.profiled = []
+        self.folded = {}
+        self._pstats = None
+        self._profiler = None
+        self._depth = 0
+
+    def _selected(self, smarts):
+        if self.select is None:
+            return True
+        if callable(self.select):
+            return bool(self.select(smarts))
+        return smarts in self.select
+
+    def __call__(self, event, info):
+        if event == "canon_start":
+            if self._depth > 0:
+                self._depth = self._depth + 1
+            elif self._selected(info["smarts"]):
+                self._depth = 1
+                self.profiled.append(info["smarts"])
+                if self.output == "pstats":
+                    self._profiler = cProfile.Profile()
+                    self._profiler.enable()
+                else:
+                    self._profiler = _StackTracer(info["kind"])
+                    self._profiler.start()
+        elif event == "canon_end" and self._depth > 0:
+            self._depth = self._depth - 1
+            if self._depth == 0:
+                self._stop()
+
+    def _stop(self):
+        profiler = self._profiler
+        self._profiler = None
+        if self.output == "pstats":
+            profiler.disable()
+            if self._pstats is None:
+                self._pstats = pstats.Stats(profiler)
+            else:
+                self._pstats.add(profiler)
+        else:
+            profiler.stop()
+            for key, seconds in profiler.folded.items():
+                self.folded[key] = self.folded.get(key, 0.0) + seconds
+
+    def stats(self):
+        """
+        Returns the accumulated pstats.Stats, or None if nothing was profiled.
+        """
+        return self._pstats
+
+    def dump(self, path):
+        """
+        Writes the accumulated profile to a file.
+        """
+        if self.output == "pstats":
+            if self._pstats is None:
+                raise ValueError("no input has been profiled")
+            self._pstats.dump_stats(path)
+        else:
+            with open(path, "w") as f:
+                for key, seconds in sorted(self.folded.items()):
+                    us = int(round(seconds * 1e6))
+                    if us > 0:
+                        f.write("%s %d\n" % (key.replace(" ", "_"), us))
@@ -0,0 +1,198 @@
+from rdkit import Chem
+import rdkit
+from rdcanon.main import Graph, canon_atom_token
+from rdcanon.token_parser import recursive_compare, scan_bracket
+from rdkit.Chem.rdchem import BondDir, BondStereo
+
+
+def _splice(item, end, old_length, new_text):
+    # replaces the token or bond ending at `end` in a traversal and moves the positions after it
+    delta = len(new_text) - old_length
+    sm = item["smarts"]
+    item["smarts"] = sm[: end - old_length] + new_text + sm[end:]
+    for positions in (item["node_map"], item["bond_map"]):
+        for k in positions:
+            if positions[k] >= end:
+                positions[k] = positions[k] + delta
+
+
+class CanonState:
+    """
+    The canonical form of a SMARTS pattern, kept up to date through atom token and bond edits.
+
+    The graph, the canonical token and score of every atom and the tied best traversals are kept
+    between edits. An atom edit canonicalizes only the new token. If the new score compares with
+    the score of every other atom as the old one did, the traversal search would make the same
+    choices, so the tied traversals are kept and only regenerated with the new token. A bond edit
+    keeps every token, and the traversals as long as the bond type is unchanged.
+
+    Atoms are numbered as graph nodes, in input order without the hydrogen atoms merged into
+    their neighbours. Atoms and bonds cannot be added or removed.
+
+    Args:
+        smarts (str or Mol): The SMARTS pattern or query mol.
+        mapping (bool, optional): Whether the canonical SMARTS keeps atom maps. Defaults to False.
+        embedding (str or dict, optional): The query primitive frequency dictionary to use. Defaults to "drugbank".
+    """
+
+    def __init__(self, smarts, mapping=False, embedding="drugbank"):
+        self.mapping = mapping
+        self.embedding = embedding
+        self.graph = Graph()
+        self.graph.graph_from_smarts(smarts, embedding)
+        self.searches = 0
+        self.search_reused = False
+        self._search()
+        self._render()
+
+    def _search(self):
+        self.top_tied = self.graph.all_depth_first_search()
+        self.searches = self.searches + 1
+        self.search_reused = False
+
+    def _render(self):
+        for item in self.top_tied:
+            item["path_scores"] = self.graph.path_scores(item["path"])
+        self.graph.top_tied = self.top_tied
+        self.smarts = self.graph.regen_tied(self.top_tied, self.mapping)
+
+    def _rank(self, index, score):
+        # how a score compares with the score of every other atom
+        out = []
+        for node in self.graph.nodes:
+            if node.index != index:
+                out.append(
+                    (
+                        recursive_compare(score, node.serialized_score),
+                        score == node.serialized_score,
+                    )
+                )
+        return out
+
+    def _perceive_stereo(self):
+        # whether double bonds can carry stereo depends on the whole pattern, as in
+        # Graph.graph_from_smarts; defined cis and trans bonds cannot be edited
+        item = self.top_tied[0]
+        mol = Chem.MolFromSmarts(item["smarts"])
+        rdkit.Chem.rdmolops.FastFindRings(mol)
+        rdkit.Chem.rdmolops.FindPotentialStereoBonds(mol)
+        order = [node.index for node, _, _ in item["path"]]
+        stereo = self.graph.bond_indices_to_stereo
+        for bond in mol.GetBonds():
+            i = order[bond.GetBeginAtomIdx()]
+            j = order[bond.GetEndAtomIdx()]
+            if stereo[(i, j)] in (BondStereo.STEREONONE, BondStereo.STEREOANY):
+                stereo[(i, j)] = bond.GetStereo()
+                stereo[(j, i)] = bond.GetStereo()
+
+    def atom_tokens(self):
+        """
+        Returns the canonical token of every atom, in node order.
+        """
+        return [node.data["smarts"] for node in self.graph.nodes]
+
+    def set_atom(self, index, token):
+        """
+        Replaces the query of one atom and updates the canonical SMARTS.
+
+        Args:
+            index (int): The node index of the atom.
+            token (str): The new atom token, e.g. "[C;H0;+0]". An atom map and @ or @@ are read
+                as in the input SMARTS, with the neighbours in input order.
+
+        Returns:
+            str: The canonical SMARTS after the edit.
+        """
+        nodes = self.graph.nodes
+        if index < 0 or index >= len(nodes):
+            raise ValueError("No atom with index %d" % index)
+        mol = Chem.MolFromSmarts(token)
+        if not mol or mol.GetNumAtoms() != 1:
+            raise ValueError("Expected a single atom token, got %r" % token)
+        atom = mol.GetAtomWithIdx(0)
+        atom_sm = atom.GetSmarts()
+        if atom_sm == "[H]" or atom_sm == "[#1]":
+            raise ValueError("Hydrogen atoms are not graph nodes")
+
+        # the mark is read as in Graph.graph_from_smarts, ignoring recursive SMARTS
+        mark = scan_bracket(token, 0)[1] if token[0] == "[" else ""
+        if mark == "@@":
+            stereo = Chem.rdchem.ChiralType.CHI_TETRAHEDRAL_CW
+        elif mark == "@":
+            stereo = Chem.rdchem.ChiralType.CHI_TETRAHEDRAL_CCW
+        else:
+            stereo = atom.GetChiralTag()
+
+        node = nodes[index]
+        old_length = len(node.data["smarts"])
+        sm, sc = canon_atom_token(atom_sm, self.embedding)
+        reuse = self._rank(index, sc) == self._rank(index, node.serialized_score)
+        node.set_token(sm, sc)
+        node.data["stereo"] = stereo
+
+        if reuse:
+            for item in self.top_tied:
+                _splice(item, item["node_map"][index], old_length, sm)
+            self.search_reused = True
+        else:
+            self._search()
+        self._render()
+        return self.smarts
+
+    def set_bond(self, begin, end, bond):
+        """
+        Replaces the query of one bond and updates the canonical SMARTS.
+
+        Args:
+            begin (int): The node index of one atom of the bond.
+            end (int): The node index of the other atom.
+            bond (str): The new bond token, e.g. "=" or "-;!@". Directional bonds, and bonds of
+                defined double bond stereo, cannot be edited.
+
+        Returns:
+            str: The canonical SMARTS after the edit.
+        """
+        graph = self.graph
+        key = (begin, end)
+        if key not in graph.bond_indices_to_smarts:
+            raise ValueError("No bond between atoms %d and %d" % key)
+        old_sm = graph.bond_indices_to_smarts[key]
+        if (
+            "/" in old_sm
+            or "\\" in old_sm
+            or graph.bond_indices_to_stereo[key]
+            not in (BondStereo.STEREONONE, BondStereo.STEREOANY)
+        ):
+            raise ValueError("Bonds with double bond stereo cannot be edited")
+
+        node_a = graph.nodes[begin]
+        node_b = graph.nodes[end]
+        mol = Chem.MolFromSmarts(node_a.data["smarts"] + bond + node_b.data["smarts"])
+        if not mol or mol.GetNumAtoms() != 2 or mol.GetNumBonds() != 1:
+            raise ValueError("Expected a single bond token, got %r" % bond)
+        new_bond = mol.GetBondWithIdx(0)
+        if new_bond.GetBondDir() != BondDir.NONE or "/" in bond or "\\" in bond:
+            raise ValueError("Directional bonds cannot be edited")
+        bond_sm = new_bond.GetSmarts()
+        bond_type = new_bond.GetBondType()
+
+        old_type = None
+        for node, other in ((node_a, node_b), (node_b, node_a)):
+            k = node.bonds.index(other)
+            old_type = node.bond_types[k]
+            node.bond_types[k] = bond_type
+            node.bond_smarts[k] = bond_sm
+        graph.bond_indices_to_smarts[(begin, end)] = bond_sm
+        graph.bond_indices_to_smarts[(end, begin)] = bond_sm
+
+        # an empty bond token may not be where its recorded position says
+        if old_type == bond_type and len(old_sm) > 0:
+            for item in self.top_tied:
+                k = key if key in item["bond_map"] else (end, begin)
+                _splice(item, item["bond_map"][k], len(old_sm), bond_sm)
+            self.search_reused = True
+        else:
+            self._search()
+        self._perceive_stereo()
+        self._render()
+        return self.smarts
@@ -0,0 +1,70 @@
+import hashlib
+import json
+from rdkit.Chem.rdchem import BondStereo, ChiralType
+from rdcanon.cache import embedding_fingerprint
+from rdcanon.main import Graph
+
+# Keys with the same KEY_VERSION are comparable between processes, machines and rdcanon
+# releases. It is increased whenever the canonical structure or the serialization changes.
+KEY_VERSION = 2
+
+KEY_SIZE = 16
+
+
+def _has_stereo(g):
+    # whether the rendered SMARTS can carry tetrahedral or double bond stereo
+    for node in g.nodes:
+        if node.data["stereo"] in (
+            ChiralType.CHI_TETRAHEDRAL_CW,
+            ChiralType.CHI_TETRAHEDRAL_CCW,
+        ):
+            return True
+    for stereo in g.bond_indices_to_stereo.values():
+        if stereo not in (BondStereo.STEREONONE, BondStereo.STEREOANY):
+            return True
+    for bond_sm in g.bond_indices_to_smarts.values():
+        if "/" in bond_sm or "\\" in bond_sm:
+            return True
+    return False
+
+
+def canon_key(smarts, embedding="drugbank", fast=False):
+    """
+    Returns a fixed-width binary key of a SMARTS pattern, equal for patterns that canonicalize identically.
+
+    The key is a BLAKE2b digest of the canonical SMARTS without atom maps, together with the
+    embedding. The first byte is KEY_VERSION.
+
+    With fast=True, the canonical SMARTS is not rendered for patterns without tetrahedral or
+    double bond stereo. Their key is a digest of the canonical atom tokens and the bonds and ring
+    closures between atoms numbered in canonical order, which determine the canonical SMARTS.
+    Patterns with stereo are rendered, so stereoisomers never share a key. Fast and full keys of
+    the same pattern differ, but either kind alone can be used for deduplication.
+
+    Args:
+        smarts (str): The SMARTS pattern.
+        embedding (str or dict, optional): The query primitive frequency dictionary to use. Defaults to "drugbank".
+        fast (bool, optional): Whether to skip rendering patterns without stereo. Defaults to False.
+
+    Returns:
+        bytes: The KEY_SIZE byte key. Use .hex() for a text key.
+    """
+    g = Graph()
+    g.graph_from_smarts(smarts, embedding)
+    structure = None
+    rendered = None
+    if fast and not _has_stereo(g):
+        structure = g.canonical_structure(g.all_depth_first_search())
+    else:
+        rendered = g.recreate_molecule(False)
+
+    payload = [
+        KEY_VERSION,
+        "fast" if fast else "full",
+        embedding_fingerprint(embedding),
+        structure,
+        rendered,
+    ]
+    data = json.dumps(payload, separators=(",", ":")).encode()
+    digest = hashlib.blake2b(data, digest_size=KEY_SIZE - 1).digest()
+    return bytes([KEY_VERSION]) + digest
@@ -1,12 +1,16 @@
 from rdkit import Chem
-from rdkit.Chem import AllChem
+from rdkit.Chem import AllChem, rdChemReactions
+import base64
 import re
 from rdcanon.token_parser import (
-    order_token_canon,
+    canon_token,
     recursive_compare,
-    parse_smarts_total,
+    scan_smarts,
+    token_cache_stats,
 )
+from rdcanon.hooks import active_hooks, fire
 import rdkit
+import time
 from collections import deque
 from rdcanon.askcos_prims import prims as prims1
 import random
@@ -55,6 +59,87 @@ def custom_key2(item1t, item2t):
     return recursive_compare(item1, item2)
 
 
+def smarts_label(query):
+    """
+    Returns a SMARTS string, or writes a query mol or reaction as SMARTS, for cache keys and hooks.
+    """
+    if type(query) == str:
+        return query
+    if isinstance(query, rdChemReactions.ChemicalReaction):
+        return AllChem.ReactionToSmarts(query)
+    return Chem.MolToSmarts(query)
+
+
+def query_mol(mol):
+    """
+    Returns a copy of an input mol to build a Graph from.
+
+    Query mols, e.g. from Chem.MolFromSmarts or the templates of a ChemicalReaction, are copied as
+    they are. A mol with plain atoms, e.g. from Chem.MolFromSmiles, has no query tokens to read and
+    is converted through its SMARTS.
+    """
+    if not isinstance(mol, Chem.Mol):
+        raise ValueError("expected a SMARTS string or an RDKit Mol")
+    for atom in mol.GetAtoms():
+        if not atom.HasQuery():
+            return Chem.MolFromSmarts(Chem.MolToSmarts(mol))
+    return Chem.Mol(mol)
+
+
+def has_chiral_atoms(mol):
+    for atom in mol.GetAtoms():
+        if atom.GetChiralTag() != Chem.rdchem.ChiralType.CHI_UNSPECIFIED:
+            return True
+    return False
+
+
+atom_query_cache = {}
+
+
+def atom_query(token):
+    """
+    Returns how RDKit writes an atom token of a SMARTS pattern, and whether it matches hydrogen.
+
+    Both depend only on the token text, so they are computed once per distinct token and cached.
+
+    Args:
+        token (str): The atom token as written in the SMARTS, e.g. "[C@@H:3]" or "c".
+
+    Returns:
+        tuple: Atom.GetSmarts() of the token and Chem.HasQueryHs of the token.
+    """
+    if token not in atom_query_cache:
+        mol = Chem.MolFromSmarts(token)
+        atom_query_cache[token] = (
+            mol.GetAtomWithIdx(0).GetSmarts(),
+            Chem.HasQueryHs(mol)[0],
+        )
+    return atom_query_cache[token]
+
+
+def canon_atom_token(
+    token, embedding, min_num_explicit_hs=None, opt_num_explicit_hs=None
+):
+    """
+    Canonicalizes an atom token as written by RDKit, keeping its atom map.
+
+    Args:
+        token (str): The atom token, e.g. from Atom.GetSmarts().
+        embedding (str or dict): The query primitive frequency dictionary to use.
+
+    Returns:
+        tuple: The canonical token and its score.
+    """
+    atom_map = re.findall(r":\d+]", token)
+    return canon_token(
+        re.sub(r":\d+]", "]", token),
+        atom_map[0][0:-1] if len(atom_map) > 0 else None,
+        embedding,
+        min_num_explicit_hs,
+        opt_num_explicit_hs,
+    )
+
+
 class Node:
     def __init__(self, index, data):
         self.index = index
@@ -73,33 +158,98 @@ class Node:
             self.bond_stereo.append(bond_stereo)
             self.bond_smarts.append(bond_smarts)
 
+    def set_token(self, sm, sc):
+        single_score = sc
+        while True:
+            if type(single_score) == list or type(single_score) == tuple:
+                single_score = single_score[0]
+            else:
+                break
+
+        self.score_original = 1 / single_score
+        self.serialized_score = sc
+        self.data["smarts"] = sm
+
     def __repr__(self):
         return f"Node({self.index}, {self.data['smarts']})"
 
 
 class Graph:
-    def __init__(self, v=False):
+    def __init__(self, v=False, stats=None):
         self.nodes = []
         self.top_score = 0
+        self.top_tied = []
         self.v = v
+        self.stats = stats
+        self.hooks = active_hooks()
+        self.smarts = None
         self.bond_indices_to_smarts = {}
         self.bond_indices_to_stereo = {}
         self.bond_indices_to_relative_stereo = {}
         # self.atom_to_original_chiral_tag = {}
 
     def graph_from_smarts(self, smarts, embedding):
-        proton_mol = Chem.MolFromSmiles("[#1]")
-        
-        mol = Chem.MolFromSmarts(smarts)
-        
-        if Chem.HasQueryHs(mol)[0]:
+        stats = self.stats
+        hooks = self.hooks
+        timed = stats is not None or hooks is not None
+        if timed:
+            t0 = time.perf_counter()
+            t_start = t0
+
+        from_mol = type(smarts) != str
+        if from_mol:
+            mol = query_mol(smarts)
+            if has_chiral_atoms(mol):
+                # tetrahedral stereo is read from the @ and @@ of the SMARTS text below
+                smarts = Chem.MolToSmarts(mol)
+                from_mol = False
+            elif hooks is not None or self.v:
+                smarts = smarts_label(mol)
+        if not from_mol:
+            mol = Chem.MolFromSmarts(smarts)
+        self.smarts = smarts
+        # an empty pattern parses to a mol without atoms
+        if not mol or mol.GetNumAtoms() == 0:
+            raise ValueError("Invalid SMARTS provided")
+
+        if timed:
+            t1 = time.perf_counter()
+        if stats is not None:
+            stats.add_time("rdkit_parse", t1 - t0)
+
+        # each atom token of the text is lexed once; the scan gives the tetrahedral marks, and
+        # the cached RDKit text and hydrogen check of the token stand in for the atoms of mol
+        queries = None
+        if not from_mol:
+            spans, marks, _ = scan_smarts(smarts)
+            if len(spans) == mol.GetNumAtoms():
+                queries = [atom_query(smarts[i:j]) for i, j in spans]
+        else:
+            # a mol input without tetrahedral stereo needs no tokens
+            marks = None
+
+        if timed:
+            t0 = time.perf_counter()
+        if stats is not None:
+            stats.add_time("scan", t0 - t1)
+
+        if queries is None:
+            has_query_hs = Chem.HasQueryHs(mol)[0]
+        else:
+            has_query_hs = any(is_h for _, is_h in queries)
+        if has_query_hs:
             mol = Chem.AdjustQueryProperties(Chem.MergeQueryHs(mol))
             # print(Chem.MolToSmarts(mol))
-        if not mol:
-            raise ValueError("Invalid SMARTS provided")
+            # the atoms are renumbered and their queries changed
+            queries = None
 
         Chem.SanitizeMol(mol, sanitizeOps=Chem.SanitizeFlags.SANITIZE_NONE)
 
+        if timed:
+            t1 = time.perf_counter()
+        if stats is not None:
+            stats.add_time("rdkit_parse", t1 - t0)
+
         # Create nodes for each atom
         if self.v:
             print("input SMARTS:", smarts)
@@ -107,19 +257,32 @@ class Graph:
             print()
             print("token embeddings")
 
-        num_atoms = len(mol.GetAtoms())
-        atoms_seq, bonds_seq = parse_smarts_total(smarts, num_atoms)
+        if stats is not None:
+            token_hits = token_cache_stats["hits"]
+            token_misses = token_cache_stats["misses"]
+
+        # dictionary embeddings are not in the token cache; repeated tokens of this
+        # SMARTS are canonicalized once
+        memo = {} if type(embedding) == dict else None
 
         old_idx_to_new_idx = {}
         nnn = 0
         for atom in mol.GetAtoms():
+            idx = atom.GetIdx()
             # is it supposed to make sense?
-            if "@@" in atoms_seq[atom.GetIdx()]:
+            if marks is None:
+                pass
+            elif marks[idx] == "@@":
                 atom.SetChiralTag(Chem.rdchem.ChiralType.CHI_TETRAHEDRAL_CW)
-            elif "@" in atoms_seq[atom.GetIdx()]:
+            elif marks[idx] == "@":
                 atom.SetChiralTag(Chem.rdchem.ChiralType.CHI_TETRAHEDRAL_CCW)
 
-            if atom.GetSmarts() == "[H]" or atom.GetSmarts() == "[#1]":
+            # RDKit writes the query of an atom once, for the hydrogen check and the token
+            if queries is None:
+                atom_sm = atom.GetSmarts()
+            else:
+                atom_sm = queries[idx][0]
+            if atom_sm == "[H]" or atom_sm == "[#1]":
                 continue
 
             min_num_explicit_hs = 0
@@ -137,82 +300,101 @@ class Graph:
                 opt_num_explicit_hs = None
 
             node_data = {
-                "smarts": atom.GetSmarts(),
+                "smarts": atom_sm,
                 "stereo": atom.GetChiralTag(),
             }
             n = Node(nnn, node_data)
-            atom_map = re.findall(r":\d+]", n.data["smarts"])
 
-            if len(atom_map) > 0:
-                sm, sc, _ = order_token_canon(
-                    re.sub(r":\d+]", "]", n.data["smarts"]),
-                    atom_map[0][0:-1],
-                    embedding,
-                    min_num_explicit_hs,
-                    opt_num_explicit_hs
-                )
+            if timed:
+                t1 = time.perf_counter()
+
+            if memo is not None and atom_sm in memo:
+                sm, sc = memo[atom_sm]
             else:
-                sm, sc, _ = order_token_canon(
-                    re.sub(r":\d+]", "]", n.data["smarts"]),
-                    None,
+                sm, sc = canon_atom_token(
+                    atom_sm,
                     embedding,
                     min_num_explicit_hs,
-                    opt_num_explicit_hs
+                    opt_num_explicit_hs,
                 )
+                if memo is not None:
+                    memo[atom_sm] = (sm, sc)
+
+            if timed:
+                dt = time.perf_counter() - t1
+                if stats is not None:
+                    stats.add_time("token_canon", dt)
+                if hooks is not None:
+                    fire(
+                        hooks,
+                        "token",
+                        smarts=smarts,
+                        index=nnn,
+                        token=n.data["smarts"],
+                        canonical=sm,
+                        length=len(sm),
+                        seconds=dt,
+                    )
 
             if self.v:
                 print(">", n.data["smarts"], sm, sc)
 
-            single_score = sc
-            while True:
-                if type(single_score) == list or type(single_score) == tuple:
-                    single_score = single_score[0]
-                else:
-                    break
-
-            n.score_original = 1 / single_score
-            n.serialized_score = sc
-            n.data["smarts"] = sm
-            old_idx_to_new_idx[atom.GetIdx()] = nnn
+            n.set_token(sm, sc)
+            old_idx_to_new_idx[idx] = nnn
             nnn = nnn + 1
             self.nodes.append(n)
         if self.v:
             print()
 
+        if stats is not None:
+            stats.atoms = stats.atoms + len(self.nodes)
+            stats.token_cache_hits = (
+                stats.token_cache_hits + token_cache_stats["hits"] - token_hits
+            )
+            stats.token_cache_misses = (
+                stats.token_cache_misses + token_cache_stats["misses"] - token_misses
+            )
+
         rdkit.Chem.rdmolops.FastFindRings(mol)
         rdkit.Chem.rdmolops.FindPotentialStereoBonds(mol)
         for bond in mol.GetBonds():
+            start_idx_o = bond.GetBeginAtomIdx()
+            end_idx_o = bond.GetEndAtomIdx()
             if (
-                bond.GetBeginAtomIdx() not in old_idx_to_new_idx
-                or bond.GetEndAtomIdx() not in old_idx_to_new_idx
+                start_idx_o not in old_idx_to_new_idx
+                or end_idx_o not in old_idx_to_new_idx
             ):
                 continue
-            start_idx_o = bond.GetBeginAtomIdx()
-            end_idx_o = bond.GetEndAtomIdx()
 
-            start_idx = old_idx_to_new_idx[bond.GetBeginAtomIdx()]
-            end_idx = old_idx_to_new_idx[bond.GetEndAtomIdx()]
+            start_idx = old_idx_to_new_idx[start_idx_o]
+            end_idx = old_idx_to_new_idx[end_idx_o]
+
+            # RDKit writes the query of a bond once
+            bond_sm = bond.GetSmarts()
+            bond_type = bond.GetBondType()
+            bond_dir = bond.GetBondDir()
+            bond_stereo = bond.GetStereo()
 
             self.nodes[start_idx].add_bond(
                 self.nodes[end_idx],
-                bond.GetBondType(),
-                bond.GetBondDir(),
-                bond.GetSmarts(),
+                bond_type,
+                bond_dir,
+                bond_sm,
             )
             self.nodes[end_idx].add_bond(
                 self.nodes[start_idx],
-                bond.GetBondType(),
-                bond.GetBondDir(),
-                bond.GetSmarts(),
+                bond_type,
+                bond_dir,
+                bond_sm,
             )
 
-            self.bond_indices_to_stereo[(start_idx, end_idx)] = bond.GetStereo()
-            self.bond_indices_to_stereo[(end_idx, start_idx)] = bond.GetStereo()
+            self.bond_indices_to_stereo[(start_idx, end_idx)] = bond_stereo
+            self.bond_indices_to_stereo[(end_idx, start_idx)] = bond_stereo
 
             bond_a = None
             bond_b = None
 
-            if bond.GetStereo() != Chem.rdchem.BondStereo.STEREONONE:
+            if bond_stereo != Chem.rdchem.BondStereo.STEREONONE:
 
                 atom = mol.GetAtomWithIdx(start_idx_o)
                 neighbors = atom.GetNeighbors()
@@ -249,15 +431,21 @@ class Graph:
                         break
 
             if bond_a is not None and bond_b is not None:
-                self.bond_indices_to_relative_stereo[(bond_a, bond_b)] = (
-                    bond.GetStereo()
-                )
-                self.bond_indices_to_relative_stereo[(bond_b, bond_a)] = (
-                    bond.GetStereo()
-                )
-
-            self.bond_indices_to_smarts[(start_idx, end_idx)] = bond.GetSmarts()
-            self.bond_indices_to_smarts[(end_idx, start_idx)] = bond.GetSmarts()
+                self.bond_indices_to_relative_stereo[(bond_a, bond_b)] = bond_stereo
+                self.bond_indices_to_relative_stereo[(bond_b, bond_a)] = bond_stereo
+
+            self.bond_indices_to_smarts[(start_idx, end_idx)] = bond_sm
+            self.bond_indices_to_smarts[(end_idx, start_idx)] = bond_sm
+
+        if hooks is not None:
+            fire(
+                hooks,
+                "graph_build",
+                smarts=smarts,
+                atoms=len(self.nodes),
+                bonds=len(self.bond_indices_to_smarts) // 2,
+                seconds=time.perf_counter() - t_start,
+            )
 
     def replace_at_index(self, original, new_text, start, length):
         end = start + length
@@ -266,11 +454,43 @@ class Graph:
     def insert_at_index(self, original, new_text, start):
         return original[:start] + new_text + original[start:]
 
-    def find_hamiltonian_paths_iterative_sm(self, start_node, best_seen):
-        paths = []
-        smiles_out = []
-        node_maps_out = []
-        bond_maps_out = []
+    def path_scores(self, path):
+        path_ar = []
+        for rr in path:
+            path_ar.append(rr[0].serialized_score)
+            if rr[1] == None:
+                bond_v = "None"
+            else:
+                bond_v = rr[1].name
+            path_ar.append([bond_value_map[bond_v]])
+        return path_ar
+
+    def keep_tied(self, top_tied, item):
+        """
+        Adds a completed path to the running list of paths tied for the best score.
+
+        The list holds the paths that compare equal to the best path seen so far, in the order
+        they were found, which is the head of a stable sort of every completed path.
+
+        Args:
+            top_tied (list): The running list, modified in place.
+            item (dict): The completed path, with its "path_scores".
+
+        Returns:
+            list: The running list.
+        """
+        if len(top_tied) == 0:
+            top_tied.append(item)
+            return top_tied
+        c = custom_key2(item, top_tied[0])
+        if c < 0:
+            top_tied[:] = [item]
+        elif c == 0:
+            top_tied.append(item)
+        return top_tied
+
+    def find_hamiltonian_paths_iterative_sm(self, start_node, best_seen, top_tied):
+        stats = self.stats
 
         start_node = (self.nodes[start_node], None, None)
 
@@ -296,6 +516,8 @@ class Graph:
                 )
             ]
         )
+        if stats is not None:
+            stats.states_pushed = stats.states_pushed + 1
         nn = 0
         while stack:
             (
@@ -310,6 +532,8 @@ class Graph:
                 this_bond_to_sm_idx,
                 this_branch_level,
             ) = stack.popleft()
+            if stats is not None:
+                stats.states_popped = stats.states_popped + 1
             if nn > 10000:
                 raise ValueError(
                     "Too many iterations, please share SMARTS with us as an issue on github"
@@ -344,15 +568,25 @@ class Graph:
                                 )
 
                         ring_num = ring_num + 1
+                        if stats is not None:
+                            stats.ring_closures = stats.ring_closures + 1
 
                 if this_branch_level > 0:
                     for i in range(this_branch_level):
                         sm_so_far = sm_so_far + ")"
 
-                paths.append(path)
-                smiles_out.append(sm_so_far)
-                node_maps_out.append(this_node_to_sm_idx)
-                bond_maps_out.append(this_bond_to_sm_idx)
+                if stats is not None:
+                    stats.paths = stats.paths + 1
+                item = {
+                    "path_scores": self.path_scores(path),
+                    "path": path,
+                    "smarts": sm_so_far,
+                    "node_map": this_node_to_sm_idx,
+                    "bond_map": this_bond_to_sm_idx,
+                }
+                if self.v:
+                    print("> path", item)
+                self.keep_tied(top_tied, item)
                 continue
 
             all_neighbors_visited = True
@@ -389,6 +623,8 @@ class Graph:
                                 )
 
                         ring_num = ring_num + 1
+                        if stats is not None:
+                            stats.ring_closures = stats.ring_closures + 1
 
             if neighbors_not_visited > 1:
                 this_branch_level = this_branch_level + 1
@@ -399,6 +635,8 @@ class Graph:
                 jnode = junction.pop()
                 sm_so_far = sm_so_far + ")"
                 this_branch_level = this_branch_level - 1
+                if stats is not None:
+                    stats.states_pushed = stats.states_pushed + 1
                 stack.append(
                     (
                         jnode,
@@ -482,6 +720,8 @@ class Graph:
 
                         new_this_node_to_sm_idx[neighbor.index] = len(tsm_so_far)
 
+                        if stats is not None:
+                            stats.states_pushed = stats.states_pushed + 1
                         stack.append(
                             (
                                 nei,
@@ -496,8 +736,10 @@ class Graph:
                                 this_branch_level,
                             )
                         )
+                    elif stats is not None:
+                        stats.prefixes_pruned = stats.prefixes_pruned + 1
 
-        return paths, best_seen, smiles_out, node_maps_out, bond_maps_out
+        return top_tied, best_seen
 
     def all_depth_first_search(self):
         if self.v:
@@ -510,71 +752,75 @@ class Graph:
         for i, nd in enumerate(node_data):
             if nd == n:
                 top_nodes.append(i)
+        if self.stats is not None:
+            self.stats.tied_start_nodes = self.stats.tied_start_nodes + len(top_nodes)
+        if self.hooks is not None:
+            fire(
+                self.hooks,
+                "search_start",
+                smarts=self.smarts,
+                atoms=len(self.nodes),
+                tied_start_nodes=len(top_nodes),
+            )
 
-        poss_paths = []
-        all_paths_scored = []
-        path_idx = 0
+        # only the paths tied for the best score are kept while searching
+        top_tied = []
         best_seen = []
         for idx, h in enumerate(self.nodes):
             if idx not in top_nodes:
                 continue
 
-            all_paths, new_best_seen, sm_o, node_map, bond_map = (
-                self.find_hamiltonian_paths_iterative_sm(h.index, best_seen)
+            top_tied, best_seen = self.find_hamiltonian_paths_iterative_sm(
+                h.index, best_seen, top_tied
             )
-            best_seen = new_best_seen
-
-            for i, r in enumerate(all_paths):
-                path_ar = []
-                for rr in r:
-                    path_ar.append(rr[0].serialized_score)
-                    if rr[1] == None:
-                        bond_v = "None"
-                    else:
-                        bond_v = rr[1].name
 
-                    path_ar.append([bond_value_map[bond_v]])
-                all_paths_scored.append(
-                    {
-                        "path_scores": path_ar,
-                        "path": r,
-                        "smarts": sm_o[i],
-                        "node_map": node_map[i],
-                        "bond_map": bond_map[i],
-                    }
-                )
-                if self.v:
-                    print("> path", path_idx)
-                    for rr in r:
-                        print(">>", rr[0], rr[0].serialized_score, rr[1])
-                    print(">>", path_ar)
-
-                poss_paths.append(r)
-                path_idx = path_idx + 1
+        # paths that compare equal to the best one but are not identical to it are dropped
+        top_score = top_tied[0]["path_scores"]
+        for i, p in enumerate(top_tied):
+            if p["path_scores"] != top_score:
+                top_tied = top_tied[:i]
+                break
 
         if self.v:
             print()
-            print("unsorted paths")
-            for kk in all_paths_scored:
+            print("tied paths")
+            for kk in top_tied:
                 print(">", kk)
 
-        these_weights = sorted(all_paths_scored, key=cmp_to_key(custom_key2))
+        return top_tied
+
+    def canonical_structure(self, top_tied):
+        """
+        Describes the graph with atoms numbered in the order of a best traversal, without stereo.
 
-        if self.v:
-            print()
-            print("sorted paths")
-            for kk in these_weights:
-                print(">", kk)
+        Every tied traversal is described and the smallest description is kept, so the result does
+        not depend on which tied traversal was found first.
 
-        top_tied = []
-        top_score = these_weights[0]["path_scores"]
-        for i, p in enumerate(these_weights):
-            if p["path_scores"] == top_score:
-                top_tied.append(p)
-            else:
-                break
+        Args:
+            top_tied (list): The tied best paths, as returned by all_depth_first_search.
 
-        return top_tied
+        Returns:
+            list: The atom tokens without atom map numbers and the sorted (rank, rank, bond token)
+            edges, with directional bonds written as "/". Path scores are left out, since the score
+            of a canonical token can depend on how the input token was written.
+        """
+        out = None
+        for p in top_tied:
+            rank = {}
+            for r, (node, _, _) in enumerate(p["path"]):
+                rank[node.index] = r
+            tokens = [
+                re.sub(r":\d+\]$", "]", node.data["smarts"]) for node, _, _ in p["path"]
+            ]
+            edges = []
+            for (i, j), bond_sm in self.bond_indices_to_smarts.items():
+                if rank[i] < rank[j]:
+                    edges.append([rank[i], rank[j], bond_sm.replace("\\", "/")])
+            edges.sort()
+            desc = [tokens, edges]
+            if out is None or desc < out:
+                out = desc
+        return out
 
     def can_transform(self, set1, set2):
         """
@@ -612,14 +858,59 @@ class Graph:
         return False
 
     def recreate_molecule(self, mapping):
+        stats = self.stats
+        hooks = self.hooks
+        timed = stats is not None or hooks is not None
+        if timed:
+            t0 = time.perf_counter()
+
         top_scores = self.all_depth_first_search()
+        self.top_tied = top_scores
+
+        if timed:
+            t1 = time.perf_counter()
+        if hooks is not None:
+            fire(
+                hooks,
+                "search_end",
+                smarts=self.smarts,
+                atoms=len(self.nodes),
+                tied_paths=len(top_scores),
+                seconds=t1 - t0,
+            )
+        if stats is not None:
+            stats.add_time("search", t1 - t0)
+            stats.tied_paths = stats.tied_paths + len(top_scores)
+
+        return self.regen_tied(top_scores, mapping)
+
+    def regen_tied(self, top_scores, mapping):
+        """
+        Regenerates every tied best path and returns the smallest canonical SMARTS.
+
+        Args:
+            top_scores (list): The tied best paths, as returned by all_depth_first_search. They
+                are not modified.
+            mapping (bool): Whether to return the SMARTS with atom maps.
+
+        Returns:
+            str: The canonical SMARTS.
+        """
+        stats = self.stats
+        hooks = self.hooks
+        timed = stats is not None or hooks is not None
+        if timed:
+            t1 = time.perf_counter()
+        if stats is not None:
+            stats.regen_calls = stats.regen_calls + len(top_scores)
+
         sms = []
         for top_score in top_scores:
             unmapped, mapped = self.regen_molecule(
                 top_score["path"],
                 top_score["smarts"],
-                top_score["node_map"],
-                top_score["bond_map"],
+                dict(top_score["node_map"]),
+                dict(top_score["bond_map"]),
             )
 
             sms.append(
@@ -634,6 +925,20 @@ class Graph:
         self.top_score = sms[0][2]
         self.unmapped_canon = sms[0][0]
 
+        if timed:
+            dt = time.perf_counter() - t1
+        if stats is not None:
+            stats.add_time("regen", dt)
+        if hooks is not None:
+            fire(
+                hooks,
+                "regen",
+                smarts=self.smarts,
+                tied_paths=len(top_scores),
+                length=len(sms[0][1] if mapping else sms[0][0]),
+                seconds=dt,
+            )
+
         if mapping:
             return sms[0][1]
         else:
@@ -1058,6 +1363,7 @@ class Reaction:
         remapping=False,
         v=False,
         repl_dict={},
+        stats=None,
     ):
         self.reactants = []
         self.agents = []
@@ -1070,20 +1376,11 @@ class Reaction:
         self.index = 1
         self.index_map = {}
         self.repl_dict = repl_dict
+        self.stats = stats
 
     def _load_reactants(self, reactants):
         for r_sm in reactants:
-            is_grouped = False
-            if r_sm[0] == "(":
-                r_sm = r_sm[1:-1]
-                is_grouped = True
-            else:
-                r_sm = r_sm
-
-            if "." in r_sm:
-                smss = r_sm.split(".")
-            else:
-                smss = [r_sm]
+            r_sm, smss, is_grouped = self.split_component(r_sm)
             grouped = []
             for sm in smss:
                 san_sm, ts, unmapped_canon = canon_smarts(
@@ -1092,6 +1389,7 @@ class Reaction:
                     self.embedding,
                     return_score=True,
                     repl_dict=self.repl_dict,
+                    stats=self.stats,
                 )
                 grouped.append(
                     {
@@ -1121,17 +1419,7 @@ class Reaction:
 
     def _load_agents(self, agents):
         for r_sm in agents:
-            is_grouped = False
-            if r_sm[0] == "(":
-                r_sm = r_sm[1:-1]
-                is_grouped = True
-            else:
-                r_sm = r_sm
-
-            if "." in r_sm:
-                smss = r_sm.split(".")
-            else:
-                smss = [r_sm]
+            r_sm, smss, is_grouped = self.split_component(r_sm)
             grouped = []
             for sm in smss:
                 san_sm, ts, unmapped_canon = canon_smarts(
@@ -1140,6 +1428,7 @@ class Reaction:
                     self.embedding,
                     return_score=True,
                     repl_dict=self.repl_dict,
+                    stats=self.stats,
                 )
                 grouped.append(
                     {
@@ -1168,17 +1457,7 @@ class Reaction:
 
     def _load_products(self, products):
         for r_sm in products:
-            is_grouped = False
-            if r_sm[0] == "(":
-                r_sm = r_sm[1:-1]
-                is_grouped = True
-            else:
-                r_sm = r_sm
-
-            if "." in r_sm:
-                smss = r_sm.split(".")
-            else:
-                smss = [r_sm]
+            r_sm, smss, is_grouped = self.split_component(r_sm)
             grouped = []
             for sm in smss:
                 san_sm, ts, unmapped_canon = canon_smarts(
@@ -1187,6 +1466,7 @@ class Reaction:
                     self.embedding,
                     return_score=True,
                     repl_dict=self.repl_dict,
+                    stats=self.stats,
                 )
                 grouped.append(
                     {
@@ -1213,6 +1493,33 @@ class Reaction:
                 }
             )
 
+    def split_component(self, component):
+        """
+        Splits a reactant, agent or product into the SMARTS or query mols of its fragments.
+
+        Args:
+            component (str or Mol): A component of a reaction SMARTS, grouped in parentheses if it
+                has several fragments, or a template of a ChemicalReaction.
+
+        Returns:
+            tuple: The component without its parentheses, the list of fragments and whether the
+            component is grouped.
+        """
+        if type(component) != str:
+            frags = Chem.GetMolFrags(component, asMols=True, sanitizeFrags=False)
+            return component, list(frags), len(frags) > 1
+
+        is_grouped = False
+        if component[0] == "(":
+            component = component[1:-1]
+            is_grouped = True
+
+        if "." in component:
+            smss = component.split(".")
+        else:
+            smss = [component]
+        return component, smss, is_grouped
+
     def remap(self, in_smarts):
         for r in in_smarts:
             grouped = False
@@ -1267,9 +1574,27 @@ class Reaction:
 
         return parts
 
+    def _fire_sort(self, hooks, role, components, t0):
+        fire(
+            hooks,
+            "reaction_sort",
+            smarts=smarts_label(self.input_reaction_smarts),
+            role=role,
+            components=len(components),
+            seconds=time.perf_counter() - t0,
+        )
+
     def canonicalize_template(self):
-        k = AllChem.ReactionFromSmarts(self.input_reaction_smarts)
-        if len(k.GetAgents()) > 0:
+        from_rxn = type(self.input_reaction_smarts) != str
+        if from_rxn:
+            k = self.input_reaction_smarts
+        else:
+            k = AllChem.ReactionFromSmarts(self.input_reaction_smarts)
+        if from_rxn:
+            reactants = list(k.GetReactants())
+            agents = list(k.GetAgents())
+            products = list(k.GetProducts())
+        elif len(k.GetAgents()) > 0:
             comps = self.input_reaction_smarts.split(">")
             if len(comps) == 3:
                 reactants = self.split_at_period_not_in_parentheses(comps[0])
@@ -1289,7 +1614,12 @@ class Reaction:
         self._load_agents(agents)
         self._load_products(products)
 
+        hooks = active_hooks()
+        if hooks is not None:
+            t0 = time.perf_counter()
         reactants_sort = sorted(self.reactants, key=cmp_to_key(custom_key2))
+        if hooks is not None:
+            self._fire_sort(hooks, "reactants", reactants_sort, t0)
 
         if self.remapping:
             self.remap(reactants_sort)
@@ -1298,7 +1628,11 @@ class Reaction:
 
         if len(self.agents) > 0:
             san_smarts_out = san_smarts_out + ">"
+            if hooks is not None:
+                t0 = time.perf_counter()
             agents_sort = sorted(self.agents, key=cmp_to_key(custom_key2))
+            if hooks is not None:
+                self._fire_sort(hooks, "agents", agents_sort, t0)
             if self.remapping:
                 self.remap(agents_sort)
             san_smarts_out = san_smarts_out + ".".join(
@@ -1306,7 +1640,11 @@ class Reaction:
             )
 
         san_smarts_out = san_smarts_out + ">>"
+        if hooks is not None:
+            t0 = time.perf_counter()
         products_sort = sorted(self.products, key=cmp_to_key(custom_key2))
+        if hooks is not None:
+            self._fire_sort(hooks, "products", products_sort, t0)
         if self.remapping:
             self.remap(products_sort)
         san_smarts_out = san_smarts_out + ".".join(
@@ -1346,29 +1684,73 @@ def canon_smarts(
     return_score=False,
     v=False,
     repl_dict={},
+    cache=None,
+    stats=None,
 ):
     """
     Canonicalizes a SMARTS pattern.
 
     Args:
-        smarts (str): The input SMARTS pattern to be canonicalized.
+        smarts (str or Mol): The input SMARTS pattern to be canonicalized, or a query mol, e.g. from
+            Chem.MolFromSmarts, whose atoms, bonds and query tokens are read directly.
         mapping (bool, optional): Whether to return the atom mapping. Defaults to False.
         embedding (str, optional): The query primitive frequency dictionary to use. Defaults to "drugbank".
         return_score (bool, optional): Whether to return the top score. Defaults to False.
         v (bool, optional): Whether to enable verbose mode. Defaults to False.
         repl_dict (dictionary, optional): A dictionary of SMARTS token replacements.
+        cache (CanonCache, optional): A persistent cache to read from and write to. It is not used
+            when `return_score` or `v` is True, or when `stats` is given.
+        stats (CanonStats, optional): Search counters, phase timings and, if enabled, the peak memory
+            are added to this object.
 
     Returns:
         str or tuple: The canonicalized SMARTS pattern. If `return_score` is True, a tuple containing the canonicalized SMARTS pattern,
         the top score, and the unmapped canonical SMARTS pattern is returned.
     """
-    g = Graph(v)
-    g.graph_from_smarts(smarts, embedding)
-    out = g.recreate_molecule(mapping)
+    use_cache = cache is not None and not return_score and not v and stats is None
+    if use_cache:
+        key = cache.key(
+            smarts_label(smarts), "smarts", mapping, embedding, False, repl_dict
+        )
+        out = cache.get(key)
+        if out is not None:
+            return out
+
+    hooks = active_hooks()
+    if hooks is not None:
+        label = smarts_label(smarts)
+        fire(hooks, "canon_start", smarts=label, kind="smarts")
+    if stats is not None or hooks is not None:
+        t0 = time.perf_counter()
+    if stats is not None and stats.memory:
+        memory = stats.start_memory()
+
+    try:
+        g = Graph(v, stats)
+        g.graph_from_smarts(smarts, embedding)
+        out = g.recreate_molecule(mapping)
+    finally:
+        if stats is not None and stats.memory:
+            stats.stop_memory(memory)
+        if hooks is not None:
+            fire(
+                hooks,
+                "canon_end",
+                smarts=label,
+                kind="smarts",
+                seconds=time.perf_counter() - t0,
+            )
+
+    if stats is not None:
+        stats.calls = stats.calls + 1
+        stats.add_time("total", time.perf_counter() - t0)
 
     for k in repl_dict:
         out = out.replace(k, repl_dict[k])
 
+    if use_cache:
+        cache.put(key, out)
+
     if return_score:
         return out, g.top_score, g.unmapped_canon
     return out
@@ -1398,17 +1780,28 @@ def debug(smarts, mapping=False, embedding="drugbank", return_score=False):
 
 
 def canon_reaction_smarts(
-    smarts, mapping=False, embedding="drugbank", remapping=False, repl_dict={}
+    smarts,
+    mapping=False,
+    embedding="drugbank",
+    remapping=False,
+    repl_dict={},
+    cache=None,
+    stats=None,
 ):
     """
     Canonicalizes a reaction SMARTS string.
 
     Args:
-        smarts (str): The reaction SMARTS string to be canonicalized.
+        smarts (str or ChemicalReaction): The reaction SMARTS string to be canonicalized, or a
+            ChemicalReaction, whose reactant, agent and product templates are read directly.
         mapping (bool, optional): Whether to include atom mapping in the canonicalization. Defaults to False.
         embedding (str, optional): The embedding to use for the canonicalization. Defaults to "drugbank".
         remapping (bool, optional): Whether to remap atom indices after canonicalization. Defaults to True.
         repl_dict (dictionary, optional): A dictionary of SMARTS token replacements.
+        cache (CanonCache, optional): A persistent cache to read from and write to. It is not used
+            when `stats` is given.
+        stats (CanonStats, optional): Search counters and phase timings of every reactant, agent and
+            product SMARTS are added to this object.
 
     Returns:
         str: The canonicalized reaction SMARTS string.
@@ -1417,5 +1810,118 @@ def canon_reaction_smarts(
     if remapping == True:
         mapping = True
 
-    reaction = Reaction(smarts, mapping, embedding, remapping, repl_dict=repl_dict)
-    return reaction.canonicalize_template()
+    use_cache = cache is not None and stats is None
+    if use_cache:
+        key = cache.key(
+            smarts_label(smarts), "reaction", mapping, embedding, remapping, repl_dict
+        )
+        out = cache.get(key)
+        if out is not None:
+            return out
+
+    hooks = active_hooks()
+    if hooks is not None:
+        label = smarts_label(smarts)
+        fire(hooks, "canon_start", smarts=label, kind="reaction")
+        t0 = time.perf_counter()
+
+    try:
+        reaction = Reaction(
+            smarts, mapping, embedding, remapping, repl_dict=repl_dict, stats=stats
+        )
+        out = reaction.canonicalize_template()
+    finally:
+        if hooks is not None:
+            fire(
+                hooks,
+                "canon_end",
+                smarts=label,
+                kind="reaction",
+                seconds=time.perf_counter() - t0,
+            )
+
+    if use_cache:
+        cache.put(key, out)
+    return out
+
+
+def _cached_query(out, kind, mapping, embedding, cache):
+    """
+    Builds the RDKit query object of a canonical SMARTS or reaction SMARTS, reading and writing
+    its pickle in the cache under the canonical output, so that inputs with the same canonical
+    form share one entry.
+    """
+    if cache is not None:
+        key = cache.key(out, kind, mapping, embedding)
+        blob = cache.get(key)
+        if blob is not None:
+            data = base64.b64decode(blob)
+            if kind == "query_mol":
+                return Chem.Mol(data)
+            return rdChemReactions.ChemicalReaction(data)
+
+    if kind == "query_mol":
+        obj = Chem.MolFromSmarts(out)
+    else:
+        obj = AllChem.ReactionFromSmarts(out)
+    if obj is None:
+        raise ValueError("RDKit could not parse the canonical output: " + out)
+
+    if cache is not None:
+        cache.put(key, base64.b64encode(obj.ToBinary()).decode())
+    return obj
+
+
+def canon_query_mol(
+    smarts, mapping=False, embedding="drugbank", repl_dict={}, cache=None
+):
+    """
+    Canonicalizes a SMARTS pattern and returns it as an RDKit query mol.
+
+    This replaces Chem.MolFromSmarts(canon_smarts(...)). With a cache, both the canonical SMARTS
+    and the pickled query mol are stored, the latter once per canonical pattern.
+
+    Args:
+        smarts (str): The input SMARTS pattern to be canonicalized.
+        mapping (bool, optional): Whether to keep the atom mapping. Defaults to False.
+        embedding (str, optional): The query primitive frequency dictionary to use. Defaults to "drugbank".
+        repl_dict (dictionary, optional): A dictionary of SMARTS token replacements.
+        cache (CanonCache, optional): A persistent cache to read from and write to.
+
+    Returns:
+        Mol: The query mol of the canonical SMARTS pattern.
+    """
+    out = canon_smarts(smarts, mapping, embedding, repl_dict=repl_dict, cache=cache)
+    return _cached_query(out, "query_mol", mapping, embedding, cache)
+
+
+def canon_query_reaction(
+    smarts,
+    mapping=False,
+    embedding="drugbank",
+    remapping=False,
+    repl_dict={},
+    cache=None,
+):
+    """
+    Canonicalizes a reaction SMARTS and returns it as an RDKit ChemicalReaction.
+
+    This replaces AllChem.ReactionFromSmarts(canon_reaction_smarts(...)). With a cache, both the
+    canonical reaction SMARTS and the pickled reaction are stored, the latter once per canonical
+    reaction.
+
+    Args:
+        smarts (str): The reaction SMARTS string to be canonicalized.
+        mapping (bool, optional): Whether to include atom mapping in the canonicalization. Defaults to False.
+        embedding (str, optional): The embedding to use for the canonicalization. Defaults to "drugbank".
+        remapping (bool, optional): Whether to remap atom indices after canonicalization. Defaults to False.
+        repl_dict (dictionary, optional): A dictionary of SMARTS token replacements.
+        cache (CanonCache, optional): A persistent cache to read from and write to.
+
+    Returns:
+        ChemicalReaction: The reaction of the canonical reaction SMARTS.
+    """
+    out = canon_reaction_smarts(
+        smarts, mapping, embedding, remapping, repl_dict, cache=cache
+    )
+    return _cached_query(out, "query_reaction", mapping, embedding, cache)
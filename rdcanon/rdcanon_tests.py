@@ -1,5 +1,46 @@
 from absl.testing import absltest
-from rdcanon.main import canon_smarts, canon_reaction_smarts
+from rdcanon.main import (
+    canon_smarts,
+    canon_reaction_smarts,
+    canon_query_mol,
+    canon_query_reaction,
+    atom_query,
+)
+from rdcanon.batch import (
+    canon_smarts_batch,
+    canon_reaction_smarts_batch,
+    CanonPool,
+    estimate_cost,
+)
+from rdcanon.cache import CanonCache
+from rdcanon.keys import canon_key, KEY_SIZE, KEY_VERSION
+from rdcanon.equivalence import smarts_equivalent, reaction_smarts_equivalent, shape
+from rdcanon.incremental import CanonState
+from rdcanon.stats import CanonStats
+from rdcanon.hooks import add_hook, remove_hook, clear_hooks, ProfileHook
+from rdcanon.token_parser import (
+    canon_token,
+    scan_smarts,
+    clear_token_cache,
+    token_cache,
+    token_cache_stats,
+    shared_token_tables,
+    shared_token_key,
+)
+from rdcanon.shared import SharedTable
+from rdcanon.benchmark import (
+    bench_suite,
+    bench_scaling,
+    compare_to_baseline,
+    fit_scaling,
+)
+from rdcanon.synthetic import FAMILIES, generate
+from rdcanon.substruct import bench_substruct, write_report
+from rdcanon.fuzz import check_invariance, fuzz, random_traversal, shrink
+from rdcanon.datasets import load_dataset, read_dataset, find_dataset
+from rdcanon.aio import AsyncCanonicalizer
+from rdcanon.server import CanonServer, MicroBatcher
+from rdcanon import cli
 from rdcanon.util import (
     compare_reaction_outputs,
     compare_products,
@@ -8,9 +49,15 @@ from rdcanon.util import (
     run_random_permutations,
     time_compare_substruct_match,
 )
+from rdkit import Chem
 from rdkit.Chem import AllChem
 import pandas as pd
+import asyncio
+import csv
+import json
+import urllib.request
 import os
+import time
 
 
 class TestRegularSmarts(absltest.TestCase):
@@ -142,14 +189,30 @@ class TestRegularSmarts(absltest.TestCase):
         s_test2 = "[C]=[N]=,-[C]"
         self.assertEqual(canon_smarts(s_test1), canon_smarts(s_test2))
 
+    def test_mol_input(self):
+        df = load_dataset("noncanon_efg_templates_20240108")
+        templates = [sm for sm in df["noncanon_efg_templates"] if type(sm) == str][:60]
+        templates = templates + [
+            "F/C=C/F",
+            "[C@@H:1]1(F)CC[C@H:2](Cl)CC1",
+            "[CH3:1][H]",
+        ]
+        for sm in templates:
+            mol = Chem.MolFromSmarts(sm)
+            expected = canon_smarts(Chem.MolToSmarts(mol), True)
+            self.assertEqual(canon_smarts(mol, True), expected)
+            # the input mol is not modified
+            self.assertEqual(
+                Chem.MolToSmarts(mol), Chem.MolToSmarts(Chem.MolFromSmarts(sm))
+            )
+        self.assertEqual(
+            canon_smarts(Chem.MolFromSmiles("OCC")), canon_smarts("[#8]-[#6]-[#6]")
+        )
+
 
 class TestReactionSmarts(absltest.TestCase):
     def test_check_products_of_reactions(self):
-        path = (
-            os.path.dirname(os.path.abspath(__file__))
-            + "/testing_data/reaction_smarts_out.xlsx"
-        )
-        run_reactants_experiments = pd.read_excel(path)
+        run_reactants_experiments = load_dataset("reaction_smarts_out")
 
         reactant_objs = [
             AllChem.MolFromSmiles(x)
@@ -185,6 +248,23 @@ class TestReactionSmarts(absltest.TestCase):
         o = compare_products(rxn1, reactant)
         assert o
 
+    def test_reaction_input(self):
+        reactions = load_dataset("reaction_smarts_out")["reaction_smarts"][:40]
+        reactions = list(reactions) + ["([C:1].[N:2])>>[C:1]#[N:2]"]
+        for rxn in reactions:
+            obj = AllChem.ReactionFromSmarts(rxn)
+            self.assertEqual(canon_reaction_smarts(obj), canon_reaction_smarts(rxn))
+            self.assertEqual(
+                canon_reaction_smarts(obj, True, "drugbank", True),
+                canon_reaction_smarts(rxn, True, "drugbank", True),
+            )
+
+        rxn = "[C:1](=[O:2])O.[N:3]>[Pd]>[C:1](=[O:2])[N:3]"
+        obj = AllChem.ReactionFromSmarts(rxn)
+        self.assertEqual(
+            canon_reaction_smarts(obj, True), canon_reaction_smarts(rxn, True)
+        )
+
     def test_permute_reactants(self):
         rxn1 = "[*:1]-[N&H0&+0:2](-[*:3])-C.[*:4]-[N&H0&+0:5](-[*:6])-C>>[*:1]-[N&H1&+0:2]-[*:3][C:7][N:8][*:4]-[N&H1&+0:5]-[*:6]"
         rxn2 = "[*:4]-[N&H0&+0:5](-[*:6])-C.[*:1]-[N&H0&+0:2](-[*:3])-C>>[*:1]-[N&H1&+0:2]-[*:3][C:7][N:8][*:4]-[N&H1&+0:5]-[*:6]"
@@ -248,6 +328,77 @@ class TestReactionSmarts(absltest.TestCase):
         )
 
 
+class TestScanner(absltest.TestCase):
+    def test_scan_tokens(self):
+        sm = "[C@@H:1](Cl)1-[c;$(c@c)]:c=%10.[N@]C1~Br%10"
+        atoms, marks, bonds = scan_smarts(sm)
+        self.assertEqual(
+            [sm[a:b] for a, b in atoms],
+            ["[C@@H:1]", "Cl", "[c;$(c@c)]", "c", "[N@]", "C", "Br"],
+        )
+        self.assertEqual(marks, ["@@", "", "", "", "@", "", ""])
+        self.assertEqual([sm[a:b] for a, b in bonds], ["-", ":", "=", "~"])
+        with self.assertRaises(ValueError):
+            scan_smarts("[C;$(C)")
+        with self.assertRaisesRegex(ValueError, "Invalid SMARTS"):
+            canon_smarts("")
+
+    def test_chirality_classes(self):
+        self.assertEqual(scan_smarts("[C@TH1](F)(Cl)(Br)I")[1][0], "@")
+        self.assertEqual(scan_smarts("[C@TH2H](F)(Cl)Br")[1][0], "@@")
+        self.assertEqual(
+            canon_smarts("[C@TH1](F)(Cl)(Br)I"), canon_smarts("[C@](F)(Cl)(Br)I")
+        )
+        self.assertEqual(
+            canon_smarts("[C@TH2](F)(Cl)(Br)I"), canon_smarts("[C@@](F)(Cl)(Br)I")
+        )
+        self.assertEqual(
+            canon_smarts("[C@TH2H](F)(Cl)Br"), canon_smarts("[C@@H](F)(Cl)Br")
+        )
+        for sm in ["[C@SP1](F)(Cl)(Br)I", "[C@TB1](F)(Cl)(Br)I"]:
+            with self.assertRaises(ValueError):
+                canon_smarts(sm)
+
+    def test_scan_matches_rdkit(self):
+        df = load_dataset("noncanon_efg_templates_20240108")
+        templates = [sm for sm in df["noncanon_efg_templates"] if type(sm) == str]
+        templates = templates + [
+            "[C@H](F)(Cl)Br",
+            "F[C@@](Cl)(Br)I",
+            "C[C@@H]1CC[C@H]1O",
+        ]
+        for sm in templates:
+            mol = Chem.MolFromSmarts(sm)
+            atoms, marks, bonds = scan_smarts(sm)
+            self.assertEqual(len(atoms), mol.GetNumAtoms())
+            self.assertEqual(
+                len(bonds), len([b for b in mol.GetBonds() if b.GetSmarts() != ""])
+            )
+            for atom, mark in zip(mol.GetAtoms(), marks):
+                self.assertEqual(
+                    mark != "",
+                    atom.GetChiralTag() != Chem.rdchem.ChiralType.CHI_UNSPECIFIED,
+                )
+
+    def test_atom_query_matches_rdkit(self):
+        templates = [
+            "[C@@H:1](Cl)1-[c;$(c@c)]:c=%10.[N@]C1~Br%10",
+            "[CH3:1][C:2](=[O;H0;D1;+0:3])[OH:4]",
+            "[H]C(Cl)[2H]",
+            "[#1][O;X2]",
+            "[C,#1]N",
+            "[!#1;X4]C",
+        ]
+        for sm in templates:
+            mol = Chem.MolFromSmarts(sm)
+            atoms, _, _ = scan_smarts(sm)
+            queries = [atom_query(sm[a:b]) for a, b in atoms]
+            self.assertEqual(
+                [q[0] for q in queries], [atom.GetSmarts() for atom in mol.GetAtoms()]
+            )
+            self.assertEqual(any(q[1] for q in queries), Chem.HasQueryHs(mol)[0])
+
+
 class TestRecursive(absltest.TestCase):
     def test_recursive(self):
         s_test1 = "[$([C&X2,N&X2](=[$([C])])=[C])]"
@@ -279,11 +430,7 @@ class TestRecursive(absltest.TestCase):
 
 
     def test_multi_canon(self):
-        path = (
-            os.path.dirname(os.path.abspath(__file__))
-            + "/testing_data/noncanon_efg_templates_20240108.xlsx"
-        )
-        noncanon_templates = pd.read_excel(path)
+        noncanon_templates = load_dataset("noncanon_efg_templates_20240108")
         for t in noncanon_templates["noncanon_efg_templates"]:
             sm1 = canon_smarts(t)
             sm2 = canon_smarts(sm1)
@@ -291,16 +438,8 @@ class TestRecursive(absltest.TestCase):
             assert sm1 == sm2 == sm3
 
     def test_validate_recursive_against_database(self):
-        path = (
-            os.path.dirname(os.path.abspath(__file__))
-            + "/testing_data/noncanon_efg_templates_20240108.xlsx"
-        )
-        noncanon_templates = pd.read_excel(path)
-        path = (
-            os.path.dirname(os.path.abspath(__file__))
-            + "/testing_data/drugbank_smiles_1000.xlsx"
-        )
-        tdb = pd.read_excel(path)
+        noncanon_templates = load_dataset("noncanon_efg_templates_20240108")
+        tdb = load_dataset("drugbank_smiles_1000")
 
         nc, c = run_against_library(
             noncanon_templates["noncanon_efg_templates"], tdb["smiles"], 1
@@ -308,24 +447,864 @@ class TestRecursive(absltest.TestCase):
         assert compare_product_sets(nc, c)
 
     def test_random_permutations(self):
-        # print(os.path.dirname(os.path.abspath(__file__)))
-        path = (
-            os.path.dirname(os.path.abspath(__file__))
-            + "/testing_data/noncanon_efg_templates_20240108.xlsx"
-        )
-        noncanon_templates = pd.read_excel(path)
+        noncanon_templates = load_dataset("noncanon_efg_templates_20240108")
         for t in noncanon_templates["noncanon_efg_templates"]:
             # print("Testing: ", t)
             assert run_random_permutations(t, n_perms=10)
 
 
+class TestBatch(absltest.TestCase):
+    def test_smarts_batch_matches_serial(self):
+        smarts = [
+            "[CX3](=O)[OX1H0-,OX2H1]",
+            "[C;H0;+0]-[C;H1;+0]",
+            "[C;H1;+0]-[C;H0;+0]",
+            "[Br;!Cl;H10;X10][c;H0]1[c;H0][c;H0][c;H0][c;H0][c;H0]1",
+            "[N&H2&+0:4]-[C&H1&+0:2](-[C&H2&+0:8])-[O&H1&+0:3]",
+        ]
+        expected = [canon_smarts(s, True) for s in smarts]
+        self.assertEqual(canon_smarts_batch(smarts, True, workers=1), expected)
+        self.assertEqual(
+            canon_smarts_batch(smarts, True, workers=2, chunk_size=2), expected
+        )
+
+    def test_batch_captures_errors(self):
+        smarts = ["[C][O]", "not a smarts", "[N]=[O]"]
+        out, errors = canon_smarts_batch(
+            smarts, workers=2, chunk_size=1, return_errors=True
+        )
+        self.assertEqual(out[0], canon_smarts("[C][O]"))
+        self.assertIsNone(out[1])
+        self.assertEqual(out[2], canon_smarts("[N]=[O]"))
+        self.assertIsNone(errors[0])
+        self.assertIsNotNone(errors[1])
+
+    def test_reaction_batch_matches_serial(self):
+        rxns = [
+            "[*:1]-[N&H0&+0:2](-[*:3])-C.[*:4]-[N&H0&+0:5](-[*:6])-C>>[*:1]-[N&H1&+0:2]-[*:3][C:7][N:8][*:4]-[N&H1&+0:5]-[*:6]",
+            "([C:1].[N:2])>>[C:1]#[N:2]",
+        ]
+        expected = [canon_reaction_smarts(r, True, "drugbank", True) for r in rxns]
+        out = canon_reaction_smarts_batch(rxns, True, "drugbank", True, workers=2)
+        self.assertEqual(out, expected)
+
+    def test_estimate_cost_orders_by_size(self):
+        self.assertLess(estimate_cost("[C]"), estimate_cost("[C]-[C]-[N]"))
+        self.assertLess(estimate_cost("CCCCCC"), estimate_cost("C1CCCCC1"))
+        self.assertLess(
+            estimate_cost("[N;R1]"), estimate_cost("[N;$([N;R1]1=[N;R1][C;R1]=[C;R1]1)]")
+        )
+
+    def test_cost_schedule_preserves_order(self):
+        smarts = [
+            "[C]",
+            "[$([NR1]1=[NR1][CR1]=[CR1][CR1][CR1]1),$([NR1]1[NR1]=[CR1][CR1]=[CR1][CR1]1)]",
+            "[O]=[C]-[N]",
+            "c1ccc2ccccc2c1",
+            "[Cl]",
+        ]
+        expected = [canon_smarts(s) for s in smarts]
+        with CanonPool(workers=2, chunk_size=2, schedule="cost") as pool:
+            self.assertEqual([r for r, _ in pool.map(smarts)], expected)
+        self.assertEqual(
+            canon_smarts_batch(smarts, workers=2, schedule="fifo"), expected
+        )
+
+    def test_timeout_fails_only_slow_item(self):
+        slow = "CC1(C)S[C@@H]2[C@H](NC(=O)[C@H](NC(=O)N3CCN(S(C)(=O)=O)C3=O)c3ccccc3)C(=O)N2[C@H]1C(=O)O"
+        out, errors = canon_smarts_batch(
+            ["[C][O]", slow, "[N]=[O]"],
+            workers=1,
+            timeout=1.0,
+            return_errors=True,
+        )
+        self.assertEqual(out[0], canon_smarts("[C][O]"))
+        self.assertIsNone(out[1])
+        self.assertTrue(errors[1].startswith("TimeoutError"))
+        self.assertEqual(out[2], canon_smarts("[N]=[O]"))
+
+    def test_crashed_worker_is_replaced(self):
+        slow = "CC1(C)S[C@@H]2[C@H](NC(=O)[C@H](NC(=O)N3CCN(S(C)(=O)=O)C3=O)c3ccccc3)C(=O)N2[C@H]1C(=O)O"
+        with CanonPool(workers=1, timeout=120) as pool:
+            fut = pool.pool.submit([slow, "[C]"])
+            while pool.pool.workers[0].task is None:
+                time.sleep(0.01)
+            pool.pool.workers[0].process.kill()
+            pairs = fut.result()
+            self.assertTrue(pairs[0][1].startswith("WorkerCrash"))
+            self.assertEqual(pairs[1], (canon_smarts("[C]"), None))
+            self.assertEqual(pool.stats()["crashes"], 1)
+            self.assertEqual(pool.map(["[C][O]"]), [(canon_smarts("[C][O]"), None)])
+
+    def test_prepass_seeds_token_cache(self):
+        smarts = ["[C;H1;+0]-[C;H0;+0]", "[C;H0;+0]-[C;H1;+0]", "[O;H1]-[C;H1;+0]"]
+        expected = [canon_smarts(s) for s in smarts]
+
+        clear_token_cache()
+        with CanonPool(workers=1) as pool:
+            stats = pool.prepass(smarts)
+            self.assertEqual(stats["tokens"], 6)
+            self.assertEqual(stats["unique_tokens"], 3)
+            misses = token_cache_stats["misses"]
+            self.assertEqual([r for r, _ in pool.map(smarts)], expected)
+            self.assertEqual(token_cache_stats["misses"], misses)
+
+        clear_token_cache()
+        self.assertEqual(
+            canon_smarts_batch(smarts, workers=2, chunk_size=1, prepass=True), expected
+        )
+
+    def test_token_cache_ignores_atom_map(self):
+        clear_token_cache()
+        self.assertEqual(
+            canon_token("[C;H1;+0]", ":3")[0], canon_token("[C;H1;+0]")[0][:-1] + ":3]"
+        )
+        self.assertEqual(token_cache_stats, {"hits": 1, "misses": 1})
+
+    def test_shared_table(self):
+        entries = {"b": ("[C]", [0.5]), "a": None, "c\td": [1, [2]]}
+        table = SharedTable.create(entries)
+        try:
+            other = SharedTable.attach(table.name)
+            self.assertEqual(len(other), 3)
+            for k, v in entries.items():
+                self.assertEqual(other[k], v)
+            self.assertIsNone(other.get("missing"))
+            self.assertNotIn("missing", other)
+            other.close()
+        finally:
+            table.close()
+            table.unlink()
+
+        path = os.path.join(self.create_tempdir().full_path, "tokens.tbl")
+        SharedTable.write(entries, path)
+        table = SharedTable.open(path)
+        self.assertEqual(table["b"], ("[C]", [0.5]))
+        table.close()
+
+    def test_shared_token_table(self):
+        clear_token_cache()
+        expected = canon_token("[N;H2;+0]")
+        table = SharedTable.create(
+            {shared_token_key("drugbank", "[N;H2;+0]"): token_cache[("drugbank", "[N;H2;+0]")]}
+        )
+        clear_token_cache()
+        shared_token_tables.append(table)
+        try:
+            self.assertEqual(canon_token("[N;H2;+0]"), expected)
+            self.assertEqual(token_cache_stats, {"hits": 1, "misses": 0})
+            self.assertEqual(len(token_cache), 0)
+        finally:
+            shared_token_tables.remove(table)
+            table.close()
+            table.unlink()
+
+        smarts = ["[C;H1;+0]-[C;H0;+0]", "[O;H1]-[C;H1;+0]"]
+        self.assertEqual(
+            canon_smarts_batch(smarts, workers=2, prepass=True, shared_memory=True),
+            [canon_smarts(s) for s in smarts],
+        )
+
+
+class TestCommandLine(absltest.TestCase):
+    def test_stream_lines(self):
+        smarts = ["[C;H0;+0]-[C;H1;+0]", "bad((", "[C;H1;+0]-[C;H0;+0]"]
+        in_file = self.create_tempfile(content="\n".join(smarts) + "\n")
+        out_path = os.path.join(self.create_tempdir().full_path, "out.txt")
+        cli.main([in_file.full_path, "-o", out_path, "--workers", "1", "--quiet"])
+        with open(out_path) as f:
+            out = f.read().split("\n")
+        self.assertEqual(out[0], canon_smarts(smarts[0]))
+        self.assertEqual(out[1], "")
+        self.assertEqual(out[2], out[0])
+
+    def test_stream_csv_column(self):
+        rxn = "([C:1].[N:2])>>[C:1]#[N:2]"
+        in_file = self.create_tempfile(content="id,rxn\n1," + rxn + "\n")
+        out_path = os.path.join(self.create_tempdir().full_path, "out.csv")
+        cli.main(
+            [
+                in_file.full_path,
+                "-o",
+                out_path,
+                "--reaction",
+                "--remap",
+                "--column",
+                "rxn",
+                "--workers",
+                "2",
+                "--quiet",
+            ]
+        )
+        out = pd.read_csv(out_path)
+        self.assertEqual(list(out.columns), ["id", "rxn", "canon_rxn"])
+        self.assertEqual(
+            out["canon_rxn"][0], canon_reaction_smarts(rxn, True, "drugbank", True)
+        )
+
+    def test_stream_csv_short_rows(self):
+        in_file = self.create_tempfile(content="id,smarts\n1,[C]N\n\n2\n3,CO\n")
+        out_path = os.path.join(self.create_tempdir().full_path, "out.csv")
+        cli.main(
+            [
+                in_file.full_path,
+                "-o",
+                out_path,
+                "--column",
+                "smarts",
+                "--workers",
+                "1",
+                "--quiet",
+            ]
+        )
+        with open(out_path) as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[0], ["id", "smarts", "canon_smarts"])
+        self.assertEqual(rows[1][2], canon_smarts("[C]N"))
+        self.assertEqual(rows[2], [""])
+        self.assertEqual(rows[3], ["2", ""])
+        self.assertEqual(rows[4][2], canon_smarts("CO"))
+
+
+class TestCache(absltest.TestCase):
+    def test_cache_hits_and_keys(self):
+        path = os.path.join(self.create_tempdir().full_path, "canon.sqlite")
+        cache = CanonCache(path)
+        sm = "[N&H2&+0:4]-[C&H1&+0:2](-[C&H2&+0:8])-[O&H1&+0:3]"
+
+        out = canon_smarts(sm, cache=cache)
+        self.assertEqual(cache.stats()["misses"], 1)
+        self.assertEqual(canon_smarts(sm, cache=cache), out)
+        self.assertEqual(cache.stats()["hits"], 1)
+
+        # different settings must not share entries
+        self.assertEqual(canon_smarts(sm, True, cache=cache), canon_smarts(sm, True))
+        self.assertEqual(
+            canon_smarts(sm, embedding="askcos", cache=cache),
+            canon_smarts(sm, embedding="askcos"),
+        )
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(len(cache), 3)
+
+        rxn = "([C:1].[N:2])>>[C:1]#[N:2]"
+        expected = canon_reaction_smarts(rxn, True, "drugbank", True)
+        for _ in range(2):
+            self.assertEqual(
+                canon_reaction_smarts(rxn, True, "drugbank", True, cache=cache),
+                expected,
+            )
+        self.assertEqual(cache.stats()["hits"], 2)
+
+    def test_repeated_keys_count_as_hits(self):
+        cache = CanonCache(
+            os.path.join(self.create_tempdir().full_path, "canon.sqlite")
+        )
+        cache.put("a", "A")
+        self.assertEqual(cache.get_many(["a", "a", "b", "b"]), {"a": "A"})
+        self.assertEqual(cache.stats()["hits"], 2)
+        self.assertEqual(cache.stats()["misses"], 2)
+
+    def test_batch_warm_run(self):
+        path = os.path.join(self.create_tempdir().full_path, "canon.sqlite")
+        smarts = ["[C][O]", "[O][C]", "bad((", "[C]=[N]", "[c]1[c][c][c][c][c]1"]
+        cold = canon_smarts_batch(
+            smarts, workers=2, chunk_size=2, cache=CanonCache(path)
+        )
+        cache = CanonCache(path)
+        warm = canon_smarts_batch(smarts, workers=2, chunk_size=2, cache=cache)
+        self.assertEqual(cold, warm)
+        self.assertEqual(cache.stats()["hits"], 4)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_query_objects(self):
+        path = os.path.join(self.create_tempdir().full_path, "canon.sqlite")
+        cache = CanonCache(path)
+        sm = "[N&H2&+0:4]-[C&H1&+0:2](-[C&H2&+0:8])-[O&H1&+0:3]"
+        expected = Chem.MolToSmarts(Chem.MolFromSmarts(canon_smarts(sm, True)))
+        self.assertEqual(Chem.MolToSmarts(canon_query_mol(sm, True)), expected)
+        for _ in range(2):
+            query = canon_query_mol(sm, True, cache=cache)
+            self.assertEqual(Chem.MolToSmarts(query), expected)
+        # the canonical SMARTS and the pickled mol are each written once
+        self.assertEqual(cache.stats()["writes"], 2)
+        self.assertTrue(
+            Chem.MolFromSmiles("NC(C)O").HasSubstructMatch(
+                canon_query_mol("[OH]C[NH2]", cache=cache)
+            )
+        )
+
+        rxn = "[C:1](=[O;H0:2])[OH].[N;H2:3]>>[C:1](=[O:2])[N:3]"
+        expected = canon_reaction_smarts(rxn, True, "drugbank", True)
+        for _ in range(2):
+            out = canon_query_reaction(rxn, True, "drugbank", True, cache=cache)
+            self.assertEqual(
+                AllChem.ReactionToSmarts(out),
+                AllChem.ReactionToSmarts(AllChem.ReactionFromSmarts(expected)),
+            )
+        products = out.RunReactants(
+            (Chem.MolFromSmiles("CN"), Chem.MolFromSmiles("CC(=O)O"))
+        )
+        self.assertEqual(Chem.MolToSmiles(products[0][0]), "CNC(C)=O")
+
+
+class TestCanonKey(absltest.TestCase):
+    def test_key_invariance(self):
+        df = load_dataset("noncanon_efg_templates_20240108")
+        templates = [sm for sm in df["noncanon_efg_templates"] if type(sm) == str][:40]
+        for sm in templates:
+            key = canon_key(sm)
+            fast = canon_key(sm, fast=True)
+            self.assertEqual(len(key), KEY_SIZE)
+            self.assertEqual(key[0], KEY_VERSION)
+            self.assertNotEqual(key, fast)
+            self.assertEqual(canon_key(canon_smarts(sm)), key)
+            self.assertEqual(canon_key(canon_smarts(sm), fast=True), fast)
+
+        keys = [canon_key(sm) for sm in templates]
+        fast_keys = [canon_key(sm, fast=True) for sm in templates]
+        canon = [canon_smarts(sm) for sm in templates]
+        self.assertEqual(len(set(keys)), len(set(canon)))
+        self.assertEqual(len(set(fast_keys)), len(set(canon)))
+
+    def test_key_stereo_and_maps(self):
+        self.assertEqual(canon_key("[CH:1](F)(Cl)Br"), canon_key("Br[CH](F)Cl"))
+        self.assertNotEqual(canon_key("[C@H](F)(Cl)Br"), canon_key("[C@@H](F)(Cl)Br"))
+        self.assertNotEqual(canon_key("F/C=C/F"), canon_key("F/C=C\\F"))
+        for a, b in [
+            ("N[C@@H](C)C(=O)O", "N[C@H](C)C(=O)O"),
+            ("F/C=C/F", "F/C=C\\F"),
+        ]:
+            self.assertNotEqual(canon_key(a, fast=True), canon_key(b, fast=True))
+        self.assertEqual(
+            canon_key("F/C=C/F", fast=True), canon_key("F\\C=C\\F", fast=True)
+        )
+        self.assertNotEqual(
+            canon_key("[#6]-[#7]", embedding="askcos"), canon_key("[#6]-[#7]")
+        )
+        with self.assertRaises(ValueError):
+            canon_key("bad((")
+
+    def test_key_is_stable(self):
+        # keys must not change within a KEY_VERSION
+        self.assertEqual(
+            canon_key("[#6]-[#7]=[#8]").hex(), "02420c699be84ec0b4739e2f4e5be670"
+        )
+        self.assertEqual(
+            canon_key("[#6]-[#7]=[#8]", fast=True).hex(),
+            "02092525689821a8b82c185890033583",
+        )
+
+
+class TestEquivalence(absltest.TestCase):
+    def test_smarts_equivalent(self):
+        df = load_dataset("noncanon_efg_templates_20240108")
+        templates = [sm for sm in df["noncanon_efg_templates"] if type(sm) == str][:30]
+        canon = [canon_smarts(sm) for sm in templates]
+        for i in range(len(templates)):
+            for j in range(i, len(templates)):
+                self.assertEqual(
+                    smarts_equivalent(templates[i], templates[j]),
+                    canon[i] == canon[j],
+                )
+            mol = Chem.MolFromSmarts(templates[i])
+            self.assertTrue(smarts_equivalent(templates[i], canon[i]))
+            self.assertTrue(smarts_equivalent(mol, canon[i]))
+
+    def test_equivalence_options(self):
+        self.assertTrue(smarts_equivalent("[CH:1](F)Cl", "Cl[CH:2]F"))
+        self.assertFalse(smarts_equivalent("[CH:1](F)Cl", "Cl[CH:2]F", mapping=True))
+        self.assertTrue(smarts_equivalent("[CH:1](F)Cl", "Cl[CH:1]F", mapping=True))
+        self.assertFalse(smarts_equivalent("[C@H](F)(Cl)Br", "[C@@H](F)(Cl)Br"))
+        self.assertFalse(smarts_equivalent("[#6]-[#7]", "[#6]-[#8]"))
+        self.assertEqual(shape(Chem.MolFromSmarts("CC(C)C")), (4, 3, [1, 1, 1, 3]))
+        with self.assertRaises(ValueError):
+            smarts_equivalent("bad((", "C")
+
+    def test_reaction_smarts_equivalent(self):
+        rxn = "[C:1](=[O:2])-[OH:3].[N:4]>>[C:1](=[O:2])-[N:4]"
+        self.assertTrue(
+            reaction_smarts_equivalent(
+                rxn, "[N:4].[OH:3]-[C:1]=[O:2]>>[N:4]-[C:1]=[O:2]"
+            )
+        )
+        self.assertTrue(
+            reaction_smarts_equivalent(
+                rxn, canon_reaction_smarts(rxn, True), mapping=True
+            )
+        )
+        self.assertTrue(
+            reaction_smarts_equivalent(AllChem.ReactionFromSmarts(rxn), rxn)
+        )
+        self.assertFalse(
+            reaction_smarts_equivalent(
+                rxn, "[C:1](=[O:2])-[OH:3].[O:4]>>[C:1](=[O:2])-[O:4]"
+            )
+        )
+        self.assertFalse(reaction_smarts_equivalent(rxn, "[C:1]=[O:2]>>[C:1]-[O:2]"))
+
+
+class TestIncremental(absltest.TestCase):
+    def test_atom_and_bond_edits(self):
+        state = CanonState("[C:1](=[O:2])-[N:3]-[C]", mapping=True)
+        self.assertEqual(state.smarts, canon_smarts("[C:1](=[O:2])-[N:3]-[C]", True))
+        self.assertEqual(state.atom_tokens(), ["[C:1]", "[O:2]", "[N:3]", "[C]"])
+
+        edits = [
+            (state.set_atom, (3, "[C;H3;+0]"), "[C:1](=[O:2])-[N:3]-[C;H3;+0]"),
+            (state.set_atom, (0, "[C;H0;+0:1]"), "[C;H0;+0:1](=[O:2])-[N:3]-[C;H3;+0]"),
+            (
+                state.set_bond,
+                (2, 3, "-;!@"),
+                "[C;H0;+0:1](=[O:2])-[N:3]-;!@[C;H3;+0]",
+            ),
+            (state.set_bond, (1, 0, "~"), "[C;H0;+0:1](~[O:2])-[N:3]-;!@[C;H3;+0]"),
+        ]
+        reused = []
+        for edit, args, smarts in edits:
+            self.assertEqual(edit(*args), canon_smarts(smarts, True))
+            reused.append(state.search_reused)
+        self.assertEqual(reused, [False, False, True, False])
+        self.assertEqual(state.searches, 4)
+
+        state = CanonState("c1ccccc1C")
+        self.assertEqual(state.set_atom(6, "[C;H3]"), canon_smarts("c1ccccc1[C;H3]"))
+        self.assertTrue(state.search_reused)
+
+        state = CanonState("[C@@H](F)(Cl)Br")
+        self.assertEqual(state.set_atom(0, "[C@TH1H]"), canon_smarts("[C@H](F)(Cl)Br"))
+        self.assertEqual(
+            state.set_atom(0, "[C@H;$(C@@C)]"), canon_smarts("[C@H;$(C@@C)](F)(Cl)Br")
+        )
+
+    def test_edits_match_canon_smarts(self):
+        df = load_dataset("noncanon_efg_templates_20240108")
+        templates = [
+            sm
+            for sm in df["noncanon_efg_templates"]
+            if type(sm) == str and "#1" not in sm and "@" not in sm and "/" not in sm
+        ][:40]
+        reused = 0
+        for sm in templates:
+            state = CanonState(sm)
+            mol = Chem.RWMol(Chem.MolFromSmarts(sm))
+            for i in range(min(3, mol.GetNumAtoms())):
+                token = mol.GetAtomWithIdx(i).GetSmarts()
+                token = token[:-1] + ";+0]" if token[0] == "[" else "[%s;+0]" % token
+                mol.ReplaceAtom(i, Chem.MolFromSmarts(token).GetAtomWithIdx(0))
+                self.assertEqual(
+                    state.set_atom(i, token), canon_smarts(Chem.MolToSmarts(mol))
+                )
+                reused = reused + state.search_reused
+        self.assertGreater(reused, 0)
+
+    def test_invalid_edits(self):
+        state = CanonState("F/C=C/C-C")
+        with self.assertRaises(ValueError):
+            state.set_atom(9, "[C]")
+        with self.assertRaises(ValueError):
+            state.set_atom(0, "CC")
+        with self.assertRaises(ValueError):
+            state.set_atom(0, "[#1]")
+        with self.assertRaises(ValueError):
+            state.set_bond(0, 3, "-")
+        with self.assertRaises(ValueError):
+            state.set_bond(0, 1, "-")
+        with self.assertRaises(ValueError):
+            state.set_bond(3, 4, "/")
+
+
+class TestStats(absltest.TestCase):
+    def test_search_stats(self):
+        clear_token_cache()
+        sm = "[CX3](=[OX1])[OX2][CX3](=[OX1])c1ccccc1"
+        stats = CanonStats()
+        self.assertEqual(canon_smarts(sm, stats=stats), canon_smarts(sm))
+
+        self.assertEqual(stats.calls, 1)
+        self.assertEqual(stats.atoms, 11)
+        self.assertEqual(stats.states_pushed, stats.states_popped)
+        self.assertGreater(stats.states_pushed, stats.atoms)
+        self.assertGreater(stats.ring_closures, 0)
+        self.assertGreaterEqual(stats.tied_start_nodes, 1)
+        self.assertGreaterEqual(stats.paths, stats.tied_paths)
+        self.assertEqual(stats.regen_calls, stats.tied_paths)
+        self.assertEqual(stats.token_cache_hits + stats.token_cache_misses, 11)
+        self.assertGreater(stats.timings["total"], stats.timings["search"])
+
+        # the persistent cache is bypassed so that the search is measured
+        path = os.path.join(self.create_tempdir().full_path, "canon.sqlite")
+        cache = CanonCache(path)
+        canon_smarts(sm, cache=cache)
+        canon_smarts(sm, cache=cache, stats=stats)
+        self.assertEqual(stats.calls, 2)
+        self.assertEqual(stats.token_cache_misses, 4)
+
+        rxn = "[C:1](=[O:2])[OH].[N:3]>>[C:1](=[O:2])[N:3]"
+        stats = CanonStats()
+        self.assertEqual(
+            canon_reaction_smarts(rxn, True, stats=stats),
+            canon_reaction_smarts(rxn, True),
+        )
+        self.assertEqual(stats.calls, 3)
+        self.assertEqual(json.loads(json.dumps(stats.as_dict())), stats.as_dict())
+
+
+class TestMemory(absltest.TestCase):
+    # upper bounds in bytes of the peak Python allocations of one canon_smarts call;
+    # measured values are about half of these
+    bounds = {
+        "[#1,#6][CX3]([#1,#6])=[NX2][NX3]([#1,#6&!$([CX3]=[OX1,SX1,NX2])])[CX3](=[OX1])"
+        "[NX3]([#1,#6&!$([CX3]=[OX1,SX1,NX2])])[#1,#6&!$([CX3]=[OX1,SX1,NX2])]": 1200000,
+        generate("ring", 24): 600000,
+        generate("ladder", 3): 2000000,
+    }
+
+    def test_peak_memory_bounds(self):
+        for sm, bound in self.bounds.items():
+            stats = CanonStats(memory=True)
+            canon_smarts(sm, stats=stats)
+            self.assertGreater(stats.peak_memory, 0)
+            self.assertLess(stats.peak_memory, bound, sm)
+
+    def test_memory_off_by_default(self):
+        import tracemalloc
+
+        stats = CanonStats()
+        canon_smarts("[CX3](=[OX1])[OX2][CX3](=[OX1])c1ccccc1", stats=stats)
+        self.assertEqual(stats.peak_memory, 0)
+        self.assertFalse(tracemalloc.is_tracing())
+
+        stats = CanonStats(memory=True)
+        canon_reaction_smarts("[C:1](=[O:2])[OH].[N:3]>>[C:1](=[O:2])[N:3]", stats=stats)
+        self.assertGreater(stats.peak_memory, 0)
+        self.assertGreaterEqual(stats.peak_memory, stats.last_peak_memory)
+        self.assertEqual(stats.as_dict()["peak_memory"], stats.peak_memory)
+        self.assertFalse(tracemalloc.is_tracing())
+
+
+class TestHooks(absltest.TestCase):
+    def tearDown(self):
+        clear_hooks()
+
+    def test_phase_events(self):
+        events = []
+        callback = add_hook(lambda event, info: events.append((event, info)))
+        sm = "[CX3](=[OX1])[OX2][CX3](=[OX1])c1ccccc1"
+        out = canon_smarts(sm)
+        remove_hook(callback)
+        self.assertEqual(canon_smarts(sm), out)
+
+        names = [e[0] for e in events]
+        self.assertEqual(names[0], "canon_start")
+        self.assertEqual(names.count("token"), 11)
+        self.assertEqual(
+            names[12:],
+            ["graph_build", "search_start", "search_end", "regen", "canon_end"],
+        )
+        info = dict(events)
+        self.assertEqual(info["graph_build"]["atoms"], 11)
+        self.assertEqual(info["graph_build"]["bonds"], 11)
+        self.assertEqual(info["regen"]["length"], len(out))
+        self.assertGreaterEqual(
+            info["canon_end"]["seconds"], info["search_end"]["seconds"]
+        )
+
+        events.clear()
+        add_hook(lambda event, info: events.append((event, info)), ["reaction_sort"])
+        canon_reaction_smarts("[C:1](=[O:2])[OH].[N:3]>>[C:1](=[O:2])[N:3]")
+        self.assertEqual([e[1]["role"] for e in events], ["reactants", "products"])
+        self.assertEqual([e[1]["components"] for e in events], [2, 1])
+
+        with self.assertRaises(ValueError):
+            add_hook(print, ["no_such_event"])
+
+    def test_profile_hook(self):
+        tmp = self.create_tempdir().full_path
+        slow = "[CX3](=[OX1])[OX2][CX3](=[OX1])c1ccccc1"
+
+        hook = add_hook(ProfileHook(select=[slow]))
+        canon_smarts("[N&H2&+0:4]-[C&H1&+0:2](-[C&H2&+0:8])-[O&H1&+0:3]")
+        canon_smarts(slow)
+        self.assertEqual(hook.profiled, [slow])
+        hook.dump(os.path.join(tmp, "canon.prof"))
+        remove_hook(hook)
+
+        hook = add_hook(ProfileHook(lambda sm: ">>" in sm, output="folded"))
+        canon_smarts(slow)
+        canon_reaction_smarts("[C:1](=[O:2])[OH].[N:3]>>[C:1](=[O:2])[N:3]")
+        self.assertEqual(len(hook.profiled), 1)
+        path = os.path.join(tmp, "canon.folded")
+        hook.dump(path)
+        with open(path) as f:
+            lines = f.read().splitlines()
+        self.assertGreater(len(lines), 0)
+        for line in lines:
+            stack, us = line.rsplit(" ", 1)
+            self.assertTrue(stack.startswith("reaction;"))
+            self.assertGreater(int(us), 0)
+        self.assertTrue(any("find_hamiltonian_paths" in line for line in lines))
+
+
+class TestFuzz(absltest.TestCase):
+    def test_random_traversal(self):
+        import random
+
+        mol = Chem.MolFromSmarts("[CX3](=[OX1])[OX2][CX3](=[OX1])c1ccccc1")
+        rng = random.Random(0)
+        variants = set(random_traversal(mol, rng) for _ in range(20))
+        self.assertGreater(len(variants), 1)
+        expected = canon_smarts("[CX3](=[OX1])[OX2][CX3](=[OX1])c1ccccc1")
+        for v in variants:
+            self.assertEqual(canon_smarts(v), expected)
+
+    def test_check_and_shrink(self):
+        self.assertIsNone(check_invariance("F/C=C/[C@H](Cl)Br", 20))
+        # RDKit drops a directional bond without a partner; such orderings are not checked
+        self.assertIsNone(
+            check_invariance("[C:5]=[C:4]/[C:2](=[O;D1;H0:3])-[OH;D1;+0:1]", 20)
+        )
+        with self.assertRaises(ValueError):
+            check_invariance("[C")
+
+        minimal = shrink("CCC(N)CC1CCCCC1O", fails=lambda sm: "N" in sm)
+        self.assertEqual(minimal, "N")
+        # substituents are removed, the ring itself is kept
+        self.assertEqual(shrink("CC1CCC(O)CC1N", fails=lambda sm: "1" in sm), "C1CCCCC1")
+
+    def test_fuzz_pool(self):
+        templates = load_dataset("noncanon_efg_templates_20240108")
+        templates = list(templates["noncanon_efg_templates"][:12]) + ["[C"]
+        for workers in [1, 2]:
+            report = fuzz(templates, n_perms=5, workers=workers)
+            self.assertEqual(report["checked"], 13)
+            self.assertEqual(report["permutations"], 60)
+            self.assertEqual(report["failures"], [])
+            self.assertEqual([e["index"] for e in report["errors"]], [12])
+
+
+class TestAsync(absltest.TestCase):
+    def test_coalesced_requests(self):
+        smarts = "[Br;!Cl;H10;X10][c;H0]1[c;H0][c;H0][c;H0][c;H0][c;H0]1"
+
+        async def run():
+            async with AsyncCanonicalizer("thread", max_workers=2) as canon:
+                outs = await asyncio.gather(
+                    *[canon.canon_smarts(smarts) for _ in range(5)],
+                    canon.canon_smarts("[C][O]"),
+                    canon.canon_reaction_smarts("([C:1].[N:2])>>[C:1]#[N:2]", True),
+                )
+                return outs, canon.submitted, canon.coalesced
+
+        outs, submitted, coalesced = asyncio.run(run())
+        self.assertEqual(outs[:5], [canon_smarts(smarts)] * 5)
+        self.assertEqual(outs[5], canon_smarts("[C][O]"))
+        self.assertEqual(
+            outs[6], canon_reaction_smarts("([C:1].[N:2])>>[C:1]#[N:2]", True)
+        )
+        self.assertEqual(submitted, 3)
+        self.assertEqual(coalesced, 4)
+
+    def test_cancel_one_waiter(self):
+        smarts = "[Cl][C][C][C][C][C][C][N][C][C][C][C][C][C][Br]"
+
+        async def run():
+            async with AsyncCanonicalizer("thread", max_workers=1) as canon:
+                first = asyncio.ensure_future(canon.canon_smarts(smarts))
+                second = asyncio.ensure_future(canon.canon_smarts(smarts))
+                await asyncio.sleep(0)
+                first.cancel()
+                return await second, first.cancelled()
+
+        out, cancelled = asyncio.run(run())
+        self.assertTrue(cancelled)
+        self.assertEqual(out, canon_smarts(smarts))
+
+
+class TestServer(absltest.TestCase):
+    def post(self, url, payload):
+        req = urllib.request.Request(url, data=json.dumps(payload).encode())
+        with urllib.request.urlopen(req) as resp:
+            return json.loads(resp.read())
+
+    def test_canonicalize_over_http(self):
+        smarts = ["[C;H0;+0]-[C;H1;+0]", "[C;H1;+0]-[C;H0;+0]", "bad(("]
+        rxn = "([C:1].[N:2])>>[C:1]#[N:2]"
+        with CanonServer(("127.0.0.1", 0), workers=2).start() as server:
+            out = self.post(server.url + "/canon_smarts", {"smarts": smarts[0]})
+            self.assertEqual(out["result"], canon_smarts(smarts[0]))
+
+            out = self.post(server.url + "/canon_smarts", {"smarts": smarts})
+            self.assertEqual(out["results"][:2], [canon_smarts(smarts[0])] * 2)
+            self.assertIsNone(out["results"][2])
+            self.assertIsNotNone(out["errors"][2])
+
+            out = self.post(
+                server.url + "/canon_reaction_smarts",
+                {"smarts": rxn, "remapping": True},
+            )
+            self.assertEqual(
+                out["result"], canon_reaction_smarts(rxn, True, "drugbank", True)
+            )
+
+            with urllib.request.urlopen(server.url + "/stats") as resp:
+                stats = json.loads(resp.read())
+            self.assertEqual(stats["cache_hits"], 1)
+
+    def test_close_fails_queued_requests(self):
+        with CanonPool(workers=1) as pool:
+            batcher = MicroBatcher(pool)
+            self.assertEqual(
+                batcher.submit("[C][O]").result(), (canon_smarts("[C][O]"), None)
+            )
+
+            # stop the collector so the next request stays queued
+            batcher.running = False
+            batcher.thread.join()
+            fut = batcher.submit("[C][N]")
+            batcher.close()
+            with self.assertRaises(ValueError):
+                fut.result(timeout=5)
+            with self.assertRaises(ValueError):
+                batcher.submit("[C][N]")
+
+
+class TestDatasets(absltest.TestCase):
+    def test_formats_agree(self):
+        name = "noncanon_efg_templates_20240108"
+        df = load_dataset(name)
+        self.assertTrue(find_dataset(name).endswith(".csv"))
+        self.assertIs(load_dataset(name), df)
+
+        xlsx = read_dataset(find_dataset(name + ".xlsx"))
+        self.assertEqual(list(xlsx.columns), list(df.columns))
+        self.assertEqual(
+            list(xlsx["noncanon_efg_templates"]), list(df["noncanon_efg_templates"])
+        )
+
+        lines = self.create_tempfile(
+            "templates.smarts", content="\n".join(df["noncanon_efg_templates"]) + "\n"
+        )
+        self.assertEqual(
+            list(read_dataset(lines.full_path)["smarts"]),
+            list(df["noncanon_efg_templates"]),
+        )
+
+
+class TestBenchmark(absltest.TestCase):
+    def test_suite_and_baseline(self):
+        result = bench_suite(size=2, repeats=1, warmup=0)
+        self.assertIn("token_canon", result["cases"])
+        self.assertIn("canon_smarts_recursive", result["cases"])
+        self.assertIn("canon_reaction_smarts", result["cases"])
+        for case in result["cases"].values():
+            self.assertGreater(case["n"], 0)
+            self.assertEqual(case["errors"], 0)
+        json.dumps(result)
+
+        baseline = json.loads(json.dumps(result))
+        baseline["cases"]["token_canon"]["per_item_ms"] *= 2
+        baseline["cases"]["canon_reaction_smarts"]["per_item_ms"] /= 2
+        comparison = compare_to_baseline(result, baseline)
+        self.assertEqual(comparison["token_canon"]["status"], "improvement")
+        self.assertEqual(comparison["canon_reaction_smarts"]["status"], "regression")
+        self.assertEqual(comparison["canon_smarts_recursive"]["status"], "ok")
+
+        baseline["meta"]["repeats"] = 5
+        with self.assertRaises(ValueError):
+            compare_to_baseline(result, baseline)
+
+    def test_synthetic_families(self):
+        atoms = {
+            ("chain", 5): 5,
+            ("ring", 7): 7,
+            ("ladder", 3): 14,
+            ("star", 2): 9,
+            ("dendrimer", 3): 15,
+            ("wildcard_ring", 4): 4,
+            ("recursive", 3): 2,
+        }
+        for (family, n), num_atoms in atoms.items():
+            sm = generate(family, n)
+            mol = Chem.MolFromSmarts(sm)
+            self.assertIsNotNone(mol, sm)
+            self.assertEqual(mol.GetNumAtoms(), num_atoms, sm)
+        self.assertEqual(set(f for f, _ in atoms), set(FAMILIES))
+        self.assertEqual(generate("ladder", 2), "C1CC2CCCCC2CC1")
+        self.assertEqual(generate("ladder", 3, ring_size=4), "C1C2C3CCC3C2C1")
+        self.assertEqual(generate("recursive", 2), "[C;$(C[C;$(C[N])])]C")
+        # ring closure digits above 9
+        sm = generate("ladder", 12, ring_size=4)
+        self.assertIn("%10", sm)
+        mol = Chem.MolFromSmarts(sm)
+        self.assertEqual(mol.GetNumBonds() - mol.GetNumAtoms() + 1, 12)
+
+    def test_scaling(self):
+        fit = fit_scaling([1, 2, 4, 8], [0.01, 0.04, 0.16, 0.64])
+        self.assertEqual(fit["model"], "power")
+        self.assertAlmostEqual(fit["power"]["exponent"], 2.0)
+        fit = fit_scaling([1, 2, 3, 4], [0.01, 0.03, 0.09, 0.27])
+        self.assertEqual(fit["model"], "exponential")
+        self.assertAlmostEqual(fit["exponential"]["rate"], 3.0)
+
+        result = bench_scaling(["ring", "dendrimer"], {"ring": [3, 4, 6]}, repeats=1)
+        ring = result["families"]["ring"]
+        self.assertEqual([p["n"] for p in ring["points"]], [3, 4, 6])
+        self.assertIsNone(ring["blowup"])
+        self.assertIn(ring["fit"]["model"], ["power", "exponential"])
+        # the search gives up on deep symmetric trees
+        blowup = result["families"]["dendrimer"]["blowup"]
+        self.assertEqual(blowup["n"], 4)
+        self.assertIn("ValueError", blowup["reason"])
+        json.dumps(result)
+
+    def test_substruct_harness(self):
+        df = load_dataset("drugbank_non_matching_substruct_dataset_20240108")
+        templates = list(df["query_smarts"][:6])
+        substrates = list(df["non_matching_substrate_smiles"][:6])
+        flat = {"[C]": 1.0, "[N]": 1.0}
+
+        for workers in [1, 2]:
+            result = bench_substruct(
+                templates,
+                substrates,
+                ["drugbank", flat],
+                repeats=3,
+                iters=2,
+                workers=workers,
+                n_boot=100,
+            )
+            self.assertEqual(set(result["summary"]), {"drugbank", "custom_1"})
+            summary = result["summary"]["drugbank"]
+            self.assertEqual(summary["templates"], 6)
+            self.assertLessEqual(summary["geomean_ci"][0], summary["geomean_speedup"])
+            self.assertGreaterEqual(summary["geomean_ci"][1], summary["geomean_speedup"])
+            self.assertEqual([t["index"] for t in result["templates"]], list(range(6)))
+            item = result["templates"][0]["variants"]["drugbank"]
+            self.assertEqual(item["smarts"], canon_smarts(templates[0], True))
+            self.assertLessEqual(item["ci_low"], item["ci_high"])
+
+        tmp = self.create_tempdir().full_path
+        write_report(result, os.path.join(tmp, "report.json"))
+        write_report(result, os.path.join(tmp, "report.csv"))
+        rows = pd.read_csv(os.path.join(tmp, "report.csv"))
+        self.assertEqual(len(rows), 12)
+        self.assertEqual(set(rows["embedding"]), {"drugbank", "custom_1"})
+        with self.assertRaises(ValueError):
+            bench_substruct(templates, substrates[:2])
+
+        # a template that does not parse is not timed
+        result = bench_substruct(
+            ["bad((", templates[0]], substrates[:2], repeats=1, iters=1, workers=1
+        )
+        self.assertIsNone(result["templates"][0]["variants"]["drugbank"]["median_s"])
+        write_report(result, os.path.join(tmp, "report.json"))
+        with open(os.path.join(tmp, "report.json")) as f:
+            self.assertNotIn("NaN", f.read())
+
+
 class TestProfiling(absltest.TestCase):
     def test_non_recursive_substruct_profile(self):
-        path = (
-            os.path.dirname(os.path.abspath(__file__))
-            + "/testing_data/drugbank_non_matching_substruct_dataset_20240108.xlsx"
-        )
-        noncanon_templates = pd.read_excel(path)
+        noncanon_templates = load_dataset("drugbank_non_matching_substruct_dataset_20240108")
 
         times = time_compare_substruct_match(
             noncanon_templates["query_smarts"],
@@ -0,0 +1,366 @@
+import argparse
+import json
+import queue
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from rdcanon.batch import CanonPool
+from rdcanon.cli import EMBEDDINGS, _load_embedding
+
+
+class LRUCache:
+    """
+    A thread-safe in-memory least recently used cache.
+    """
+
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            if key in self.data:
+                self.data.move_to_end(key)
+                self.hits = self.hits + 1
+                return self.data[key]
+            self.misses = self.misses + 1
+            return None
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_size:
+                self.data.popitem(last=False)
+
+    def __len__(self):
+        return len(self.data)
+
+
+class MicroBatcher:
+    """
+    Collects single canonicalization requests into batches for a CanonPool.
+
+    A collector thread waits up to `max_delay` seconds (or until `max_batch` items are queued)
+    after the first request of a batch, groups the requests by their options, and hands each
+    group to one of `workers` dispatch threads, so batches keep every pool worker busy.
+    Repeated inputs are answered from an in-memory LRU cache, and duplicates within a
+    batch are computed once.
+
+    Args:
+        pool (CanonPool): The pool that canonicalizes the batches.
+        max_batch (int, optional): Maximum number of items per batch. Defaults to 256.
+        max_delay (float, optional): Seconds to wait for a batch to fill. Defaults to 0.005.
+        cache_size (int, optional): Number of results kept in memory. Defaults to 100000.
+    """
+
+    def __init__(self, pool, max_batch=256, max_delay=0.005, cache_size=100000):
+        self.pool = pool
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.cache = LRUCache(cache_size)
+        self.queue = queue.Queue()
+        self.dispatch = ThreadPoolExecutor(pool.workers)
+        self.batches = 0
+        self.items = 0
+        self.stats_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.closed = False
+        self.running = True
+        self.thread = threading.Thread(target=self._collect, daemon=True)
+        self.thread.start()
+
+    def submit(self, smarts, kind="smarts", mapping=False, remapping=False):
+        """
+        Queues one input and returns a Future of its (result, error) tuple.
+        """
+        if self.closed:
+            raise ValueError("batcher is closed")
+        if kind == "reaction" and remapping:
+            mapping = True
+        key = (kind, bool(mapping), bool(remapping), smarts)
+        fut = Future()
+        hit = self.cache.get(key)
+        if hit is not None:
+            fut.set_result((hit, None))
+            return fut
+        with self.lock:
+            if self.closed:
+                raise ValueError("batcher is closed")
+            self.queue.put((key, fut))
+        return fut
+
+    def _collect(self):
+        while self.running:
+            try:
+                first = self.queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if first is None:
+                break
+            batch = [first]
+            deadline = time.perf_counter() + self.max_delay
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.running = False
+                    break
+                batch.append(item)
+
+            groups = {}
+            for key, fut in batch:
+                options = key[:3]
+                if options not in groups:
+                    groups[options] = OrderedDict()
+                groups[options].setdefault(key[3], []).append(fut)
+            for options, futs_by_smarts in groups.items():
+                self.dispatch.submit(self._run, options, futs_by_smarts)
+
+    def _run(self, options, futs_by_smarts):
+        kind, mapping, remapping = options
+        smarts = list(futs_by_smarts)
+        try:
+            results = self.pool.map(
+                smarts, kind=kind, mapping=mapping, remapping=remapping
+            )
+        except Exception as e:
+            for futs in futs_by_smarts.values():
+                for fut in futs:
+                    fut.set_exception(e)
+            return
+
+        with self.stats_lock:
+            self.batches = self.batches + 1
+            self.items = self.items + len(smarts)
+        for sm, pair in zip(smarts, results):
+            if pair[1] is None:
+                self.cache.put(options + (sm,), pair[0])
+            for fut in futs_by_smarts[sm]:
+                fut.set_result(pair)
+
+    def stats(self):
+        lookups = self.cache.hits + self.cache.misses
+        return {
+            "batches": self.batches,
+            "canonicalized": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+            "cache_hits": self.cache.hits,
+            "cache_misses": self.cache.misses,
+            "cache_hit_rate": self.cache.hits / lookups if lookups else 0.0,
+            "cache_size": len(self.cache),
+        }
+
+    def close(self):
+        """
+        Stops the batcher. Batches already collected are finished; requests still queued
+        fail with ValueError.
+        """
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.running = False
+            self.queue.put(None)
+        self.thread.join()
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                item[1].set_exception(ValueError("batcher is closed"))
+        self.dispatch.shutdown(wait=True)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    routes = {
+        "/canon_smarts": "smarts",
+        "/canon_reaction_smarts": "reaction",
+    }
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def _reply(self, code, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._reply(200, {"status": "ok"})
+        elif self.path == "/stats":
+            self._reply(200, self.server.batcher.stats())
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        kind = self.routes.get(self.path)
+        if kind is None:
+            self._reply(404, {"error": "not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length))
+            smarts = request["smarts"]
+        except (ValueError, KeyError, TypeError):
+            self._reply(400, {"error": "expected a JSON object with a 'smarts' field"})
+            return
+
+        single = type(smarts) == str
+        if single:
+            smarts = [smarts]
+        if type(smarts) != list or not all(type(sm) == str for sm in smarts):
+            self._reply(400, {"error": "'smarts' must be a string or a list of strings"})
+            return
+
+        futs = [
+            self.server.batcher.submit(
+                sm,
+                kind,
+                bool(request.get("mapping", False)),
+                bool(request.get("remapping", False)),
+            )
+            for sm in smarts
+        ]
+        pairs = [fut.result() for fut in futs]
+
+        if single:
+            out, error = pairs[0]
+            self._reply(200 if error is None else 422, {"result": out, "error": error})
+        else:
+            self._reply(
+                200,
+                {"results": [p[0] for p in pairs], "errors": [p[1] for p in pairs]},
+            )
+
+
+class CanonServer(ThreadingHTTPServer):
+    """
+    An HTTP/JSON canonicalization server built on the standard library.
+
+    POST /canon_smarts and /canon_reaction_smarts accept {"smarts": str or list, "mapping": bool,
+    "remapping": bool} and return {"result", "error"} for a single input or {"results", "errors"}
+    for a list. GET /stats reports batching and cache statistics, GET /health returns {"status": "ok"}.
+
+    Args:
+        address (tuple, optional): (host, port) to bind. Port 0 picks a free port. Defaults to ("127.0.0.1", 8000).
+        embedding (str or dict, optional): The embedding used for every request. Defaults to "drugbank".
+        workers (int, optional): Number of pool worker processes. Defaults to os.cpu_count().
+        max_batch (int, optional): Maximum number of items per batch. Defaults to 256.
+        max_delay (float, optional): Seconds to wait for a batch to fill. Defaults to 0.005.
+        cache_size (int, optional): Number of results kept in memory. Defaults to 100000.
+        verbose (bool, optional): Whether to log every request. Defaults to False.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address=("127.0.0.1", 8000),
+        embedding="drugbank",
+        workers=None,
+        max_batch=256,
+        max_delay=0.005,
+        cache_size=100000,
+        verbose=False,
+    ):
+        self.canon_pool = CanonPool(
+            embedding=embedding, workers=workers, chunk_size=16
+        )
+        self.batcher = MicroBatcher(self.canon_pool, max_batch, max_delay, cache_size)
+        self.verbose = verbose
+        ThreadingHTTPServer.__init__(self, address, _Handler)
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return "http://%s:%d" % (host, port)
+
+    def start(self):
+        """
+        Serves requests from a background thread.
+        """
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        if self.thread is not None:
+            self.thread.join()
+        self.server_close()
+        self.batcher.close()
+        self.canon_pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="rdcanon-server", description="Serve SMARTS canonicalization over HTTP."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--embedding",
+        default="drugbank",
+        help="one of "
+        + ", ".join(EMBEDDINGS)
+        + ", or a JSON file of primitive frequencies (default drugbank)",
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--max-batch", type=int, default=256)
+    parser.add_argument(
+        "--max-delay", type=float, default=5.0, help="batching delay in milliseconds"
+    )
+    parser.add_argument("--cache-size", type=int, default=100000)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    server = CanonServer(
+        (args.host, args.port),
+        _load_embedding(args.embedding),
+        args.workers,
+        args.max_batch,
+        args.max_delay / 1000,
+        args.cache_size,
+        args.verbose,
+    )
+    print("rdcanon server listening on " + server.url, file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.batcher.close()
+        server.canon_pool.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
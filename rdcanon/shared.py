@@ -0,0 +1,159 @@
+import mmap
+import pickle
+import struct
+from multiprocessing import shared_memory
+
+MAGIC = b"RDCT"
+HEADER = struct.Struct("<4sQ")
+OFFSET = struct.Struct("<Q")
+
+_missing = object()
+
+
+def _pack(mapping):
+    items = sorted(
+        (str(k).encode(), pickle.dumps(v, pickle.HIGHEST_PROTOCOL))
+        for k, v in mapping.items()
+    )
+    n = len(items)
+
+    key_offsets = [0]
+    val_offsets = [0]
+    for k, v in items:
+        key_offsets.append(key_offsets[-1] + len(k))
+        val_offsets.append(val_offsets[-1] + len(v))
+
+    parts = [HEADER.pack(MAGIC, n)]
+    parts.append(struct.pack("<%dQ" % (n + 1), *key_offsets))
+    parts.append(struct.pack("<%dQ" % (n + 1), *val_offsets))
+    parts.extend(k for k, _ in items)
+    parts.extend(v for _, v in items)
+    return b"".join(parts)
+
+
+class SharedTable:
+    """
+    A read-only mapping from strings to picklable values stored in one flat buffer.
+
+    The table is built once with create() (shared memory) or write() (a file), and other
+    processes attach to it by name or path without copying it: keys are found by binary
+    search over the buffer and only the value that is looked up is unpickled. It is used
+    to hand a warm token cache to worker processes.
+
+    Args:
+        buf (buffer): The packed table, e.g. the buffer of a SharedMemory block or an mmap.
+        shm (SharedMemory, optional): The shared memory block backing `buf`.
+        mm (mmap, optional): The memory map backing `buf`.
+    """
+
+    def __init__(self, buf, shm=None, mm=None):
+        self.shm = shm
+        self.mm = mm
+        self.buf = memoryview(buf)
+        magic, self.n = HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC:
+            raise ValueError("not a SharedTable buffer")
+        self._key_offsets = HEADER.size
+        self._val_offsets = self._key_offsets + 8 * (self.n + 1)
+        self._keys = self._val_offsets + 8 * (self.n + 1)
+        self._vals = self._keys + self._offset(self._key_offsets, self.n)
+
+    @classmethod
+    def create(cls, mapping):
+        """
+        Packs a mapping into a new shared memory block.
+
+        Args:
+            mapping (dict): Keys are converted with str(); values must be picklable.
+
+        Returns:
+            SharedTable: The table. The creating process should call unlink() when it is no longer needed.
+        """
+        data = _pack(mapping)
+        shm = shared_memory.SharedMemory(create=True, size=len(data))
+        shm.buf[: len(data)] = data
+        return cls(shm.buf, shm=shm)
+
+    @classmethod
+    def attach(cls, name):
+        """
+        Attaches to a table created by another process.
+        """
+        shm = shared_memory.SharedMemory(name=name)
+        return cls(shm.buf, shm=shm)
+
+    @staticmethod
+    def write(mapping, path):
+        """
+        Writes a mapping to a file that open() maps into memory.
+        """
+        with open(path, "wb") as f:
+            f.write(_pack(mapping))
+
+    @classmethod
+    def open(cls, path):
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(mm, mm=mm)
+
+    @property
+    def name(self):
+        return self.shm.name if self.shm is not None else None
+
+    def _offset(self, base, i):
+        return OFFSET.unpack_from(self.buf, base + 8 * i)[0]
+
+    def _key(self, i):
+        start = self._keys + self._offset(self._key_offsets, i)
+        end = self._keys + self._offset(self._key_offsets, i + 1)
+        return bytes(self.buf[start:end])
+
+    def _find(self, key):
+        key = str(key).encode()
+        lo = 0
+        hi = self.n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.n and self._key(lo) == key:
+            return lo
+        return -1
+
+    def get(self, key, default=None):
+        i = self._find(key)
+        if i < 0:
+            return default
+        start = self._vals + self._offset(self._val_offsets, i)
+        end = self._vals + self._offset(self._val_offsets, i + 1)
+        return pickle.loads(self.buf[start:end])
+
+    def __contains__(self, key):
+        return self._find(key) >= 0
+
+    def __getitem__(self, key):
+        value = self.get(key, _missing)
+        if value is _missing:
+            raise KeyError(key)
+        return value
+
+    def __len__(self):
+        return self.n
+
+    def __reduce__(self):
+        if self.shm is None:
+            raise TypeError("only shared memory tables can be sent to other processes")
+        return (SharedTable.attach, (self.shm.name,))
+
+    def close(self):
+        self.buf.release()
+        if self.shm is not None:
+            self.shm.close()
+        if self.mm is not None:
+            self.mm.close()
+
+    def unlink(self):
+        if self.shm is not None:
+            self.shm.unlink()
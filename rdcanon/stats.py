@@ -0,0 +1,110 @@
+import tracemalloc
+
+PHASES = ["rdkit_parse", "scan", "token_canon", "search", "regen", "total"]
+
+COUNTERS = [
+    "calls",
+    "atoms",
+    "tied_start_nodes",
+    "states_pushed",
+    "states_popped",
+    "prefixes_pruned",
+    "ring_closures",
+    "paths",
+    "tied_paths",
+    "regen_calls",
+    "token_cache_hits",
+    "token_cache_misses",
+]
+
+
+class CanonStats:
+    """
+    Search counters and phase timings filled in by canon_smarts and Graph.
+
+    Pass an instance as `stats` to canon_smarts or canon_reaction_smarts. Counters and
+    timings accumulate over every SMARTS canonicalized with the same object, so one object
+    can describe a single template or a whole reaction. Nothing is recorded, and nothing is
+    timed, when `stats` is None.
+
+    With memory=True, every canon_smarts call is also traced with tracemalloc, which slows
+    canonicalization down severalfold. tracemalloc is started for the call if it is not
+    running already, and its peak is reset at the start of every call.
+
+    Counters:
+        calls: SMARTS canonicalized.
+        atoms: Heavy atoms (graph nodes).
+        tied_start_nodes: Atoms tied for the best token score, from which the search starts.
+        states_pushed, states_popped: Search states added to and taken from the stack.
+        prefixes_pruned: Extensions dropped because they scored worse than the best prefix seen.
+        ring_closures: Ring closure digits written.
+        paths: Complete traversals found.
+        tied_paths: Traversals tied for the best score, each of which is regenerated.
+        regen_calls: Calls to Graph.regen_molecule.
+        token_cache_hits, token_cache_misses: Atom token cache lookups, including those of
+            recursive SMARTS bodies.
+
+    Timings (seconds, in `timings`):
+        rdkit_parse, scan, token_canon, search, regen and total.
+
+    Memory (bytes, with memory=True):
+        peak_memory: The largest peak of Python allocations of one canon_smarts call, above the
+            memory in use when the call started.
+        last_peak_memory: The peak of the latest call.
+
+    Args:
+        memory (bool, optional): Whether to measure peak memory. Defaults to False.
+    """
+
+    def __init__(self, memory=False):
+        for name in COUNTERS:
+            setattr(self, name, 0)
+        self.timings = dict.fromkeys(PHASES, 0.0)
+        self.memory = memory
+        self.peak_memory = 0
+        self.last_peak_memory = 0
+
+    def start_memory(self):
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        return started, tracemalloc.get_traced_memory()[0]
+
+    def stop_memory(self, token):
+        started, base = token
+        peak = tracemalloc.get_traced_memory()[1] - base
+        if started:
+            tracemalloc.stop()
+        self.last_peak_memory = peak
+        self.peak_memory = max(self.peak_memory, peak)
+
+    def add_time(self, phase, seconds):
+        self.timings[phase] = self.timings[phase] + seconds
+
+    def merge(self, other):
+        """
+        Adds the counters and timings of another CanonStats to this one.
+        """
+        for name in COUNTERS:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        for phase in PHASES:
+            self.add_time(phase, other.timings[phase])
+        self.peak_memory = max(self.peak_memory, other.peak_memory)
+        return self
+
+    def as_dict(self):
+        """
+        Returns the counters, timings and peak memory as a flat dictionary, with timings keyed
+        "<phase>_s".
+        """
+        out = {name: getattr(self, name) for name in COUNTERS}
+        for phase in PHASES:
+            out[phase + "_s"] = self.timings[phase]
+        out["peak_memory"] = self.peak_memory
+        return out
+
+    def __repr__(self):
+        return "CanonStats(%s)" % ", ".join(
+            "%s=%s" % (k, v) for k, v in self.as_dict().items()
+        )
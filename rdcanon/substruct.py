@@ -0,0 +1,313 @@
+import csv
+import json
+import multiprocessing
+import os
+import platform
+import random
+import time
+import numpy as np
+from rdkit import Chem
+from rdcanon.batch import canon_smarts_batch
+from rdcanon.version import __version__
+
+BASELINE = "input"
+
+
+def _pin_worker(counter, cpus):
+    # every worker takes the next CPU of the parent's affinity set
+    with counter.get_lock():
+        i = counter.value
+        counter.value = counter.value + 1
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {cpus[i % len(cpus)]})
+
+
+def _time_rows(task):
+    """
+    Times every variant of each template of a chunk against its substrate.
+
+    Within a repeat the variants are timed back to back in a random order, so slow drifts
+    of the machine affect all of them alike.
+    """
+    rows, repeats, iters, seed = task
+    out = []
+    for index, variants, substrate in rows:
+        rng = random.Random(seed + index)
+        mol = Chem.MolFromSmiles(substrate)
+        queries = [Chem.MolFromSmarts(v) if v is not None else None for v in variants]
+        times = np.full((len(variants), repeats), np.nan)
+        if mol is None or queries[0] is None:
+            out.append((index, times.tolist()))
+            continue
+        order = [i for i, q in enumerate(queries) if q is not None]
+        for r in range(repeats):
+            rng.shuffle(order)
+            for i in order:
+                q = queries[i]
+                start = time.perf_counter()
+                for _ in range(iters):
+                    mol.HasSubstructMatch(q)
+                times[i, r] = (time.perf_counter() - start) / iters
+        out.append((index, times.tolist()))
+    return out
+
+
+def bootstrap_ci(values, statistic=np.mean, confidence=0.95, n_boot=2000, rng=None):
+    """
+    Returns a percentile bootstrap confidence interval of a statistic.
+
+    Args:
+        values (array): The sample.
+        statistic (callable, optional): Function of a 1-D array, or of a 2-D array along axis 1
+            when it accepts `axis`. Defaults to np.mean.
+        confidence (float, optional): Coverage of the interval. Defaults to 0.95.
+        n_boot (int, optional): Number of resamples. Defaults to 2000.
+        rng (numpy.random.Generator, optional): The random generator.
+
+    Returns:
+        tuple: (low, high), or (nan, nan) for an empty sample.
+    """
+    values = np.asarray(values, dtype=float)
+    if len(values) == 0:
+        return float("nan"), float("nan")
+    if rng is None:
+        rng = np.random.default_rng(0)
+    samples = values[rng.integers(0, len(values), (n_boot, len(values)))]
+    try:
+        stats = statistic(samples, axis=1)
+    except TypeError:
+        stats = np.array([statistic(s) for s in samples])
+    alpha = (1 - confidence) / 2
+    return float(np.quantile(stats, alpha)), float(np.quantile(stats, 1 - alpha))
+
+
+def _label(embedding, i):
+    if type(embedding) == tuple:
+        return embedding[0], embedding[1]
+    if type(embedding) == str:
+        return embedding, embedding
+    return "custom_%d" % i, embedding
+
+
+def bench_substruct(
+    templates,
+    substrates,
+    embeddings=["drugbank"],
+    repeats=5,
+    iters=100,
+    workers=None,
+    chunk_size=16,
+    pin=True,
+    confidence=0.95,
+    n_boot=2000,
+    seed=0,
+):
+    """
+    Measures the substructure match speedup of canonical templates, per template and per embedding.
+
+    Each template is canonicalized with every embedding and matched against its paired
+    substrate (templates[i] against substrates[i], as in util.time_compare_substruct_match).
+    For every template, the input pattern and all canonical variants are timed in the same
+    worker, `iters` matches per measurement and `repeats` measurements each, with the
+    variants interleaved in a random order. The speedup of a template is the ratio of the
+    median input time to the median time of the variant, with a bootstrap confidence interval
+    over the paired repeats. The summary of each embedding gives the geometric mean, the
+    median and the ratio of total times over templates, each with a bootstrap interval over
+    templates, and the fraction of templates that became faster.
+
+    Args:
+        templates (list): SMARTS templates.
+        substrates (list): SMILES substrates, one per template.
+        embeddings (list, optional): Embedding names, embedding dictionaries (reported as custom_<i>)
+            or (label, embedding) tuples. Defaults to ["drugbank"].
+        repeats (int, optional): Measurements per template and variant. Defaults to 5.
+        iters (int, optional): Matches per measurement. Defaults to 100.
+        workers (int, optional): Number of worker processes used for canonicalization and timing.
+            Defaults to os.cpu_count(). 1 runs in the calling process.
+        chunk_size (int, optional): Templates per timing task. Defaults to 16.
+        pin (bool, optional): Whether to pin every timing worker to its own CPU (Linux only). Defaults to True.
+        confidence (float, optional): Coverage of the confidence intervals. Defaults to 0.95.
+        n_boot (int, optional): Bootstrap resamples. Defaults to 2000.
+        seed (int, optional): Seed of the variant order and the bootstrap. Defaults to 0.
+
+    Returns:
+        dict: "meta", "summary" (per embedding) and "templates" (per template: the input, the
+        canonical variants, the median times and the speedups with their intervals).
+    """
+    templates = list(templates)
+    substrates = list(substrates)
+    if len(templates) != len(substrates):
+        raise ValueError("templates and substrates must have the same length")
+    if workers is None:
+        workers = os.cpu_count() or 1
+    labeled = [_label(e, i) for i, e in enumerate(embeddings)]
+    labels = [BASELINE] + [label for label, _ in labeled]
+    if len(set(labels)) != len(labels):
+        raise ValueError("embedding labels must be unique")
+
+    variants = [templates]
+    errors = {}
+    for label, embedding in labeled:
+        canon, errs = canon_smarts_batch(
+            templates,
+            mapping=True,
+            embedding=embedding,
+            workers=workers,
+            return_errors=True,
+        )
+        variants.append(canon)
+        errors[label] = sum(e is not None for e in errs)
+
+    rows = [(i, [v[i] for v in variants], substrates[i]) for i in range(len(templates))]
+    tasks = [
+        (rows[i : i + chunk_size], repeats, iters, seed)
+        for i in range(0, len(rows), chunk_size)
+    ]
+    times = [None] * len(rows)
+    if workers == 1:
+        for task in tasks:
+            for index, t in _time_rows(task):
+                times[index] = np.array(t)
+    else:
+        cpus = []
+        if pin and hasattr(os, "sched_getaffinity"):
+            cpus = sorted(os.sched_getaffinity(0))
+        ctx = multiprocessing.get_context()
+        counter = ctx.Value("i", 0)
+        with ctx.Pool(workers, _pin_worker, (counter, cpus)) as pool:
+            for chunk in pool.imap_unordered(_time_rows, tasks):
+                for index, t in chunk:
+                    times[index] = np.array(t)
+
+    rng = np.random.default_rng(seed)
+    per_template = []
+    speedups = {label: [] for label in labels[1:]}
+    base_totals = {label: [] for label in labels[1:]}
+    variant_totals = {label: [] for label in labels[1:]}
+    for i, t in enumerate(times):
+        medians = np.median(t, axis=1)
+        entry = {
+            "index": i,
+            "template": templates[i],
+            "substrate": substrates[i],
+            "variants": {},
+        }
+        for k, label in enumerate(labels):
+            # variants that did not parse were not timed
+            median = float(medians[k]) if np.isfinite(medians[k]) else None
+            item = {"smarts": variants[k][i], "median_s": median}
+            if k > 0:
+                paired = t[0] / t[k]
+                paired = paired[np.isfinite(paired)]
+                if len(paired) > 0:
+                    item["speedup"] = float(medians[0] / medians[k])
+                    low, high = bootstrap_ci(
+                        np.log(paired), np.mean, confidence, n_boot, rng
+                    )
+                    item["ci_low"] = float(np.exp(low))
+                    item["ci_high"] = float(np.exp(high))
+                    speedups[label].append(item["speedup"])
+                    base_totals[label].append(medians[0])
+                    variant_totals[label].append(medians[k])
+            entry["variants"][label] = item
+        per_template.append(entry)
+
+    summary = {}
+    for label in labels[1:]:
+        s = np.array(speedups[label])
+        if len(s) == 0:
+            summary[label] = {"templates": 0, "canon_errors": errors[label]}
+            continue
+        log_s = np.log(s)
+        base = np.array(base_totals[label])
+        var = np.array(variant_totals[label])
+
+        def total_ratio(idx, axis=None):
+            idx = idx.astype(int)
+            return base[idx].sum(axis=axis) / var[idx].sum(axis=axis)
+
+        gm_ci = bootstrap_ci(log_s, np.mean, confidence, n_boot, rng)
+        summary[label] = {
+            "templates": int(len(s)),
+            "canon_errors": errors[label],
+            "geomean_speedup": float(np.exp(log_s.mean())),
+            "geomean_ci": [float(np.exp(gm_ci[0])), float(np.exp(gm_ci[1]))],
+            "median_speedup": float(np.median(s)),
+            "median_ci": list(bootstrap_ci(s, np.median, confidence, n_boot, rng)),
+            "total_speedup": float(base.sum() / var.sum()),
+            "total_ci": list(
+                bootstrap_ci(np.arange(len(s)), total_ratio, confidence, n_boot, rng)
+            ),
+            "fraction_faster": float(np.mean(s > 1)),
+            "quantiles": {
+                str(q): float(np.quantile(s, q)) for q in (0.05, 0.25, 0.5, 0.75, 0.95)
+            },
+        }
+
+    return {
+        "meta": {
+            "rdcanon": __version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "templates": len(templates),
+            "embeddings": labels[1:],
+            "repeats": repeats,
+            "iters": iters,
+            "workers": workers,
+            "pinned": bool(pin and workers > 1 and hasattr(os, "sched_setaffinity")),
+            "confidence": confidence,
+            "seed": seed,
+        },
+        "summary": summary,
+        "templates": per_template,
+    }
+
+
+CSV_FIELDS = [
+    "index",
+    "embedding",
+    "template",
+    "canon_template",
+    "substrate",
+    "input_median_s",
+    "median_s",
+    "speedup",
+    "ci_low",
+    "ci_high",
+]
+
+
+def write_report(result, path):
+    """
+    Writes a bench_substruct result as JSON (.json) or as one CSV row per template and embedding (.csv).
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".json":
+        with open(path, "w") as f:
+            json.dump(result, f, indent=2, allow_nan=False)
+    elif ext == ".csv":
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, CSV_FIELDS)
+            writer.writeheader()
+            for entry in result["templates"]:
+                base = entry["variants"][BASELINE]
+                for label, item in entry["variants"].items():
+                    if label == BASELINE:
+                        continue
+                    writer.writerow(
+                        {
+                            "index": entry["index"],
+                            "embedding": label,
+                            "template": entry["template"],
+                            "canon_template": item["smarts"],
+                            "substrate": entry["substrate"],
+                            "input_median_s": base["median_s"],
+                            "median_s": item["median_s"],
+                            "speedup": item.get("speedup"),
+                            "ci_low": item.get("ci_low"),
+                            "ci_high": item.get("ci_high"),
+                        }
+                    )
+    else:
+        raise ValueError("report path must end in .json or .csv")
@@ -0,0 +1,206 @@
+def _ring_label(digit):
+    return str(digit) if digit < 10 else "%" + str(digit)
+
+
+def graph_to_smarts(num_atoms, edges, atom="C", bond=""):
+    """
+    Writes a connected graph as a SMARTS pattern.
+
+    Atoms are written depth first from atom 0, branches in parentheses and the remaining
+    edges as ring closures, reusing the lowest free ring closure digit.
+
+    Args:
+        num_atoms (int): Number of atoms.
+        edges (list): (i, j) pairs of atom indices.
+        atom (str or list, optional): The atom token, or one token per atom. Defaults to "C".
+        bond (str, optional): The bond token. Defaults to "" (single or aromatic).
+
+    Returns:
+        str: The SMARTS pattern.
+    """
+    if num_atoms < 1:
+        raise ValueError("a graph needs at least one atom")
+    tokens = [atom] * num_atoms if type(atom) == str else list(atom)
+    adj = [[] for _ in range(num_atoms)]
+    for i, j in edges:
+        adj[i].append(j)
+        adj[j].append(i)
+
+    # depth first spanning tree; every other edge closes a ring
+    order = []
+    parent = {0: None}
+    children = [[] for _ in range(num_atoms)]
+    stack = [0]
+    while stack:
+        i = stack.pop()
+        if i in order:
+            continue
+        order.append(i)
+        if parent[i] is not None:
+            children[parent[i]].append(i)
+        for j in reversed(sorted(adj[i])):
+            if j not in order:
+                parent[j] = i
+                stack.append(j)
+    if len(order) != num_atoms:
+        raise ValueError("the graph is not connected")
+
+    tree = set()
+    for i in range(num_atoms):
+        for j in children[i]:
+            tree.add((i, j))
+            tree.add((j, i))
+    rank = {i: r for r, i in enumerate(order)}
+
+    free = []
+    next_digit = 1
+    open_rings = {}
+
+    def write(i):
+        nonlocal next_digit
+        out = tokens[i]
+        for j in sorted(adj[i], key=lambda j: rank[j]):
+            if (i, j) in tree:
+                continue
+            if rank[j] < rank[i]:
+                digit = open_rings.pop((j, i))
+                free.append(digit)
+                free.sort()
+                out = out + bond + _ring_label(digit)
+            else:
+                if len(free) > 0:
+                    digit = free.pop(0)
+                else:
+                    digit = next_digit
+                    next_digit = next_digit + 1
+                open_rings[(i, j)] = digit
+                out = out + _ring_label(digit)
+        for k, j in enumerate(children[i]):
+            if k < len(children[i]) - 1:
+                out = out + "(" + bond + write(j) + ")"
+            else:
+                out = out + bond + write(j)
+        return out
+
+    return write(0)
+
+
+def chain(n, atom="C"):
+    """
+    A linear chain of n atoms.
+    """
+    return graph_to_smarts(n, [(i, i + 1) for i in range(n - 1)], atom)
+
+
+def ring(n, atom="C"):
+    """
+    A single ring of n atoms.
+    """
+    if n < 3:
+        raise ValueError("a ring needs at least 3 atoms")
+    return graph_to_smarts(n, [(i, (i + 1) % n) for i in range(n)], atom)
+
+
+def wildcard_ring(n):
+    """
+    A single ring of n wildcard atoms, the worst case for ties between start atoms.
+    """
+    return ring(n, "*")
+
+
+def ladder(n, ring_size=6, atom="C"):
+    """
+    A ladder of n rings fused in a line, each sharing one bond with the next (acenes for ring_size=6).
+    """
+    if ring_size < 4 or ring_size % 2 != 0:
+        raise ValueError("ring_size must be an even number of at least 4")
+    step = ring_size // 2 - 1
+    rail = n * step + 1
+    edges = []
+    for r in range(2):
+        edges.extend((r * rail + i, r * rail + i + 1) for i in range(rail - 1))
+    edges.extend((i, rail + i) for i in range(0, rail, step))
+    return graph_to_smarts(2 * rail, edges, atom)
+
+
+def star(n, arms=4, atom="C"):
+    """
+    A center atom with `arms` chains of n atoms each.
+    """
+    edges = []
+    for a in range(arms):
+        first = 1 + a * n
+        edges.append((0, first))
+        edges.extend((first + i, first + i + 1) for i in range(n - 1))
+    return graph_to_smarts(1 + arms * n, edges, atom)
+
+
+def dendrimer(n, branching=2, atom="C"):
+    """
+    A tree of depth n in which every non-leaf atom has `branching` children.
+    """
+    edges = []
+    level = [0]
+    num_atoms = 1
+    for _ in range(n):
+        next_level = []
+        for i in level:
+            for _ in range(branching):
+                edges.append((i, num_atoms))
+                next_level.append(num_atoms)
+                num_atoms = num_atoms + 1
+        level = next_level
+    return graph_to_smarts(num_atoms, edges, atom)
+
+
+def nested_recursive(n, atom="C"):
+    """
+    A two-atom pattern whose first atom holds recursive SMARTS nested n levels deep.
+    """
+    token = "[N]"
+    for _ in range(n):
+        token = "[" + atom + ";$(" + atom + token + ")]"
+    return token + atom
+
+
+FAMILIES = {
+    "chain": chain,
+    "ring": ring,
+    "ladder": ladder,
+    "star": star,
+    "dendrimer": dendrimer,
+    "wildcard_ring": wildcard_ring,
+    "recursive": nested_recursive,
+}
+
+# sizes used by the scaling benchmark when none are given
+DEFAULT_SIZES = {
+    "chain": [2, 4, 8, 16, 32, 64],
+    "ring": [3, 4, 6, 8, 12, 16, 24, 32],
+    "ladder": [1, 2, 3, 4, 5, 6],
+    "star": [1, 2, 3, 4, 6, 8],
+    "dendrimer": [1, 2, 3, 4],
+    "wildcard_ring": [3, 4, 6, 8, 12, 16],
+    "recursive": [1, 2, 4, 8, 12, 16],
+}
+
+
+def generate(family, n, **kwargs):
+    """
+    Generates a member of a synthetic SMARTS family.
+
+    Args:
+        family (str): One of FAMILIES: "chain", "ring", "ladder", "star", "dendrimer",
+            "wildcard_ring" or "recursive".
+        n (int): The size parameter: atoms for chains and rings, fused rings for ladders, arm
+            length for stars, depth for dendrimers and nesting depth for recursive SMARTS.
+        **kwargs: Other parameters of the family function, e.g. atom="[C;R]" or branching=3.
+
+    Returns:
+        str: The SMARTS pattern.
+    """
+    if family not in FAMILIES:
+        raise ValueError(
+            "unknown family %r, expected one of %s" % (family, ", ".join(FAMILIES))
+        )
+    return FAMILIES[family](n, **kwargs)
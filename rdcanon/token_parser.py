@@ -292,482 +292,6 @@ ATOMS = [
 ]
 
 
-class SMARTSTransformer2(Transformer):
-    def start(self, args):
-        results = []
-
-        stack = deque()
-
-        stack.append(args[0])
-
-        seq = []
-        while len(stack) > 0:
-            cur = stack.popleft()
-            if cur[0] == "deg":
-                seq.append(cur)
-                continue
-            if cur[0] == "!":
-                seq.append(cur[0])
-                continue
-            if cur in [
-                "rec_start",
-                "brack_start",
-                "rec_end",
-                "brack_end",
-                "&",
-                ",",
-                ";",
-            ]:
-                seq.append(cur)
-                continue
-            if cur[0] == "open" or cur[0] == "close":
-                seq.append(cur[0])
-            if cur[0] == "component":
-                seq.append(cur[1])
-                continue
-            if cur[0] == "bond":
-                seq.append(cur[1])
-                continue
-            if cur[0] == "iso":
-                seq.append(cur)
-                continue
-            if cur[0] == "nested":
-                stack.appendleft("rec_start")
-            if cur[0] == "bracketed":
-                stack.appendleft("brack_start")
-            for r in cur[1]:
-                stack.appendleft(r)
-            if cur[0] == "bracketed":
-                stack.appendleft("brack_end")
-            if cur[0] == "nested":
-                stack.appendleft("rec_end")
-
-        tok = ""
-        for r in reversed(seq):
-            if r[0] == "iso":
-                tok = tok + r[1][0] + "*"
-                continue
-            if len(r) == 2:
-                if r[0] == "deg":
-                    tok = tok + str(r[1])
-                    continue
-            if r == "brack_start":
-                tok = tok + "["
-                continue
-            if r == "brack_end":
-                tok = tok + "]"
-                continue
-            if r == "rec_start":
-                tok = tok + "$("
-                continue
-            if r == "rec_end":
-                tok = tok + ")"
-                continue
-            if r == "open":
-                tok = tok + "("
-                continue
-            if r == "close":
-                tok = tok + ")"
-                continue
-            if r in ["=", "-", "#", "~", ":", ".", "@", "/", "\\", "!", "&", ",", ";"]:
-                tok = tok + r
-                continue
-            else:
-                for k in r:
-                    if k[0] == "!":
-                        tok = tok + k[0]
-                    if k[0] == "atom":
-                        for r2 in k[1]:
-                            tok = tok + r2[1]
-                    else:
-                        for r2 in k[1]:
-                            tok = tok + r2
-
-        # if tok[0] == "[" and tok[-1] == "]":
-        # tok = tok[1:-1]
-
-        tok = tok[2:-1]
-
-        # print("kek", tok)
-        if tok[0] == "$":
-            return tok, []
-
-        # print(tok)
-
-        atoms_in_seq = []
-        bonds_in_seq = []
-        cur_atom = ""
-        cur_bond = ""
-        reading = False
-        atom_map = False
-        rec = False
-        nn = 0
-        # print(seq)
-        for r in reversed(seq):
-            if nn == 0:
-                nn = nn + 1
-                continue
-            # print("a", r, cur_atom, rec)
-            if atom_map and r != "brack_end":
-                cur_atom = cur_atom + r[1]
-                atom_map = False
-                continue
-            if r == "rec_start":
-                cur_atom = cur_atom + "$("
-                # reading = True
-                rec = True
-                continue
-            if r == "brack_start":
-                if not rec:
-                    if cur_bond != "":
-                        bonds_in_seq.append(cur_bond)
-                    cur_bond = ""
-                    reading = True
-                    continue
-                else:
-                    cur_atom = cur_atom + "["
-                    continue
-
-            if r == "brack_end":
-                if not rec:
-                    if atom_map:
-                        atom_map = False
-                    reading = False
-                    if cur_atom != "":
-                        atoms_in_seq.append(cur_atom)
-                    cur_atom = ""
-                    continue
-                else:
-                    cur_atom = cur_atom + "]"
-                    continue
-
-            if r == "rec_end":
-                cur_atom = cur_atom + ")"
-                # reading = False
-                rec = False
-                continue
-
-            # print(reading)
-            bond_symbs = ["-", "=", "#", "~", ":", ".", "@", "/", "\\"]
-            op_symbs = ["!", "&", ",", ";"]
-
-            if reading == False:
-                # print("b", r)
-                if r in op_symbs or r in bond_symbs:
-                    cur_bond = cur_bond + r
-                    continue
-                if type(r[0]) == tuple and len(r) == 1:
-                    if r[0][1][0][1][0] in bond_symbs:
-                        cur_bond = cur_bond + r[0][1][0][1][0]
-                        continue
-                    cur_atom = cur_atom + r[0][1][0][1][0]
-                    if cur_bond != "":
-                        bonds_in_seq.append(cur_bond)
-                        cur_bond = ""
-                    atoms_in_seq.append(cur_atom)
-                    cur_atom = ""
-                    continue
-                elif type(r[0]) == tuple and len(r) == 2:
-                    cur_bond = cur_bond + r[0][1][0]
-                    cur_atom = cur_atom + r[1][1][0][1][0]
-
-                    bonds_in_seq.append(cur_bond)
-                    cur_bond = ""
-
-                    atoms_in_seq.append(cur_atom)
-                    cur_atom = ""
-                    continue
-
-                else:
-                    if r == "open":
-                        continue
-                    if r == "close":
-                        continue
-                    if r[0] == "deg" or r[0] == "bond":
-                        cur_bond = cur_bond + r[1][0]
-                        continue
-            # # if reading:
-            # print(r)
-            # cur_atom = cur_atom + r[0]
-
-            if (
-                r == ";"
-                or r == ":"
-                or r == ","
-                or r == "&"
-                or r == "!"
-                or r == "open"
-                or r == "close"
-                or r in bond_symbs
-            ):
-                if r == ":" and not rec:
-                    atom_map = True
-                if rec and r == "open":
-                    cur_atom = cur_atom + "("
-                    continue
-                if rec and r == "close":
-                    cur_atom = cur_atom + ")"
-                    continue
-                if rec and r in bond_symbs:
-                    cur_atom = cur_atom + r
-                    continue
-                if not rec:
-                    cur_atom = cur_atom + r
-                    continue
-
-            if r[0] == "deg":
-                cur_atom = cur_atom + r[1]
-                continue
-            # print("c",r)
-
-            if rec and r in op_symbs:
-                cur_atom = cur_atom + r
-                continue
-
-            result = {
-                "!": -1,
-                "D": -1,
-                "H": -1,
-                "h": -1,
-                "R": -1,
-                "r": -1,
-                "v": -1,
-                "X": -1,
-                "x": -1,
-                "-": -1,
-                "+": -1,
-                "#": -1,
-                "*": -1,
-                "a": -1,
-                "A": -1,
-                "@": -1,
-                "@@": -1,
-                "bond": -1,
-                "rec": -1,
-                "C": -1,
-                "N": -1,
-                "O": -1,
-                "o": -1,
-                "c": -1,
-                "n": -1,
-                "S": -1,
-                "s": -1,
-                "P": -1,
-                "p": -1,
-                "B": -1,
-                "b": -1,
-                "F": -1,
-                "I": -1,
-                "Cl": -1,
-                "Br": -1,
-                "Se": -1,
-                "Si": -1,
-                "Sn": -1,
-                "As": -1,
-                "Te": -1,
-                "Pb": -1,
-                "Zn": -1,
-                "Cu": -1,
-                "Fe": -1,
-                "Mg": -1,
-                "Na": -1,
-                "Ca": -1,
-                "Al": -1,
-                "K": -1,
-                "Li": -1,
-                "Mn": -1,
-                "Zr": -1,
-                "Co": -1,
-                "Ni": -1,
-                "Cd": -1,
-                "Ag": -1,
-                "Au": -1,
-                "Pt": -1,
-                "Pd": -1,
-                "Ru": -1,
-                "Rh": -1,
-                "Ir": -1,
-                "Ti": -1,
-                "V": -1,
-                "W": -1,
-                "Mo": -1,
-                "Hg": -1,
-                "Tl": -1,
-                "Bi": -1,
-                "Ba": -1,
-                "Sr": -1,
-                "Cs": -1,
-                "Rb": -1,
-                "Be": -1,
-                "se": -1,
-                "te": -1,
-                "La": -1,
-                "Er": -1,
-                "Tm": -1,
-                "Yb": -1,
-                "Lu": -1,
-                "Hf": -1,
-                "Ta": -1,
-                "W" : -1,
-                "Re": -1,
-                "Co": -1,
-                "Os": -1,
-                "Re": -1,
-                "Ga": -1,
-                "Ge": -1,
-                "Y": -1,
-                "Ce": -1,
-                "Pr": -1,
-                "Nd": -1,
-                "Sm": -1,
-                "Eu": -1,
-                "Gd": -1,
-                "Tb": -1,
-                "Dy": -1,
-                "Ho": -1,
-                "Th": -1,
-                "Pa": -1,
-                "Mo": -1,
-                "U": -1,
-                "Tc": -1,
-                "At": -1,
-                "Am": -1,
-                "Bk": -1,
-                "Cf": -1,
-                "Cm": -1,
-                "He": -1,
-                "Ne": -1,
-                "Pm": -1,
-                "Pu": -1,
-                "Xe": -1,
-                "iso": -1,
-            }
-
-            if r[0] == "iso":
-                result["iso"] = r[1][0]
-                results.append(result)
-                cur_atom = cur_atom + r[1][0] + "*"
-                continue
-
-            if len(r) == 2:
-                result["bond"] = str(r[0][1])
-                atms = r[1][1]
-            else:
-                atms = r[0][1]
-
-            if rec:
-                if atms[0][1][0] in bond_symbs:
-                    if len(atms) == 1:
-                        cur_atom = cur_atom + atms[0][1][0]
-                    else:
-                        cur_atom = cur_atom + atms[0][1][0]
-                        cur_atom = cur_atom + atms[1][1][0]
-                    continue
-
-            deg_found = False
-            prev_prim = False
-            for rr in atms:
-
-                if rr[0] == "!":
-                    result["!"] = True
-                    continue
-                if prev_prim and rr[0] != "deg":
-                    if k == "R" or k == "h" or k == "r" or k == "x":
-                        result[k] = "default"
-                    else:
-                        result[k] = 1
-                    deg_found = True
-                if rr[0] == "prim":
-                    k = rr[1]
-                    prev_prim = True
-                    deg_found = False
-                elif rr[0] == "deg":
-                    deg_found = True
-                    if result[k] == -1:
-                        result[k] = int(rr[1])
-                    else:
-                        result[k] = result[k] + int(rr[1])
-                    prev_prim = False
-            if not deg_found:
-                if result[k] == -1:
-                    if k == "R" or k == "h" or k == "r" or k == "x":
-                        result[k] = "default"
-                    else:
-                        result[k] = 1
-                else:
-                    result[k] = result[k] + 1
-            # print(k, result[k])
-
-            cur_atom = cur_atom + parse_label(result)
-            # print(cur_atom)
-
-            results.append(result)
-        return atoms_in_seq, bonds_in_seq
-
-    def isotope(self, args):
-        return "iso", args
-
-    def not1(self, args):
-        return "!", args[0]  # Returning '!' to indicate its presence
-
-    def not2(self, args):
-        return "!", args  # Returning '!' to indicate its presence
-
-    def symbol(self, args):
-        return "prim", args[0]
-
-    def symbol_single(self, args):
-        return "prim", args[0]
-
-    def degree1(self, args):
-        return "deg", args[0]
-
-    def nested_rule(self, args):
-        return "nested", args
-
-    def item(self, args):
-        return "item", args
-
-    def component(self, args):
-        return "component", args
-
-    def atom(self, args):
-        return "atom", args
-
-    def token(self, args):
-        return "token", args
-
-    def operator_symbol(self, args):
-        return "op", args[0]
-
-    def bond_symbol(self, args):
-        return "bond", args[0]
-
-    def open(self, args):
-        return "open", args
-
-    def close(self, args):
-        return "close", args
-
-    def bracketed_rule(self, args):
-        return "bracketed", args
-
-    def BOND_PRIMITIVE(self, args):
-        return args
-
-    def PRIMITIVE(self, args):
-        return args
-
-    def DIGIT(self, args):
-        return args
-
-    def NOT(self, args):
-        return args
-
-    def OPERATOR_PRIMITIVE(self, args):
-        return args
-
-
 class SMARTSTransformer(Transformer):
     def start(self, args):
         results = []
@@ -1598,17 +1122,132 @@ DIGIT: "0" | "1" | "2" | "3" | "4" | "5" | "6" | "7" | "8" | "9"
 parser = Lark(grammar, parser="lalr")
 transformer = SMARTSTransformer()
 
-transformer2 = SMARTSTransformer2()
+# atoms written without brackets; two letter symbols come first
+organic_atoms = ["Cl", "Br", "B", "C", "N", "O", "S", "P", "F", "I"]
+organic_atoms = organic_atoms + ["b", "c", "n", "o", "s", "p", "*", "a", "A"]
 
+smarts_bond_chars = "-=#~:/\\@!&,;"
 
-def parse_smarts_total(in_smarts, num_atoms):
-    if in_smarts[0:2] == "[$" and num_atoms == 1:
-        parsed = parser.parse(in_smarts)
-    else:
-        parsed = parser.parse("[$(" + in_smarts + ")]")
 
-    atoms_seq, bonds_seq = transformer2.transform(parsed)
-    return atoms_seq, bonds_seq
+def scan_bracket(smarts, start):
+    """
+    Finds the end of a bracketed atom token and its tetrahedral mark.
+
+    Brackets and parentheses of recursive SMARTS inside the token are skipped, so a mark
+    inside $(...) does not count as the mark of the atom. @TH1 and @TH2 are read as @ and @@;
+    the other chirality classes are not supported.
+
+    Args:
+        smarts (str): The SMARTS pattern.
+        start (int): The index of the opening bracket.
+
+    Returns:
+        tuple: The index after the closing bracket, and "@@", "@" or "".
+
+    Raises:
+        ValueError: If the bracket is not closed, or the atom has a non-tetrahedral chirality class.
+    """
+    depth = 0
+    nested = 0
+    mark = ""
+    i = start
+    n = len(smarts)
+    while i < n:
+        c = smarts[i]
+        if c == "[":
+            depth = depth + 1
+        elif c == "]":
+            depth = depth - 1
+            if depth == 0:
+                return i + 1, mark
+        elif c == "(":
+            nested = nested + 1
+        elif c == ")":
+            nested = nested - 1
+        elif c == "@" and depth == 1 and nested == 0:
+            chiral_class = smarts[i + 1 : i + 3]
+            if smarts[i + 1] == "@":
+                mark = "@@"
+                i = i + 1
+            elif chiral_class == "TH":
+                j = i + 3
+                while j < n and smarts[j].isdigit():
+                    j = j + 1
+                if smarts[i + 3 : j] == "1":
+                    mark = "@"
+                elif smarts[i + 3 : j] == "2":
+                    mark = "@@"
+                else:
+                    raise ValueError(
+                        "Invalid tetrahedral chirality in SMARTS: " + smarts
+                    )
+                i = j - 1
+            elif chiral_class in ("AL", "SP", "TB", "OH"):
+                raise ValueError(
+                    "Only tetrahedral chirality is supported, got @"
+                    + chiral_class
+                    + " in SMARTS: "
+                    + smarts
+                )
+            elif mark == "":
+                mark = "@"
+        i = i + 1
+    raise ValueError("Unclosed bracket in SMARTS: " + smarts)
+
+
+def scan_smarts(smarts):
+    """
+    Splits a SMARTS pattern into its atom and bond tokens in a single pass.
+
+    Args:
+        smarts (str): The SMARTS pattern.
+
+    Returns:
+        tuple: The (start, end) spans of the atom tokens, in the order RDKit numbers the atoms;
+        the tetrahedral mark of each atom, "@@", "@" or ""; and the (start, end) spans of the
+        bond tokens, including the bonds of ring closures. Implicit bonds have no span.
+    """
+    atoms = []
+    marks = []
+    bonds = []
+    bond_start = -1
+    i = 0
+    n = len(smarts)
+    while i < n:
+        c = smarts[i]
+        if c in smarts_bond_chars:
+            if bond_start == -1:
+                bond_start = i
+            i = i + 1
+            continue
+        if c == "(" or c == ")" or c == "." or c == " ":
+            i = i + 1
+            continue
+
+        if bond_start != -1:
+            bonds.append((bond_start, i))
+            bond_start = -1
+
+        if c.isdigit():
+            i = i + 1
+        elif c == "%":
+            i = i + 3
+        elif c == "[":
+            end, mark = scan_bracket(smarts, i)
+            atoms.append((i, end))
+            marks.append(mark)
+            i = end
+        elif smarts[i : i + 2] in organic_atoms:
+            atoms.append((i, i + 2))
+            marks.append("")
+            i = i + 2
+        elif c in organic_atoms:
+            atoms.append((i, i + 1))
+            marks.append("")
+            i = i + 1
+        else:
+            raise ValueError("Unexpected character %r in SMARTS: %s" % (c, smarts))
+    return atoms, marks, bonds
 
 
 def recursive_compare(list1, list2):
@@ -1687,6 +1326,22 @@ def moveToFront(lst, pos):
     return lst
 
 
+def get_prims(embedding):
+    if embedding == "askcos":
+        return prims1
+    elif embedding == "pubchem":
+        return prims2
+    elif embedding == "drugbank":
+        return prims3
+    elif embedding == "npatlas":
+        return prims4
+    elif type(embedding) == dict:
+        return embedding
+    raise ValueError(
+        "embedding must be 'askcos', 'pubchem', 'drugbank', 'npatlas', or a dictionary of primitives"
+    )
+
+
 def order_token_canon(
     in_smarts_token="[!a@H&D2;#7,#6;H;a-3;#7,!O,!#8&!O;#7,!O,!#8&!O++;*;H0]",
     atom_map=None,
@@ -1694,21 +1349,7 @@ def order_token_canon(
     min_num_explicit_hs=None,
     opt_num_explicit_hs=None,
 ):
-    if embedding == "askcos":
-        prims = prims1
-    elif embedding == "pubchem":
-        prims = prims2
-    elif embedding == "drugbank":
-        prims = prims3
-    elif embedding == "npatlas":
-        prims = prims4
-    else:
-        if type(embedding) == dict:
-            prims = embedding
-        else:
-            raise ValueError(
-                "embedding must be 'askcos', 'pubchem', 'drugbank', 'npatlas', or a dictionary of primitives"
-            )
+    prims = get_prims(embedding)
 
     # print(in_smarts_token)
     sanitized, group_smarts = sanitize_smarts_token(in_smarts_token)
@@ -1856,6 +1497,82 @@ def order_token_canon(
     return "[" + dg.nodes[0]["text"] + "]", weights_in_order[-1], dg
 
 
+# canonical forms of unmapped atom tokens, keyed by (embedding name, token)
+token_cache = {}
+token_cache_stats = {"hits": 0, "misses": 0}
+
+# read-only SharedTables of cache entries published by another process,
+# keyed by shared_token_key(embedding, token)
+shared_token_tables = []
+
+
+def shared_token_key(embedding, in_smarts_token):
+    return embedding + "\t" + in_smarts_token
+
+
+def canon_token(
+    in_smarts_token,
+    atom_map=None,
+    embedding="drugbank",
+    min_num_explicit_hs=None,
+    opt_num_explicit_hs=None,
+):
+    """
+    Canonicalizes a single atom token, reusing earlier results for named embeddings.
+
+    Tokens are cached without their atom map, which is appended to the cached result, so
+    "[C;H1:3]" and "[C;H1:7]" share one entry. Embeddings given as dictionaries are not cached.
+
+    Args:
+        in_smarts_token (str): The bracketed atom token, without an atom map.
+        atom_map (str, optional): The atom map to append, e.g. ":3". Defaults to None.
+        embedding (str or dict, optional): The query primitive frequency dictionary to use. Defaults to "drugbank".
+
+    Returns:
+        tuple: The canonical token and its score.
+    """
+    if (
+        type(embedding) != str
+        or min_num_explicit_hs != None
+        or opt_num_explicit_hs != None
+    ):
+        sm, sc, _ = order_token_canon(
+            in_smarts_token,
+            atom_map,
+            embedding,
+            min_num_explicit_hs,
+            opt_num_explicit_hs,
+        )
+        return sm, sc
+
+    key = (embedding, in_smarts_token)
+    hit = token_cache.get(key)
+    if hit is None:
+        # shared entries are looked up in place rather than copied into this process
+        for table in shared_token_tables:
+            hit = table.get(shared_token_key(embedding, in_smarts_token))
+            if hit is not None:
+                break
+    if hit is None:
+        token_cache_stats["misses"] = token_cache_stats["misses"] + 1
+        sm, sc, _ = order_token_canon(in_smarts_token, None, embedding)
+        hit = (sm, sc)
+        token_cache[key] = hit
+    else:
+        token_cache_stats["hits"] = token_cache_stats["hits"] + 1
+
+    sm, sc = hit
+    if atom_map != None and len(atom_map) > 0:
+        sm = sm[:-1] + atom_map + "]"
+    return sm, sc
+
+
+def clear_token_cache():
+    token_cache.clear()
+    token_cache_stats["hits"] = 0
+    token_cache_stats["misses"] = 0
+
+
 def generate(
     test_smarts="[!a@H&D2;#7,#6;H;a-3;#7,!O,!#8&!O;#7,!O,!#8&!O++;*;H0]",
     title="figures/heatmaps/network.png",
@@ -1,4 +1,10 @@
-from rdcanon.main import canon_smarts, canon_reaction_smarts, random_smarts
+from rdcanon.main import (
+    canon_smarts,
+    canon_reaction_smarts,
+    canon_query_mol,
+    canon_query_reaction,
+    random_smarts,
+)
 from rdkit import Chem
 from rdkit.Chem import AllChem
 import timeit
@@ -49,9 +55,8 @@ def compare_reaction_outputs(reactant_objs_in, template_list, canon_template_lis
 
 
 def compare_products(reaction_template, reactants_in):
-    canon_rxn1 = canon_reaction_smarts(reaction_template, True, "drugbank", True)
     rxn = AllChem.ReactionFromSmarts(reaction_template)
-    rxn_canon = AllChem.ReactionFromSmarts(canon_rxn1)
+    rxn_canon = canon_query_reaction(reaction_template, True, "drugbank", True)
 
     reactants = Chem.MolFromSmiles(reactants_in)
     p = rxn.RunReactants((reactants,))
@@ -144,7 +149,7 @@ def run_against_library(smarts_library, target_library, n, emb="drugbank"):
     noncanon_output = find_n_matches(noncanon_template_obj, mols, n)
 
     canon_template_obj = [
-        Chem.MolFromSmarts(canon_smarts(template_smarts, mapping=True, embedding=emb))
+        canon_query_mol(template_smarts, mapping=True, embedding=emb)
         for template_smarts in smarts_library
     ]
 
@@ -224,9 +229,7 @@ def time_compare_substruct_match(
     embeds = ["rdchiral"]
     for idx, emb in enumerate(embeddings):
         canon_template_obj = [
-            Chem.MolFromSmarts(
-                canon_smarts(template_smarts, mapping=True, embedding=emb)
-            )
+            canon_query_mol(template_smarts, mapping=True, embedding=emb)
             for template_smarts in template_smarts_dataset
         ]
 
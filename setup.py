@@ -1,8 +1,14 @@
+import re
 from setuptools import setup, find_packages
 
+# the version is kept only in rdcanon/version.py, which cannot be imported before the
+# dependencies are installed
+with open('rdcanon/version.py') as f:
+    version = re.search(r'__version__ = "(.*)"', f.read()).group(1)
+
 setup(
     name='rdcanon',
-    version='0.1',
+    version=version,
     packages=find_packages(),
     description='SMARTS Sanitization',
     long_description=open('README.md').read(),
@@ -21,4 +27,10 @@ setup(
         'pandas',
         'openpyxl'
     ],
+    entry_points={
+        'console_scripts': [
+            'rdcanon=rdcanon.cli:main',
+            'rdcanon-server=rdcanon.server:main',
+        ],
+    },
 )
\ No newline at end of file